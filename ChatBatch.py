@@ -0,0 +1,324 @@
+import operator
+import random
+import struct
+
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from ChatOutputs import getFramingFunction
+
+# NumPy is optional, without it blocks are drawn with the random module
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Generates chat a block of messages at a time instead of one by one, for high
+# rate runs (batchGeneration). Every decision for a block is drawn up front:
+# when each message is due, who says it and which output of its chat state it
+# is, from the same scheduler, alias tables and population a message by message
+# run uses. The block's bytes are then joined from pre-encoded names and
+# messages in one go, already framed for the output, and the run takes the
+# messages that are due from it.
+#
+# Blocks always hold BATCH_BLOCK_MESSAGES messages however the run is timed, so
+# a seeded run still says the same things every time. It isn't the same chat
+# as a message by message run with the same seed, and NumPy draws different
+# numbers than the random module does.
+
+BATCH_BLOCK_MESSAGES = 4096
+
+packLength = struct.Struct('>I').pack
+
+######## Drawing decisions ########
+
+# Draws with the random module, one Python call per number
+class PythonDecisions:
+    def drawIntervals(self, scheduler, count):
+        if scheduler.mode == "Fixed":
+            return [1.0 / scheduler.messagesPerSecond] * count
+        nextInterval = scheduler.nextInterval
+        return [nextInterval() for i in range(count)]
+
+    # Seconds into the run each of the scheduler's next count messages is due,
+    # moving the scheduler past them
+    def drawTimes(self, scheduler, count):
+        # Added up one at a time like RateScheduler.advance()
+        baseTimes = list(accumulate(self.drawIntervals(scheduler, count), initial=scheduler.baseDeadline))
+        scheduler.baseDeadline = baseTimes.pop()
+        if scheduler.rateCurve is None:
+            return baseTimes
+        return list(map(scheduler.rateCurve.realTime, baseTimes))
+
+    def drawChatters(self, population, count):
+        return [population.pickChatter() for i in range(count)]
+
+    def drawOutputs(self, sampler, count):
+        sample = sampler.sample
+        rand = random.random
+        return [sample(rand()) for i in range(count)]
+
+# Draws a whole block with each NumPy call. The generator is seeded from the
+# random module, so a seeded run draws the same numbers every time.
+class NumpyDecisions:
+    def __init__(self):
+        self.generator = numpy.random.default_rng(random.getrandbits(64))
+        # AliasSampler tables as arrays, by sampler
+        self.aliasTables = {}
+
+    def drawIntervals(self, scheduler, count):
+        if scheduler.mode == "Fixed":
+            return numpy.full(count, 1.0 / scheduler.messagesPerSecond)
+        elif scheduler.mode == "Poisson":
+            return self.generator.exponential(1.0 / scheduler.messagesPerSecond, count)
+        return self.generator.uniform(scheduler.minInterval, scheduler.maxInterval, count)
+
+    def drawTimes(self, scheduler, count):
+        sums = numpy.cumsum(self.drawIntervals(scheduler, count))
+        baseTimes = numpy.empty(count)
+        baseTimes[0] = 0.0
+        baseTimes[1:] = sums[:-1]
+        baseTimes += scheduler.baseDeadline
+        scheduler.baseDeadline += float(sums[-1])
+
+        rateCurve = scheduler.rateCurve
+        if rateCurve is None:
+            return baseTimes.tolist()
+        # RateCurve.realTime() for every message at once
+        curveTimes = numpy.frombuffer(rateCurve.times, dtype=numpy.float64)
+        curveBaseTimes = numpy.frombuffer(rateCurve.baseTimes, dtype=numpy.float64)
+        curveScales = numpy.frombuffer(rateCurve.scales, dtype=numpy.float64)
+        segments = numpy.maximum(numpy.searchsorted(curveBaseTimes, baseTimes, side='right') - 1, 0)
+        scales = curveScales[segments]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            times = curveTimes[segments] + (baseTimes - curveBaseTimes[segments]) / scales
+        times[scales <= 0] = float('inf')
+        return times.tolist()
+
+    def sampleAlias(self, sampler, count):
+        table = self.aliasTables.get(sampler)
+        if table is None:
+            table = self.aliasTables[sampler] = (numpy.asarray(sampler.probabilities, dtype=numpy.float64),
+                numpy.asarray(sampler.aliases, dtype=numpy.int64))
+        probabilities, aliases = table
+        # Same as AliasSampler.sample()
+        scaled = self.generator.random(count) * sampler.count
+        columns = numpy.minimum(scaled.astype(numpy.int64), sampler.count - 1)
+        return numpy.where(scaled - columns < probabilities[columns], columns, aliases[columns]).tolist()
+
+    def drawChatters(self, population, count):
+        if population.weights is None:
+            return self.generator.integers(0, len(population), count).tolist()
+        return self.sampleAlias(population.getSampler(), count)
+
+    def drawOutputs(self, sampler, count):
+        return self.sampleAlias(sampler, count)
+
+######## Blocks ########
+
+class ChatBlock:
+    __slots__ = ['times', 'data', 'ends', 'outputStrings', 'position']
+    def __init__(self, times, data, ends, outputStrings):
+        # Seconds into the run each message is due, in order
+        self.times = times
+        # Every message framed one after another, and where each one ends in data
+        self.data = data
+        self.ends = ends
+        self.outputStrings = outputStrings
+        # Messages before this have been taken
+        self.position = 0
+
+# Messages taken from a block. ends are where each message ends in data,
+# counted from dataOffset.
+class ChatBatch:
+    __slots__ = ['data', 'count', 'times', 'ends', 'dataOffset', 'outputStrings']
+    def __init__(self, data, count, times, ends, dataOffset, outputStrings):
+        self.data = data
+        self.count = count
+        self.times = times
+        self.ends = ends
+        self.dataOffset = dataOffset
+        self.outputStrings = outputStrings
+
+# Takes over timing the messages from scheduler, which must have been started.
+# framing None makes no bytes, keepMessages also makes every message's text.
+# In worker processes a PerChatter scheduler's chatter k is population chatter
+# k*workerCount + workerIndex.
+class ChatBatchGenerator:
+    def __init__(self, timeline, scheduler, framing, keepMessages=False, workerIndex=0, workerCount=1):
+        self.timeline = timeline
+        self.scheduler = scheduler
+        self.population = timeline.population
+        self.framing = framing
+        self.keepMessages = keepMessages
+        self.workerIndex = workerIndex
+        self.workerCount = workerCount
+        self.decisions = NumpyDecisions() if numpy is not None else PythonDecisions()
+
+        # Every state's outputs in one table, so a message is one index into it
+        self.stateOffsets = []
+        self.messages = []
+        for compiledState in timeline.states:
+            self.stateOffsets.append(len(self.messages))
+            self.messages.extend(compiledState.messages)
+        # Templates are None here and rendered for each message
+        self.messageStrings = [message if message.__class__ is str else None for message in self.messages]
+        self.hasTemplates = None in self.messageStrings
+
+        self.suffix = b''
+        if framing is not None:
+            self.prefixBytes = self.population.getEncodedPrefixes()
+            if framing != "Length":
+                self.suffix = getFramingFunction(framing)(b'')
+            self.messageBytes = [None if message is None else message.encode('utf-8') + self.suffix for message in self.messageStrings]
+
+        self.block = None
+        # What the scheduler looked like after the last message taken, see getBlock()
+        self.expectedStartTime = None
+        self.expectedDeadline = None
+        self.expectedRateCurve = None
+        self.updateDeadline()
+
+    def drawPerChatter(self, count):
+        scheduler = self.scheduler
+        advance = scheduler.advance
+        startTime = scheduler.startTime
+        messageCount = scheduler.messageCount
+        times = []
+        chatters = []
+        for i in range(count):
+            times.append(advance() - startTime)
+            chatters.append(scheduler.lastChatter)
+        # Counted as they are taken
+        scheduler.messageCount = messageCount
+        if self.workerCount > 1:
+            workerCount = self.workerCount
+            workerIndex = self.workerIndex
+            chatters = [chatter*workerCount + workerIndex for chatter in chatters]
+        return times, chatters
+
+    # Index into messages of what each message says, following the states and fades at times
+    def drawOutputs(self, times):
+        timeline = self.timeline
+        stateOffsets = self.stateOffsets
+        rand = random.random
+        outputs = []
+        position = 0
+        count = len(times)
+        while position < count:
+            compiledState = timeline.stateAt(times[position])
+            end = bisect_left(times, compiledState.endTime, position)
+            if end <= position:
+                # Never due, e.g. after a rate of 0
+                end = count
+
+            steadyStart = position
+            if compiledState.fadeSampler is not None:
+                steadyStart = bisect_left(times, compiledState.fadeEndTime, position, end)
+                for i in range(position, steadyStart):
+                    fadeState, outputIndex = timeline.sampleOutput(times[i], rand())
+                    outputs.append(stateOffsets[fadeState.index] + outputIndex)
+
+            if steadyStart < end:
+                offset = stateOffsets[compiledState.index]
+                if compiledState.sampler.count == 1:
+                    outputs.extend([offset] * (end - steadyStart))
+                else:
+                    outputs.extend(map(offset.__add__, self.decisions.drawOutputs(compiledState.sampler, end - steadyStart)))
+            position = end
+        return outputs
+
+    def createBlock(self):
+        scheduler = self.scheduler
+        count = BATCH_BLOCK_MESSAGES
+        if scheduler.mode == "PerChatter":
+            times, chatters = self.drawPerChatter(count)
+        else:
+            times = self.decisions.drawTimes(scheduler, count)
+            chatters = self.decisions.drawChatters(self.population, count)
+        outputs = self.drawOutputs(times)
+
+        messageStrings = None
+        if self.hasTemplates or self.keepMessages:
+            messageStrings = list(map(self.messageStrings.__getitem__, outputs))
+        if self.hasTemplates:
+            messages = self.messages
+            for i in range(count):
+                if messageStrings[i] is None:
+                    messageStrings[i] = messages[outputs[i]].render()
+
+        outputStrings = None
+        if self.keepMessages:
+            outputStrings = list(map(operator.add, map(self.population.prefixes.__getitem__, chatters), messageStrings))
+
+        data = b''
+        ends = None
+        if self.framing is not None:
+            prefixes = list(map(self.prefixBytes.__getitem__, chatters))
+            messages = list(map(self.messageBytes.__getitem__, outputs))
+            if self.hasTemplates:
+                suffix = self.suffix
+                for i in range(count):
+                    if messages[i] is None:
+                        messages[i] = messageStrings[i].encode('utf-8') + suffix
+
+            lengths = list(map(operator.add, map(len, prefixes), map(len, messages)))
+            if self.framing == "Length":
+                parts = [None] * (3*count)
+                parts[0::3] = map(packLength, lengths)
+                parts[1::3] = prefixes
+                parts[2::3] = messages
+                ends = list(accumulate(map((4).__add__, lengths)))
+            else:
+                parts = [None] * (2*count)
+                parts[0::2] = prefixes
+                parts[1::2] = messages
+                ends = list(accumulate(lengths))
+            data = b''.join(parts)
+
+        self.expectedRateCurve = scheduler.rateCurve
+        return ChatBlock(times, data, ends, outputStrings)
+
+    # The current block, or a new one if the scheduler moved on by itself, e.g.
+    # after falling too far behind, resume() or a new rate curve
+    def getBlock(self):
+        scheduler = self.scheduler
+        if scheduler.deadline != self.expectedDeadline or scheduler.startTime != self.expectedStartTime or \
+                scheduler.rateCurve is not self.expectedRateCurve:
+            self.block = None
+            self.updateDeadline()
+        return self.block
+
+    # Points the scheduler's deadline at the next message waiting, making a new
+    # block once the current one is used up
+    def updateDeadline(self):
+        block = self.block
+        if block is None or block.position == len(block.times):
+            block = self.block = self.createBlock()
+        scheduler = self.scheduler
+        self.expectedStartTime = scheduler.startTime
+        self.expectedDeadline = scheduler.deadline = scheduler.startTime + block.times[block.position]
+
+    # Messages due by elapsed seconds into the run, at most maxMessages and all
+    # from one block. Returns a ChatBatch, or None if nothing is due.
+    def takeDue(self, elapsed, maxMessages=BATCH_BLOCK_MESSAGES):
+        block = self.getBlock()
+        start = block.position
+        end = min(bisect_right(block.times, elapsed, start), start + maxMessages)
+        if end == start:
+            return None
+        block.position = end
+        self.scheduler.messageCount += end - start
+
+        data = block.data
+        ends = block.ends
+        dataOffset = 0
+        if ends is not None and (start > 0 or end < len(ends)):
+            dataOffset = ends[start-1] if start > 0 else 0
+            data = data[dataOffset:ends[end-1]]
+            ends = ends[start:end]
+        outputStrings = block.outputStrings[start:end] if block.outputStrings is not None else None
+        batch = ChatBatch(data, end - start, block.times[start:end], ends, dataOffset, outputStrings)
+
+        self.updateDeadline()
+        return batch
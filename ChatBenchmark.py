@@ -0,0 +1,394 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+from array import array
+
+from ChatEngine import ChatGenerator, ChatSettingsValues, ChatStateValues, ChatOutputValues
+from ChatOutputs import createChatOutput
+
+# Measures how fast chat can be generated and delivered. Every case builds a
+# scenario in memory, runs it headless for a few seconds and records
+# throughput, CPU use and how the time between messages compares with what was
+# configured. TCP, Unix socket, UDP and pipe cases are read by a consumer in
+# its own process so it doesn't compete with the generator for the GIL.
+#   py ChatBenchmark.py --out results.json
+#   py ChatBenchmark.py --quick --filter tcp
+
+DEFAULT_DURATION = 3.0
+BENCHMARK_HOST = "127.0.0.1"
+
+# Outputs whose cases choose a framing and flush interval
+STREAM_OUTPUT_TYPES = ["TCP", "Unix", "UDP", "Pipe"]
+
+class BenchmarkCase:
+    __slots__ = ['name', 'outputType', 'framing', 'flushInterval', 'stateSize', 'numberOfChatters', 'rateMode', 'messagesPerSecond', 'workers', 'batch', 'quick']
+    def __init__(self, name, outputType, stateSize=10, numberOfChatters=50, rateMode="Uniform", messagesPerSecond=0.0,
+            framing="Newline", flushInterval=0.0, workers=1, batch=False, quick=False):
+        self.name = name
+        self.outputType = outputType
+        self.framing = framing
+        self.flushInterval = flushInterval
+        self.stateSize = stateSize
+        self.numberOfChatters = numberOfChatters
+        self.rateMode = rateMode
+        self.messagesPerSecond = messagesPerSecond
+        self.workers = workers
+        self.batch = batch
+        self.quick = quick
+
+# Uniform with no time between messages runs as fast as the generator can go
+STANDARD_CASES = [
+    BenchmarkCase("none-max-10", "None", quick=True),
+    BenchmarkCase("none-max-10000", "None", stateSize=10000),
+    BenchmarkCase("file-max-10", "File", quick=True),
+    BenchmarkCase("tcp-max-none", "TCP", framing="None"),
+    BenchmarkCase("tcp-max-newline", "TCP", framing="Newline", quick=True),
+    BenchmarkCase("tcp-max-length", "TCP", framing="Length"),
+    BenchmarkCase("tcp-max-newline-batched", "TCP", framing="Newline", flushInterval=0.005, quick=True),
+    BenchmarkCase("tcp-max-length-batched", "TCP", framing="Length", flushInterval=0.005),
+    BenchmarkCase("tcp-max-newline-10000", "TCP", stateSize=10000, flushInterval=0.005),
+    BenchmarkCase("unix-max-newline", "Unix", framing="Newline"),
+    BenchmarkCase("unix-max-newline-batched", "Unix", framing="Newline", flushInterval=0.005, quick=True),
+    BenchmarkCase("udp-max-none", "UDP", framing="None"),
+    BenchmarkCase("udp-max-newline-batched", "UDP", framing="Newline", flushInterval=0.005),
+    BenchmarkCase("pipe-max-newline", "Pipe", framing="Newline"),
+    BenchmarkCase("pipe-max-newline-batched", "Pipe", framing="Newline", flushInterval=0.005, quick=True),
+    BenchmarkCase("tcp+file-max-newline-batched", "TCP+File", framing="Newline", flushInterval=0.005, quick=True),
+    BenchmarkCase("none-fixed-1000", "None", rateMode="Fixed", messagesPerSecond=1000.0, quick=True),
+    BenchmarkCase("none-poisson-1000", "None", rateMode="Poisson", messagesPerSecond=1000.0),
+    BenchmarkCase("tcp-fixed-1000", "TCP", rateMode="Fixed", messagesPerSecond=1000.0),
+    BenchmarkCase("none-perchatter-100k", "None", numberOfChatters=100000, rateMode="PerChatter", messagesPerSecond=20000.0, quick=True),
+    BenchmarkCase("none-max-10-workers", "None", workers=os.cpu_count() or 1),
+    BenchmarkCase("tcp-max-newline-workers", "TCP", flushInterval=0.005, workers=os.cpu_count() or 1),
+    BenchmarkCase("none-max-10-batch", "None", batch=True, quick=True),
+    BenchmarkCase("none-max-10000-batch", "None", stateSize=10000, batch=True),
+    BenchmarkCase("tcp-max-newline-batch", "TCP", framing="Newline", flushInterval=0.005, batch=True, quick=True),
+    BenchmarkCase("tcp-max-length-batch", "TCP", framing="Length", flushInterval=0.005, batch=True),
+    BenchmarkCase("none-perchatter-100k-batch", "None", numberOfChatters=100000, rateMode="PerChatter", messagesPerSecond=20000.0, batch=True),
+    BenchmarkCase("tcp-max-newline-workers-batch", "TCP", flushInterval=0.005, workers=os.cpu_count() or 1, batch=True),
+    BenchmarkCase("file-max-10-workers", "File", workers=os.cpu_count() or 1),
+]
+
+# A case's outputType is one output type, or several joined with + to fan out to all of them
+def getCaseOutputTypes(case):
+    return [outputType for outputType in case.outputType.split("+") if outputType != "None"]
+
+def createBenchmarkSettings(case, duration):
+    # Two states so every run also goes through a fade
+    chatStates = []
+    for stateIndex in range(2):
+        outputs = [ChatOutputValues("state " + str(stateIndex+1) + " message " + str(i+1), random.uniform(0.1, 10.0))
+            for i in range(case.stateSize)]
+        chatStates.append(ChatStateValues(outputs, duration / 2.0))
+
+    settings = ChatSettingsValues(chatStates)
+    settings.numberOfChatters = case.numberOfChatters
+    settings.workers = case.workers
+    settings.batchGeneration = case.batch
+    settings.rateMode = case.rateMode
+    settings.messagesPerSecond = case.messagesPerSecond
+    settings.minTimeBetweenMessages = 0.0
+    settings.maxTimeBetweenMessages = 0.0
+    settings.transitionDuration = duration / 4.0
+    settings.outputTypes = getCaseOutputTypes(case)
+    settings.tcpHost = BENCHMARK_HOST
+    settings.udpHost = BENCHMARK_HOST
+    settings.framing = case.framing
+    settings.flushInterval = case.flushInterval
+    return settings
+
+def findFreePort():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((BENCHMARK_HOST, 0))
+        return probe.getsockname()[1]
+
+######## Consumers ########
+
+def countFramedMessages(data, framing, leftover):
+    if framing == "Newline" or framing == "CRLF":
+        return data.count(b'\n'), b''
+    if framing == "Length":
+        data = leftover + data
+        count = 0
+        position = 0
+        while position + 4 <= len(data):
+            length = struct.unpack_from('>I', data, position)[0]
+            if position + 4 + length > len(data):
+                break
+            position += 4 + length
+            count += 1
+        return count, data[position:]
+    # Unframed messages can't be told apart
+    return 0, b''
+
+# Reads a TCP or Unix socket output until the server closes the connection
+def runLoopbackConsumer(family, address, framing, results):
+    connection = None
+    deadline = time.monotonic() + 10.0
+    while connection is None:
+        try:
+            connection = socket.socket(family, socket.SOCK_STREAM)
+            connection.connect(address)
+        except OSError:
+            connection.close()
+            connection = None
+            if time.monotonic() > deadline:
+                results.put((0, 0))
+                return
+            time.sleep(0.01)
+
+    byteCount = 0
+    messageCount = 0
+    leftover = b''
+    with connection:
+        while True:
+            data = connection.recv(1 << 20)
+            if not data:
+                break
+            byteCount += len(data)
+            count, leftover = countFramedMessages(data, framing, leftover)
+            messageCount += count
+    results.put((byteCount, messageCount))
+
+# Receives UDP datagrams until none have come for a second
+def runUdpConsumer(udpSocket, framing, ready, results):
+    udpSocket.settimeout(10.0)
+    ready.set()
+    byteCount = 0
+    messageCount = 0
+    with udpSocket:
+        while True:
+            try:
+                data = udpSocket.recv(1 << 16)
+            except OSError:
+                break
+            udpSocket.settimeout(1.0)
+            byteCount += len(data)
+            if framing == "None":
+                messageCount += 1
+            else:
+                messageCount += countFramedMessages(data, framing, b'')[0]
+    results.put((byteCount, messageCount))
+
+# Reads a named pipe until the output closes it
+def runPipeConsumer(location, framing, results):
+    byteCount = 0
+    messageCount = 0
+    leftover = b''
+    with open(location, "rb", buffering=0) as pipe:
+        while True:
+            data = pipe.read(1 << 20)
+            if not data:
+                break
+            byteCount += len(data)
+            count, leftover = countFramedMessages(data, framing, leftover)
+            messageCount += count
+    results.put((byteCount, messageCount))
+
+######## Measuring ########
+
+# Wraps an output to timestamp every write and count bytes. Batches from worker
+# processes are only counted, their messages weren't written one at a time.
+class TimedChatOutput:
+    def __init__(self, output):
+        self.output = output
+        self.name = output.name
+        self.framing = output.framing
+        self.sinks = output.sinks
+        self.writeTimes = array('d')
+        self.byteCount = 0
+
+    @property
+    def metrics(self):
+        return self.output.metrics
+
+    @metrics.setter
+    def metrics(self, sinkMetrics):
+        self.output.metrics = sinkMetrics
+
+    def open(self, onStatus=None):
+        self.output.open(onStatus)
+
+    def write(self, outputString):
+        byteCount = self.output.write(outputString)
+        self.writeTimes.append(time.perf_counter())
+        self.byteCount += len(outputString.encode('utf-8'))
+        return byteCount
+
+    def writeFramed(self, data, messageCount):
+        self.byteCount += len(data)
+        return self.output.writeFramed(data, messageCount)
+
+    def cancel(self):
+        self.output.cancel()
+
+    def close(self):
+        self.output.close()
+
+def getPercentile(sortedValues, percentile):
+    if not sortedValues:
+        return None
+    index = min(int(len(sortedValues) * percentile / 100.0), len(sortedValues)-1)
+    return sortedValues[index]
+
+def summarizeIntervals(writeTimes, targetRate):
+    intervals = sorted(writeTimes[i] - writeTimes[i-1] for i in range(1, len(writeTimes)))
+    summary = {'configuredMean': 1.0 / targetRate if targetRate and targetRate != float('inf') else None}
+    if not intervals:
+        return summary
+
+    mean = sum(intervals) / len(intervals)
+    variance = sum((interval - mean) ** 2 for interval in intervals) / len(intervals)
+    summary.update({
+        'mean': mean,
+        'stdev': variance ** 0.5,
+        'min': intervals[0],
+        'p50': getPercentile(intervals, 50),
+        'p90': getPercentile(intervals, 90),
+        'p99': getPercentile(intervals, 99),
+        'p999': getPercentile(intervals, 99.9),
+        'max': intervals[-1],
+    })
+    return summary
+
+def runCase(case, duration, tempDirectory):
+    settings = createBenchmarkSettings(case, duration)
+    consumer = None
+    results = None
+    outputTypes = getCaseOutputTypes(case)
+    isStream = any([outputType in STREAM_OUTPUT_TYPES for outputType in outputTypes])
+    if "TCP" in outputTypes:
+        settings.tcpPort = findFreePort()
+        results = multiprocessing.Queue()
+        consumer = multiprocessing.Process(target=runLoopbackConsumer,
+            args=(socket.AF_INET, (settings.tcpHost, settings.tcpPort), settings.framing, results), daemon=True)
+        consumer.start()
+    elif "Unix" in outputTypes:
+        settings.unixPath = os.path.join(tempDirectory, case.name + ".sock")
+        results = multiprocessing.Queue()
+        consumer = multiprocessing.Process(target=runLoopbackConsumer,
+            args=(socket.AF_UNIX, settings.unixPath, settings.framing, results), daemon=True)
+        consumer.start()
+    elif "UDP" in outputTypes:
+        # Bound here so no datagram is sent before there is somewhere to receive it
+        udpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+        udpSocket.bind((BENCHMARK_HOST, 0))
+        settings.udpPort = udpSocket.getsockname()[1]
+        results = multiprocessing.Queue()
+        ready = multiprocessing.Event()
+        consumer = multiprocessing.Process(target=runUdpConsumer, args=(udpSocket, settings.framing, ready, results), daemon=True)
+        consumer.start()
+        udpSocket.close()
+        ready.wait(10.0)
+    elif "Pipe" in outputTypes:
+        settings.pipeLocation = os.path.join(tempDirectory, case.name + ".fifo")
+        os.mkfifo(settings.pipeLocation)
+        results = multiprocessing.Queue()
+        consumer = multiprocessing.Process(target=runPipeConsumer, args=(settings.pipeLocation, settings.framing, results), daemon=True)
+        consumer.start()
+    if "File" in outputTypes:
+        settings.fileLocation = os.path.join(tempDirectory, case.name + ".log")
+        settings.fileMaxSize = 10 ** 9
+
+    output = TimedChatOutput(createChatOutput(settings))
+    warnings = []
+    generator = ChatGenerator(settings, output, onWarning=lambda title, text: warnings.append(text), duration=duration)
+
+    cpuStart = time.process_time()
+    generator.run()
+    cpuSeconds = time.process_time() - cpuStart
+    elapsed = generator.elapsed
+
+    result = {
+        'name': case.name,
+        'output': case.outputType,
+        'framing': case.framing if isStream else None,
+        'flushInterval': case.flushInterval if isStream else None,
+        'stateSize': case.stateSize,
+        'numberOfChatters': case.numberOfChatters,
+        'workers': case.workers,
+        'batch': case.batch,
+        'rateMode': case.rateMode,
+        'targetRate': case.messagesPerSecond if case.rateMode != "Uniform" else None,
+        'duration': elapsed,
+        'messages': generator.messageCount,
+        'bytes': output.byteCount,
+        'msgsPerSec': generator.messageCount / elapsed if elapsed > 0 else 0.0,
+        'bytesPerSec': output.byteCount / elapsed if elapsed > 0 else 0.0,
+        'cpuSeconds': cpuSeconds,
+        'cpuPercent': 100.0 * cpuSeconds / elapsed if elapsed > 0 else 0.0,
+        'interval': summarizeIntervals(output.writeTimes, generator.scheduler.targetRate()),
+        'warnings': warnings,
+    }
+
+    if consumer is not None:
+        try:
+            receivedBytes, receivedMessages = results.get(timeout=10.0)
+            result['receivedBytes'] = receivedBytes
+            result['receivedMessages'] = receivedMessages if settings.framing != "None" or "UDP" in outputTypes else None
+        except queue.Empty:
+            result['warnings'].append("Loopback consumer didn't report")
+        consumer.join(1.0)
+    return result
+
+def formatResult(result):
+    text = "%-28s %10.0f msgs/sec %8.2f MB/sec %5.0f%% CPU" % (result['name'], result['msgsPerSec'], result['bytesPerSec'] / 1e6, result['cpuPercent'])
+    interval = result['interval']
+    if interval.get('p50') is not None:
+        text += "  interval p50 %.1fus p99 %.1fus" % (interval['p50'] * 1e6, interval['p99'] * 1e6)
+        if interval['configuredMean'] is not None:
+            text += " (configured %.1fus)" % (interval['configuredMean'] * 1e6)
+    return text
+
+def createArgumentParser():
+    parser = argparse.ArgumentParser(description="Benchmark chat generation and delivery.")
+    parser.add_argument("--out", default=None, help="write results to this JSON file")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds per case (default: %(default)s)")
+    parser.add_argument("--quick", action="store_true", help="only run a representative subset of cases")
+    parser.add_argument("--filter", default=None, help="only run cases whose name contains this text")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    return parser
+
+def main(argv=None):
+    args = createArgumentParser().parse_args(argv)
+
+    cases = [case for case in STANDARD_CASES if (case.quick or not args.quick) and (args.filter is None or args.filter in case.name)]
+    if args.list:
+        for case in cases:
+            print(case.name)
+        return 0
+
+    results = []
+    with tempfile.TemporaryDirectory() as tempDirectory:
+        for case in cases:
+            result = runCase(case, args.duration, tempDirectory)
+            print(formatResult(result), flush=True)
+            results.append(result)
+
+    report = {
+        'version': 1,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'duration': args.duration,
+        'results': results,
+    }
+    if args.out is not None:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+import json
+import math
+import selectors
+import socket
+import socketserver
+import threading
+
+from ChatEngine import createTimeline, createScheduler
+from ChatScenario import loadScenario, settingsFromDict, ScenarioError
+from ChatScheduler import RateCurve
+from ChatTemplates import TemplateError
+from ChatPopulation import PopulationError
+
+# Lets test harnesses drive a running scenario without touching the GUI or
+# restarting the run, so connected clients stay connected. Set controlPort and
+# connect to it on 127.0.0.1. Every line sent is one JSON command and gets one
+# JSON line back once the generator thread has carried it out:
+#   {"command": "status"}
+#   {"command": "state", "state": 3}            jump to chat state 3, faded in
+#   {"command": "rate", "rate": 500.0}          hold 500 msgs/sec until the scenario changes
+#   {"command": "rate", "rate": null}           go back to the scenario's rate
+#   {"command": "say", "message": "!join", "user": "ChatUser7"}
+#                                               send a message now, user defaults to a random chat user
+#   {"command": "scenario", "path": "raid.json"} or {"command": "scenario", "scenario": {...}}
+#                                               swap in another scenario's chat states and rates and
+#                                               start its timeline, outputs are kept as they are
+#   {"command": "stop"}
+# Replies are {"ok": true, ...status} or {"ok": false, "error": "..."}, with
+# the command's "id" copied in if it had one. The status is the state being
+# sent from (counting from 1), the number of states, messages sent so far and
+# the target rate. While worker processes generate the chat only status, say
+# and stop work.
+
+CONTROL_HOST = "127.0.0.1"
+CONTROL_COMMANDS = ["status", "state", "rate", "say", "scenario", "stop"]
+
+# How long a command waits for the generator thread, e.g. while it is still
+# waiting for a TCP client before starting
+CONTROL_REPLY_TIMEOUT = 5.0
+# Longest command line, inline scenarios can be big
+CONTROL_MAX_LINE_BYTES = 16777216
+
+# Settings a swapped in scenario brings with it. Outputs, workers and metrics
+# stay as the run started.
+SCENARIO_SWAP_SETTINGS = ['numberOfChatters', 'chatterActivity', 'zipfExponent', 'chatterNamesLocation', 'chatterNameFormat',
+                          'rateMode', 'messagesPerSecond', 'minTimeBetweenMessages', 'maxTimeBetweenMessages',
+                          'transitionDuration', 'pools', 'chatStates']
+
+class ControlError(Exception):
+    pass
+
+class ControlCommand:
+    __slots__ = ['request', 'reply', 'done', 'abandoned']
+    def __init__(self, request):
+        self.request = request
+        self.reply = None
+        self.done = threading.Event()
+        # Set when the connection gave up waiting, the command is then skipped
+        self.abandoned = False
+
+    def finish(self, reply):
+        self.reply = reply
+        self.done.set()
+
+######## Commands ########
+
+# Python's json reads NaN, Infinity and -Infinity, which aren't JSON
+def rejectConstant(name):
+    raise ValueError(name + " is not a JSON value")
+
+# Run on the generator thread, see ChatGenerator.runCommands()
+
+def getTimeline(generator):
+    if generator.timeline is None:
+        raise ControlError("Only status, say and stop work while worker processes generate the chat")
+    return generator.timeline
+
+def getStatus(generator):
+    metrics = generator.metrics
+    status = {
+        'state': metrics.stateIndex + 1,
+        'messages': generator.messageCount,
+        # JSON has no infinity or NaN
+        'targetRate': metrics.targetRate if math.isfinite(metrics.targetRate) else None,
+    }
+    if generator.timeline is not None:
+        status['states'] = len(generator.timeline.states)
+    return status
+
+def runStatus(generator, request):
+    pass
+
+def runState(generator, request):
+    timeline = getTimeline(generator)
+    try:
+        stateNumber = int(request['state'])
+    except (KeyError, TypeError, ValueError):
+        raise ControlError("state needs a chat state number like {\"command\": \"state\", \"state\": 2}")
+    if stateNumber < 1 or stateNumber > len(timeline.states):
+        raise ControlError("There is no chat state " + str(stateNumber) + ", the scenario has " + str(len(timeline.states)))
+
+    # Straight to where the state has faded in, so every message is from it
+    elapsed = timeline.states[stateNumber-1].fadeEndTime
+    generator.scheduler.resume(elapsed)
+    timeline.stateAt(elapsed)
+    generator.metrics.stateIndex = timeline.currentIndex
+    generator.metrics.fadePercentage = 1.0
+    generator.metrics.targetRate = generator.scheduler.targetRateAt(elapsed)
+
+def runRate(generator, request):
+    timeline = getTimeline(generator)
+    scheduler = generator.scheduler
+    if 'rate' not in request:
+        raise ControlError("rate needs a rate like {\"command\": \"rate\", \"rate\": 100.0}")
+
+    if request['rate'] is None:
+        rateCurve = timeline.rateCurve
+    else:
+        try:
+            rate = float(request['rate'])
+        except (TypeError, ValueError):
+            raise ControlError("rate must be a number of messages per second")
+        # "nan" and numbers too big for a float, like 1e400, aren't finite
+        if not math.isfinite(rate) or rate < 0:
+            raise ControlError("rate must be a number of messages per second from 0 up")
+        baseRate = scheduler.targetRate()
+        if baseRate <= 0 or baseRate == float('inf'):
+            raise ControlError("The rate can't be changed while the scenario's own rate is unlimited, use the Fixed or Poisson rate mode")
+        # Held as a flat rate curve, so it works the same in every rate mode
+        rateCurve = RateCurve([0.0], [rate / baseRate])
+
+    elapsed = scheduler.elapsed()
+    scheduler.setRateCurve(rateCurve)
+    scheduler.resume(elapsed)
+    generator.metrics.targetRate = scheduler.targetRateAt(elapsed)
+
+def runSay(generator, request):
+    message = request.get('message')
+    if message is None:
+        raise ControlError("say needs a message like {\"command\": \"say\", \"message\": \"hello\"}")
+    user = request.get('user')
+    if not user:
+        population = generator.population
+        user = population.nameAt(population.pickChatter())
+    if not generator.writeMessage(str(user) + ": " + str(message)):
+        raise ControlError("The output failed, the run has stopped")
+
+def runScenario(generator, request):
+    getTimeline(generator)
+    try:
+        if 'path' in request:
+            scenarioSettings = loadScenario(str(request['path']))
+        elif isinstance(request.get('scenario'), dict):
+            scenarioSettings = settingsFromDict(request['scenario'])
+        else:
+            raise ControlError("scenario needs a \"path\" to a scenario file or the \"scenario\" itself")
+    except ScenarioError as e:
+        raise ControlError(str(e))
+
+    try:
+        timeline = createTimeline(scenarioSettings)
+    except (TemplateError, PopulationError) as e:
+        raise ControlError(str(e))
+    scheduler = createScheduler(scenarioSettings)
+    scheduler.setPopulation(timeline.population)
+    scheduler.prepare()
+    scheduler.setRateCurve(timeline.rateCurve)
+
+    for name in SCENARIO_SWAP_SETTINGS:
+        setattr(generator.settings, name, getattr(scenarioSettings, name))
+    scheduler.start()
+    generator.scheduler = scheduler
+    generator.timeline = timeline
+    generator.population = timeline.population
+    generator.metrics.stateIndex = 0
+    generator.metrics.fadePercentage = 1.0
+    generator.metrics.targetRate = scheduler.targetRateAt(0.0)
+
+def runStop(generator, request):
+    generator.stop()
+
+COMMAND_FUNCTIONS = {
+    "status": runStatus,
+    "state": runState,
+    "rate": runRate,
+    "say": runSay,
+    "scenario": runScenario,
+    "stop": runStop,
+}
+
+def runCommand(generator, command):
+    if command.abandoned:
+        return
+    try:
+        COMMAND_FUNCTIONS[command.request['command']](generator, command.request)
+        reply = {'ok': True}
+        reply.update(getStatus(generator))
+    except ControlError as e:
+        reply = {'ok': False, 'error': str(e)}
+    command.finish(reply)
+
+######## Server ########
+
+# Answers commands on CONTROL_HOST at port for as long as the run lasts. Each
+# connection gets its own thread, which waits for the generator thread to
+# carry out every command it reads.
+class ControlServer:
+    def __init__(self, generator, port):
+        self.generator = generator
+        self.port = port
+        self.server = None
+        self.serverThread = None
+        self.stopping = False
+        self.connections = set()
+        self.connectionsLock = threading.Lock()
+        self.wakeupReader = None
+        self.wakeupWriter = None
+
+    # Raises OSError if the port is taken
+    def start(self):
+        controlServer = self
+        class ControlRequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                with controlServer.connectionsLock:
+                    if controlServer.stopping:
+                        return
+                    controlServer.connections.add(self.connection)
+                try:
+                    while True:
+                        line = self.rfile.readline(CONTROL_MAX_LINE_BYTES + 1)
+                        if not line:
+                            break
+                        if len(line) > CONTROL_MAX_LINE_BYTES:
+                            self.wfile.write(controlServer.formatReply({'ok': False, 'error': "Command too long"}))
+                            break
+                        if line.strip():
+                            self.wfile.write(controlServer.formatReply(controlServer.runLine(line)))
+                except OSError:
+                    pass
+                finally:
+                    with controlServer.connectionsLock:
+                        controlServer.connections.discard(self.connection)
+
+        self.stopping = False
+        self.server = socketserver.ThreadingTCPServer((CONTROL_HOST, self.port), ControlRequestHandler, bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        try:
+            self.server.server_bind()
+            self.server.server_activate()
+        except OSError:
+            self.server.server_close()
+            self.server = None
+            raise
+        self.wakeupReader, self.wakeupWriter = socket.socketpair()
+        self.serverThread = threading.Thread(target=self.serve, daemon=True)
+        self.serverThread.start()
+
+    # Like serve_forever(), woken by stop() instead of polling, see MetricsReporter
+    def serve(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.server, selectors.EVENT_READ)
+            selector.register(self.wakeupReader, selectors.EVENT_READ)
+            while not self.stopping:
+                for key, mask in selector.select():
+                    if key.fileobj is self.server:
+                        self.server.handle_request()
+
+    def formatReply(self, reply):
+        # Never NaN or infinity, which JSON doesn't have. An id like 1e400 still parses as infinity.
+        try:
+            text = json.dumps(reply, allow_nan=False)
+        except ValueError:
+            text = json.dumps({'ok': False, 'error': "The reply had a number JSON can't hold"})
+        return (text + "\n").encode('utf-8')
+
+    def runLine(self, line):
+        try:
+            request = json.loads(line, parse_constant=rejectConstant)
+        except ValueError as e:
+            return {'ok': False, 'error': "Invalid JSON: " + str(e)}
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': "A command must be a JSON object"}
+
+        if request.get('command') not in CONTROL_COMMANDS:
+            reply = {'ok': False, 'error': "Unknown command " + str(request.get('command')) + ". Use one of: " + ", ".join(CONTROL_COMMANDS)}
+        else:
+            command = ControlCommand(request)
+            self.generator.submitCommand(command)
+            if command.done.wait(CONTROL_REPLY_TIMEOUT):
+                reply = command.reply
+            else:
+                command.abandoned = True
+                reply = {'ok': False, 'error': "The generator didn't answer within " + str(CONTROL_REPLY_TIMEOUT) + "s, it may still be waiting for a client"}
+        if 'id' in request:
+            reply['id'] = request['id']
+        return reply
+
+    def stop(self):
+        if self.server is None:
+            return
+        with self.connectionsLock:
+            self.stopping = True
+            connections = list(self.connections)
+        self.wakeupWriter.send(b'\0')
+        self.serverThread.join()
+        self.server.server_close()
+        self.wakeupReader.close()
+        self.wakeupWriter.close()
+
+        # Commands the run didn't get to
+        generator = self.generator
+        while generator.commands:
+            generator.commands.popleft().finish({'ok': False, 'error': "The run has stopped"})
+        # Harnesses see the connection close when the run ends. Only reading is
+        # shut down, so replies still being written get through.
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+
+        self.server = None
+        self.serverThread = None
+        self.wakeupReader = None
+        self.wakeupWriter = None
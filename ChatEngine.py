@@ -0,0 +1,503 @@
+import random
+import threading
+import time
+
+import os
+import bisect
+
+from collections import deque
+
+from functools import partial
+
+from ChatOutputs import ChatOutputError, DEFAULT_FRAMING, DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_BYTES
+from ChatOutputs import DEFAULT_FILE_FLUSH_INTERVAL, DEFAULT_FILE_SYNC, DEFAULT_QUEUE_POLICY, DEFAULT_QUEUE_MAX_BYTES, DEFAULT_UNIX_PATH
+from ChatSampler import AliasSampler, BlendedSampler
+from ChatScheduler import RateScheduler, RateCurveBuilder, DEFAULT_RATE_MODE, DEFAULT_MESSAGES_PER_SECOND
+from ChatPopulation import ChatterScheduler, ChatterPopulation, createChatterPrefixes, createPopulationWeights, loadChatterNames
+from ChatPopulation import PopulationError, DEFAULT_CHATTER_ACTIVITY, DEFAULT_ZIPF_EXPONENT, DEFAULT_CHATTER_NAME_FORMAT
+from ChatTemplates import compileTemplate, mergePools, TemplateError
+from ChatMetrics import ChatMetrics, MetricsReporter, METRICS_HOST, DEFAULT_METRICS_INTERVAL
+from ChatBatch import ChatBatchGenerator
+
+# Chat generation lives here so it can run without the GUI. Nothing in this
+# module may import tkinter; ChatGui.py and ChatHeadless.py drive it.
+
+# Need to separate values from the entries for multithreading
+# Values are for the thread generating chat, entries are for the GUI thread
+class ChatOutputValues:
+    __slots__ = ['message', 'probability']
+    def __init__(self, message, probability):
+        self.message = message
+        self.probability = probability
+
+class ChatStateValues:
+    __slots__ = ['outputs', 'duration', 'pools', 'rate']
+    def __init__(self, outputs, duration, pools=None, rate=None):
+        self.outputs = outputs
+        self.duration = duration
+        # Named lists for {pool:name} in messages, see ChatTemplates.py
+        self.pools = pools
+        # RateProfile for this state, None uses the global rate
+        self.rate = rate
+
+DEFAULT_STATE_DURATION = 0.0
+DEFAULT_OUTPUT_MESSAGE = ''
+DEFAULT_OUTPUT_PROBABILITY = 1.0
+
+def createDefaultChatOutput():
+    return ChatOutputValues(DEFAULT_OUTPUT_MESSAGE, DEFAULT_OUTPUT_PROBABILITY)
+
+def createDefaultChatState():
+    return ChatStateValues([createDefaultChatOutput()], DEFAULT_STATE_DURATION)
+
+DEFAULT_NUMBER_OF_CHATTERS = 50
+DEFAULT_MIN_TIME_BETWEEN_MESSAGES = 0.02
+DEFAULT_MAX_TIME_BETWEEN_MESSAGES = 0.2
+DEFAULT_TRANSITION_DURATION = 2.0
+# Processes generating chat, 1 generates on the thread calling run()
+DEFAULT_WORKERS = 1
+
+DEFAULT_OUTPUT_TYPES = ["TCP"]
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 10000
+DEFAULT_IRC_PORT = 6667
+DEFAULT_UDP_PORT = 10001
+
+DEFAULT_FILE_LOCATION = os.path.join(os.getcwd(), "ChatOutput.log")
+DEFAULT_MAX_FILE_SIZE = 500
+
+# Plain copy of every global setting, filled in by the GUI or a scenario file
+class ChatSettingsValues:
+    __slots__ = ['numberOfChatters', 'chatterActivity', 'zipfExponent', 'chatterNamesLocation', 'chatterNameFormat', 'workers', 'rateMode', 'messagesPerSecond', 'minTimeBetweenMessages', 'maxTimeBetweenMessages', 'transitionDuration',
+                 'outputTypes', 'tcpHost', 'tcpPort', 'tcpWaitForClient', 'tcpNoDelay', 'ircPort', 'ircChannel', 'ircTags', 'unixPath',
+                 'udpHost', 'udpPort', 'pipeLocation',
+                 'framing', 'flushInterval', 'flushBytes', 'queuePolicy', 'queueMaxBytes', 'fileLocation', 'fileMaxSize',
+                 'fileFlushInterval', 'fileSync', 'fileRotate', 'fileCompress',
+                 'metricsFile', 'metricsPort', 'metricsInterval', 'controlPort', 'seed', 'batchGeneration', 'recordingLocation',
+                 'pools', 'chatStates']
+    def __init__(self, chatStates=None):
+        self.numberOfChatters = DEFAULT_NUMBER_OF_CHATTERS
+        # How much each chatter talks, see ACTIVITY_MODELS in ChatPopulation.py
+        self.chatterActivity = DEFAULT_CHATTER_ACTIVITY
+        self.zipfExponent = DEFAULT_ZIPF_EXPONENT
+        # A file of chatter names, one per line, "" numbers every chatter with chatterNameFormat
+        self.chatterNamesLocation = ""
+        self.chatterNameFormat = DEFAULT_CHATTER_NAME_FORMAT
+        self.workers = DEFAULT_WORKERS
+        self.rateMode = DEFAULT_RATE_MODE
+        self.messagesPerSecond = DEFAULT_MESSAGES_PER_SECOND
+        self.minTimeBetweenMessages = DEFAULT_MIN_TIME_BETWEEN_MESSAGES
+        self.maxTimeBetweenMessages = DEFAULT_MAX_TIME_BETWEEN_MESSAGES
+        self.transitionDuration = DEFAULT_TRANSITION_DURATION
+        # Chat goes to every one of these at once, an empty list sends it nowhere
+        self.outputTypes = list(DEFAULT_OUTPUT_TYPES)
+        self.tcpHost = DEFAULT_HOST
+        self.tcpPort = DEFAULT_PORT
+        self.tcpWaitForClient = True
+        self.tcpNoDelay = False
+        # IRC listens on tcpHost too
+        self.ircPort = DEFAULT_IRC_PORT
+        self.ircChannel = ""
+        self.ircTags = True
+        self.unixPath = DEFAULT_UNIX_PATH
+        # Where UDP datagrams are sent
+        self.udpHost = DEFAULT_HOST
+        self.udpPort = DEFAULT_UDP_PORT
+        # "" writes to standard output
+        self.pipeLocation = ""
+        self.framing = DEFAULT_FRAMING
+        self.flushInterval = DEFAULT_FLUSH_INTERVAL
+        self.flushBytes = DEFAULT_FLUSH_BYTES
+        self.queuePolicy = DEFAULT_QUEUE_POLICY
+        self.queueMaxBytes = DEFAULT_QUEUE_MAX_BYTES
+        self.fileLocation = DEFAULT_FILE_LOCATION
+        self.fileMaxSize = DEFAULT_MAX_FILE_SIZE
+        self.fileFlushInterval = DEFAULT_FILE_FLUSH_INTERVAL
+        self.fileSync = DEFAULT_FILE_SYNC
+        self.fileRotate = True
+        self.fileCompress = False
+        self.metricsFile = ""
+        self.metricsPort = 0
+        self.metricsInterval = DEFAULT_METRICS_INTERVAL
+        # Serve the control API of ChatControl.py on this port, 0 doesn't
+        self.controlPort = 0
+        # Seeds the random module so runs say the same things in the same order, 0 doesn't
+        self.seed = 0
+        # Generate chat a block of messages at a time, see ChatBatch.py
+        self.batchGeneration = False
+        # Also record the run to this file for ChatRecording.py to replay, "" doesn't
+        self.recordingLocation = ""
+        # Pools every chat state can use in its messages
+        self.pools = None
+        self.chatStates = chatStates if chatStates is not None else [createDefaultChatState()]
+
+# A chat state compiled for the generator thread: the output messages and a
+# sampler over their probabilities, plus where the state sits on the timeline.
+# Times are seconds since the run started. Messages are plain strings or
+# compiled templates, use renderMessage() to get the text to send.
+class CompiledChatState:
+    __slots__ = ['index', 'messages', 'sampler', 'fadeSampler', 'startTime', 'fadeEndTime', 'endTime']
+    def __init__(self, index, chatState, startTime, fadeEndTime, endTime, population, pools):
+        self.index = index
+        try:
+            self.messages = [compileTemplate(str(output.message), population, mergePools(pools, chatState.pools))
+                for output in chatState.outputs]
+        except TemplateError as e:
+            raise TemplateError("Chat state " + str(index+1) + ": " + str(e))
+        self.sampler = AliasSampler([output.probability for output in chatState.outputs])
+        self.fadeSampler = None
+        self.startTime = startTime
+        self.fadeEndTime = fadeEndTime
+        self.endTime = endTime
+
+    def renderMessage(self, outputIndex):
+        message = self.messages[outputIndex]
+        return message if message.__class__ is str else message.render()
+
+    def fadePercentage(self, elapsed):
+        if self.fadeSampler is None or elapsed >= self.fadeEndTime:
+            return 1.0
+        return (elapsed - self.startTime) / (self.fadeEndTime - self.startTime)
+
+# Every state's start, fade and end time worked out up front, so finding what to
+# say at a point in the run is a lookup instead of rebuilding probability lists.
+# When states have their own rates, rateCurve is the rate of the whole run for
+# the scheduler to follow, as multiples of baseRate. population is the
+# ChatterPopulation messages are attributed to. Raises TemplateError if a
+# message template is invalid.
+class ChatTimeline:
+    def __init__(self, chatStates, transitionDuration, population, pools=None, baseRate=DEFAULT_MESSAGES_PER_SECOND):
+        self.states = []
+        self.population = population
+
+        startTime = 0.0
+        for i in range(len(chatStates)):
+            isLastState = i == len(chatStates)-1
+            duration = chatStates[i].duration
+            endTime = float('inf') if isLastState else startTime + duration
+
+            fadeEndTime = startTime
+            if i > 0 and transitionDuration > 0:
+                calculatedTransitionDuration = transitionDuration if \
+                    transitionDuration < duration or isLastState else duration
+                fadeEndTime = startTime + calculatedTransitionDuration
+
+            compiledState = CompiledChatState(i, chatStates[i], startTime, fadeEndTime, endTime, population, pools)
+            if fadeEndTime > startTime:
+                compiledState.fadeSampler = BlendedSampler(self.states[i-1].sampler, compiledState.sampler)
+            self.states.append(compiledState)
+
+            startTime = endTime
+
+        self.endTimes = [compiledState.endTime for compiledState in self.states]
+        self.currentIndex = 0
+        self.rateCurve = None
+        if any(chatState.rate is not None for chatState in chatStates):
+            self.rateCurve = self.createRateCurve(chatStates, baseRate)
+
+    def createRateCurve(self, chatStates, baseRate):
+        builder = RateCurveBuilder(baseRate)
+        previousRate = baseRate
+        for i in range(len(self.states)):
+            compiledState = self.states[i]
+            profile = chatStates[i].rate
+            duration = chatStates[i].duration
+            fadeDuration = compiledState.fadeEndTime - compiledState.startTime
+
+            span = compiledState.endTime - compiledState.startTime
+            if i == len(self.states)-1:
+                span = fadeDuration if profile is None else max(profile.settleTime(duration), fadeDuration)
+
+            if profile is None:
+                rateAt = lambda offset: baseRate
+            else:
+                rateAt = partial(profile.rateAt, duration=duration)
+            builder.addState(compiledState.startTime, span, rateAt, profile is None or profile.shape == "Constant", fadeDuration, previousRate)
+            previousRate = rateAt(span)
+        return builder.build()
+
+    def stateAt(self, elapsed):
+        # Runs only move forward, so usually this is the state from the last call
+        compiledState = self.states[self.currentIndex]
+        if elapsed < compiledState.startTime or elapsed >= compiledState.endTime:
+            self.currentIndex = min(bisect.bisect_right(self.endTimes, elapsed), len(self.states)-1)
+            compiledState = self.states[self.currentIndex]
+        return compiledState
+
+    # Returns the state the message comes from and which of its outputs to use
+    def sampleOutput(self, elapsed, randomValue):
+        compiledState = self.stateAt(elapsed)
+        if compiledState.fadeSampler is not None and elapsed < compiledState.fadeEndTime:
+            percentage = compiledState.fadePercentage(elapsed)
+            isCurrentState, outputIndex = compiledState.fadeSampler.sample(randomValue, percentage)
+            if not isCurrentState:
+                return self.states[compiledState.index-1], outputIndex
+            return compiledState, outputIndex
+
+        return compiledState, compiledState.sampler.sample(randomValue)
+
+# Messages per second when no chat state sets its own rate
+def getBaseRate(settings):
+    if settings.rateMode == "Uniform":
+        meanInterval = (settings.minTimeBetweenMessages + settings.maxTimeBetweenMessages) / 2.0
+        return 1.0 / meanInterval if meanInterval > 0 else float('inf')
+    return settings.messagesPerSecond
+
+# Raises PopulationError if the chatter names can't be read
+def createPopulation(settings):
+    activity = settings.chatterActivity
+    if activity == "Default":
+        activity = "Lognormal" if settings.rateMode == "PerChatter" else "Uniform"
+    importedNames = loadChatterNames(settings.chatterNamesLocation) if settings.chatterNamesLocation else []
+    return ChatterPopulation(createChatterPrefixes(settings.numberOfChatters, settings.chatterNameFormat, importedNames),
+        createPopulationWeights(settings.numberOfChatters, activity, settings.zipfExponent))
+
+# population is made from settings unless one is given, e.g. the same one for every worker process
+def createTimeline(settings, population=None):
+    if population is None:
+        population = createPopulation(settings)
+    return ChatTimeline(settings.chatStates, settings.transitionDuration, population, settings.pools, getBaseRate(settings))
+
+def createScheduler(settings):
+    if settings.rateMode == "PerChatter":
+        return ChatterScheduler(settings.numberOfChatters, settings.messagesPerSecond)
+    return RateScheduler(settings.rateMode, settings.messagesPerSecond,
+        settings.minTimeBetweenMessages, settings.maxTimeBetweenMessages)
+
+class ChatGenerator:
+    # output is one of the ChatOutputs classes. The callbacks are optional and
+    # are called from the thread running run():
+    #   onMessage(outputString) after each message is written
+    #   onStatus(text) while waiting on something, e.g. a TCP client
+    #   onWarning(title, text) when the run has to stop because of an error
+    # duration is in seconds, None runs until stop() is called
+    def __init__(self, settings, output, onMessage=None, onStatus=None, onWarning=None, duration=None):
+        self.settings = settings
+        self.output = output
+        self.onMessage = onMessage
+        self.onStatus = onStatus
+        self.onWarning = onWarning
+        self.duration = duration
+
+        self.scheduler = createScheduler(settings)
+        self.metrics = ChatMetrics()
+        self.sinkMetrics = None
+
+        # Set to stop the run
+        self.stopEvent = threading.Event()
+        # Commands from ChatControl.py waiting for the generator thread, which
+        # wakeEvent wakes from waiting for the next message, as does stop()
+        self.commands = deque()
+        self.wakeEvent = threading.Event()
+        # The running timeline, None while worker processes generate the chat
+        self.timeline = None
+        # Who messages are attributed to while running, see ChatPopulation.py
+        self.population = None
+        # Set by generateParallel() while worker processes are running
+        self.workerPool = None
+        self.failed = False
+        self.endTime = None
+        self.messageCount = 0
+        # Seconds spent generating, set when the run ends
+        self.elapsed = 0.0
+
+    def stop(self):
+        self.stopEvent.set()
+        self.wakeEvent.set()
+        self.output.cancel()
+        workerPool = self.workerPool
+        if workerPool is not None:
+            workerPool.requestStop()
+
+    def shouldStop(self):
+        return self.stopEvent.is_set() or (self.endTime is not None and time.monotonic() >= self.endTime)
+
+    # Called from other threads, see ChatControl.py
+    def submitCommand(self, command):
+        self.commands.append(command)
+        self.wakeEvent.set()
+
+    def runCommands(self):
+        # Imported here because ChatControl builds on this module
+        from ChatControl import runCommand
+        while self.commands:
+            runCommand(self, self.commands.popleft())
+
+    def warn(self, text):
+        self.failed = True
+        self.stopEvent.set()
+        if self.onWarning is not None:
+            self.onWarning("Warning", text)
+
+    def writeMessage(self, outputString):
+        sendStartTime = time.perf_counter()
+        try:
+            byteCount = self.output.write(outputString)
+        except ChatOutputError as e:
+            self.sinkMetrics.failures += 1
+            self.warn(str(e))
+            return False
+        self.sinkMetrics.recordSend(byteCount, time.perf_counter() - sendStartTime)
+
+        self.messageCount += 1
+        self.metrics.messageCount = self.messageCount
+        if self.onMessage is not None:
+            self.onMessage(outputString)
+        return True
+
+    # Messages already framed for the output, see ChatParallel.py and ChatBatch.py
+    def writeBatch(self, data, messageCount, outputStrings=None):
+        sendStartTime = time.perf_counter()
+        try:
+            byteCount = self.output.writeFramed(data, messageCount)
+        except ChatOutputError as e:
+            self.sinkMetrics.failures += 1
+            self.warn(str(e))
+            return False
+        self.sinkMetrics.recordBatch(messageCount, byteCount, time.perf_counter() - sendStartTime)
+
+        self.messageCount += messageCount
+        self.metrics.messageCount = self.messageCount
+        if self.onMessage is not None and outputStrings is not None:
+            for outputString in outputStrings:
+                self.onMessage(outputString)
+        return True
+
+    def createBatches(self, timeline):
+        if not self.settings.batchGeneration:
+            return None
+        return ChatBatchGenerator(timeline, self.scheduler, self.output.framing, self.onMessage is not None)
+
+    def printOutput(self, message):
+        chatter = self.scheduler.lastChatter
+        if chatter is None:
+            chatter = self.population.pickChatter()
+        self.writeMessage(self.population.prefixes[chatter] + message)
+
+    # Waits on wakeEvent so stop() and commands end the wait right away.
+    # Returns False if woken before the next message is due.
+    def waitForNextMessage(self):
+        timeRemaining = self.scheduler.timeUntilDeadline()
+        if timeRemaining <= 0:
+            return True
+        if self.endTime is not None:
+            timeRemaining = min(timeRemaining, self.endTime - time.monotonic())
+        # A state with a rate of 0 has no next message
+        if self.wakeEvent.wait(None if timeRemaining == float('inf') else max(timeRemaining, 0.0)):
+            self.wakeEvent.clear()
+            return False
+        return True
+
+    def run(self):
+        self.stopEvent.clear()
+        self.wakeEvent.clear()
+        self.failed = False
+        self.messageCount = 0
+        self.elapsed = 0.0
+
+        self.metrics.reset()
+        self.metrics.targetRate = self.scheduler.targetRate()
+        self.sinkMetrics = self.metrics.getSink(self.output.name)
+        self.output.metrics = self.sinkMetrics
+        # Each output chat is fanned out to reports on its own too
+        for sink in self.output.sinks:
+            sink.output.metrics = self.metrics.getSink(sink.name)
+
+        reporter = MetricsReporter(self.metrics, self.settings.metricsFile, self.settings.metricsPort, self.settings.metricsInterval)
+        try:
+            reporter.start()
+        except OSError:
+            reporter.stop()
+            self.warn("Unable to serve metrics at " + METRICS_HOST + ":" + str(self.settings.metricsPort) + ". Try another port.")
+            return
+
+        controlServer = None
+        if self.settings.controlPort > 0:
+            # Imported here because ChatControl builds on this module
+            from ChatControl import ControlServer, CONTROL_HOST
+            controlServer = ControlServer(self, self.settings.controlPort)
+            try:
+                controlServer.start()
+            except OSError:
+                controlServer.stop()
+                reporter.stop()
+                self.warn("Unable to serve the control API at " + CONTROL_HOST + ":" + str(self.settings.controlPort) + ". Try another port.")
+                return
+
+        try:
+            self.output.open(self.onStatus)
+        except ChatOutputError as e:
+            if controlServer is not None:
+                controlServer.stop()
+            reporter.stop()
+            self.warn(str(e))
+            return
+
+        try:
+            if self.settings.workers > 1:
+                # Imported here because the worker processes import this module
+                from ChatParallel import generateParallel
+                generateParallel(self)
+            else:
+                self.generate()
+        finally:
+            self.output.close()
+            if controlServer is not None:
+                controlServer.stop()
+            reporter.stop()
+
+    def generate(self):
+        if self.settings.seed:
+            random.seed(self.settings.seed)
+        try:
+            timeline = createTimeline(self.settings)
+        except (TemplateError, PopulationError) as e:
+            self.warn(str(e))
+            return
+        self.scheduler.setPopulation(timeline.population)
+        self.scheduler.setRateCurve(timeline.rateCurve)
+        self.scheduler.start()
+        self.timeline = timeline
+        self.population = timeline.population
+        # Commands can move the scheduler's start, the run's stays put
+        startTime = self.scheduler.startTime
+        self.endTime = None if self.duration is None else startTime + self.duration
+        batches = self.createBatches(timeline)
+
+        # Also when Ctrl-C interrupts the run, the summary still needs the time
+        try:
+            while True:
+                isDue = self.waitForNextMessage()
+                if self.shouldStop():
+                    break
+                if self.commands:
+                    self.runCommands()
+                    timeline = self.timeline
+                    if batches is not None and (batches.timeline is not timeline or batches.scheduler is not self.scheduler):
+                        batches = self.createBatches(timeline)
+                    continue
+                if not isDue:
+                    continue
+
+                # The timeline follows when the message was due, not when it got sent
+                if batches is not None:
+                    # Everything due is written at once
+                    batch = batches.takeDue(self.scheduler.elapsed())
+                    if batch is None:
+                        continue
+                    self.writeBatch(batch.data, batch.count, batch.outputStrings)
+                    elapsed = batch.times[-1]
+                    timeline.stateAt(elapsed)
+                else:
+                    elapsed = self.scheduler.advance() - self.scheduler.startTime
+                    compiledState, outputIndex = timeline.sampleOutput(elapsed, random.random())
+                    self.printOutput(compiledState.renderMessage(outputIndex))
+
+                self.metrics.stateIndex = timeline.currentIndex
+                self.metrics.fadePercentage = timeline.states[timeline.currentIndex].fadePercentage(elapsed)
+                if timeline.rateCurve is not None:
+                    self.metrics.targetRate = self.scheduler.targetRateAt(elapsed)
+        finally:
+            self.timeline = None
+            self.population = None
+            self.elapsed = self.scheduler.clock() - startTime
@@ -0,0 +1,998 @@
+# The GUI, started by ChatSimulator.py. Importing this module opens the window.
+import time
+
+from tkinter import *
+from tkinter import ttk
+from tkinter import filedialog
+from tkinter import messagebox
+
+from functools import partial
+from bisect import bisect_right
+from collections import deque
+
+import threading
+
+import os
+
+
+from ChatEngine import *
+from ChatOutputs import createChatOutput, createServerOutputs, ChatOutputError, FRAMINGS, DEFAULT_FRAMING, DEFAULT_FLUSH_INTERVAL
+from ChatOutputs import FILE_SYNC_POLICIES, DEFAULT_FILE_FLUSH_INTERVAL, DEFAULT_FILE_SYNC
+from ChatOutputs import QUEUE_POLICIES, DEFAULT_QUEUE_POLICY, DEFAULT_QUEUE_MAX_BYTES, DEFAULT_UNIX_PATH
+from ChatScheduler import RATE_MODES, DEFAULT_RATE_MODE, DEFAULT_MESSAGES_PER_SECOND
+from ChatPopulation import ACTIVITY_MODELS, DEFAULT_CHATTER_ACTIVITY
+from ChatScenario import loadScenario, saveScenario, ScenarioError
+
+def getFloatFromString(str):
+    try:
+        return float(str)
+    except:
+        return 0.0
+
+def getIntFromString(str):
+    try:
+        return int(str)
+    except:
+        return 1
+
+# What the chat state editor's entries hold, kept as text so that only the
+# rows in view need widgets
+class ChatOutputEntries:
+    __slots__ = ['messageText', 'probabilityText']
+    def __init__(self, messageText=DEFAULT_OUTPUT_MESSAGE, probabilityText=str(DEFAULT_OUTPUT_PROBABILITY)):
+        self.messageText = messageText
+        self.probabilityText = probabilityText
+
+    def getChatOutputValues(self):
+        return ChatOutputValues(self.messageText, getFloatFromString(self.probabilityText))
+
+
+class ChatStateEntries:
+    __slots__ = ['outputs', 'durationText', 'pools', 'rate']
+    def __init__(self, outputs, durationText=str(DEFAULT_STATE_DURATION), pools=None, rate=None):
+        self.outputs = outputs
+        self.durationText = durationText
+        # Not editable here, kept so saving doesn't lose a loaded scenario's pools and rates
+        self.pools = pools
+        self.rate = rate
+
+    def getChatStateValues(self):
+        chatOutputValues = [output.getChatOutputValues() for output in self.outputs]
+        return ChatStateValues(chatOutputValues, getFloatFromString(self.durationText), self.pools, self.rate)
+
+def createChatStateEntries(chatState):
+    outputs = [ChatOutputEntries(output.message, str(output.probability)) for output in chatState.outputs]
+    return ChatStateEntries(outputs, str(chatState.duration), chatState.pools, chatState.rate)
+
+cwd = os.getcwd()
+
+myPurple="#f7e3ff"
+myRed="#ff8080"
+myGreen="#8cff93"
+myLightBlack="#212121"
+
+root = Tk()
+root.title("Chat Simulator")
+try:
+    root.iconbitmap("chatsimulatoricon.ico")
+except:
+    pass
+
+frame_settingsParent = LabelFrame(root, padx=10, pady=10, bd=0)
+frame_chatParent = LabelFrame(root, padx=10, pady=10)
+
+frame_settingsParent.grid(row=0, column=0)
+frame_chatParent.grid(row=0, column=1)
+
+frame_globalSettings = LabelFrame(frame_settingsParent, bd=0)
+frame_actions = LabelFrame(frame_settingsParent, bd=0)
+
+frame_globalSettings.grid(row=0, column=0, sticky=W)
+frame_actions.grid(row=2, column=0)
+
+######## Right Chat GUI ########
+
+def onClickSendChat():
+    outputString = entry_username.get() + ": " + entry_chatMessage.get()
+    if chatGenerator is not None:
+        try:
+            chatGenerator.output.write(outputString)
+        except ChatOutputError as e:
+            messagebox.showwarning("Warning", str(e))
+            return
+
+    completeMessage = addToMessageList(outputString)
+    message_chat.config(text=completeMessage)
+
+frame_chatAdultOffspring = LabelFrame(frame_chatParent, bd=0)
+frame_chatAdultOffspring.grid(row=0, column=0, columnspan=2)
+
+chatWidth = 306
+frame_chat = LabelFrame(frame_chatAdultOffspring, height=600, width=chatWidth, bd=0, bg=myLightBlack)
+frame_chat.pack()
+frame_chat.pack_propagate(0)
+
+message_chat = Message(frame_chat, text="", \
+    width=chatWidth, bg=myLightBlack, fg="white", font=("Arial", 10, "bold"), anchor=S, justify=LEFT)
+message_chat.pack(side=BOTTOM, anchor=SW)
+
+entry_username = Entry(frame_chatParent, width=14)
+entry_username.grid(row=1, column=0, pady=4)
+entry_username.insert(0, "username")
+
+entry_chatMessage = Entry(frame_chatParent, width=36)
+entry_chatMessage.grid(row=1, column=1)
+entry_chatMessage.insert(0, "message")
+
+button_sendChat = Button(frame_chatParent, text="Send", command=onClickSendChat, state=DISABLED)
+button_sendChat.grid(row=2, column=1, sticky=E)
+
+label_rate = Label(frame_chatParent, text="", anchor=W)
+label_rate.grid(row=3, column=0, columnspan=2, sticky=W)
+
+label_stats = Label(frame_chatParent, text="", anchor=W, justify=LEFT, font=("Arial", 8))
+label_stats.grid(row=4, column=0, columnspan=2, sticky=W)
+
+######## Validation ########
+
+def positiveIntValidation(text, labelText):
+    try:
+        intVal = int(text)
+        if intVal > 0:
+            return True
+        else:
+            messagebox.showwarning("Warning", labelText + " must be an integer greater than 0.")
+            return False
+    except:
+        messagebox.showwarning("Warning", labelText + " must be an integer greater than 0.")
+        return False
+
+def geqZeroIntValidation(text, labelText):
+    try:
+        intVal = int(text)
+        if intVal >= 0:
+            return True
+        else:
+            messagebox.showwarning("Warning", labelText + " must be an integer greater than or equal to 0.")
+            return False
+    except:
+        messagebox.showwarning("Warning", labelText + " must be an integer greater than or equal to 0.")
+        return False
+
+def positiveNumberValidation(text, labelText):
+    try:
+        floatVal = float(text)
+        if floatVal > 0.0:
+            return True
+        else:
+            messagebox.showwarning("Warning", labelText + " must be a number greater than 0.")
+            return False
+    except:
+        messagebox.showwarning("Warning", labelText + " must be a number greater than 0.")
+        return False
+
+def geqZeroNumberValidation(text, labelText):
+    try:
+        floatVal = float(text)
+        if (floatVal >= 0.0):
+            return True
+        else:
+            messagebox.showwarning("Warning", labelText + " must be a number greater than or equal to 0.")
+            return False
+    except:
+        messagebox.showwarning("Warning", labelText + " must be a number greater than or equal to 0.")
+        return False
+
+def isMaxTimeBetweenGeqMin():
+    if (getFloatFromString(maxTimeBetweenMessages.entry.get()) >= getFloatFromString(minTimeBetweenMessages.entry.get())):
+        return True
+    else:
+        messagebox.showwarning("Warning", "Max Time Between Messages must be greater than or equal to Min Time Between Messages")
+        return False
+
+def doesAllValidationPass():
+    if not positiveIntValidation(numberOfChatters.entry.get(), "Number of Chat Users"):
+        return False
+    if rateMode.variable.get() != "Uniform" and not positiveNumberValidation(messagesPerSecond.entry.get(), "Messages Per Second"):
+        return False
+    if not positiveNumberValidation(minTimeBetweenMessages.entry.get(), "Min Time Between Messages"):
+        return False
+    if not positiveNumberValidation(maxTimeBetweenMessages.entry.get(), "Max Time Between Messages"):
+        return False
+    if not geqZeroNumberValidation(transitionDuration.entry.get(), "Fade Between States Duration"):
+        return False
+    if not positiveIntValidation(tcpPort.entry.get(), "TCP Port"):
+        return False
+    if not positiveIntValidation(ircPort.entry.get(), "IRC Port"):
+        return False
+    if not positiveIntValidation(udpPort.entry.get(), "UDP Port"):
+        return False
+    if not geqZeroNumberValidation(flushInterval.entry.get(), "Batch Flush Interval"):
+        return False
+    if not geqZeroIntValidation(queueMaxBytes.entry.get(), "Client Queue Limit"):
+        return False
+    if not positiveIntValidation(fileMaxSize.entry.get(), "Max File Size (KB)"):
+        return False
+    if not geqZeroNumberValidation(fileFlushInterval.entry.get(), "File Flush Interval"):
+        return False
+    if not positiveIntValidation(workers.entry.get(), "Worker Processes"):
+        return False
+    if not geqZeroIntValidation(metricsPort.entry.get(), "Metrics Port"):
+        return False
+    if not geqZeroIntValidation(controlPort.entry.get(), "Control Port"):
+        return False
+
+    if not isMaxTimeBetweenGeqMin():
+        return False
+
+    for i in range(len(chatStatesEntries)):
+        state = chatStatesEntries[i]
+        if not geqZeroNumberValidation(state.durationText, "Chat state " + str(i+1)):
+            return False
+
+        for j in range(len(state.outputs)):
+            if not geqZeroNumberValidation(state.outputs[j].probabilityText, "Probability for chat state " + str(i+1) + " message " + str(j+1)):
+                return False
+
+    return True
+
+positiveIntValidationReg = root.register(positiveIntValidation)
+positiveNumberValidationReg = root.register(positiveNumberValidation)
+geqZeroIntValidationReg = root.register(geqZeroIntValidation)
+geqZeroNumberValidationReg = root.register(geqZeroNumberValidation)
+
+######## Global Settings ########
+
+######## Chat States Editor ########
+
+CHAT_STATE_ROW_HEIGHT = 30
+
+# One row of the chat state editor. Each shows whichever part of a state it is
+# currently given: the duration, one message, the +/- buttons or Add State.
+class ChatStateRow:
+    __slots__ = ['frame', 'windowId', 'label', 'entry', 'text', 'probabilityLabel', 'probabilityEntry', 'probabilityText',
+                 'frame_buttons', 'button_deleteState', 'button_deleteMessage', 'button_addState', 'kind', 'stateIndex', 'outputIndex', 'filling']
+    def __init__(self, editor):
+        self.frame = Frame(editor.canvas, bg=myPurple, height=CHAT_STATE_ROW_HEIGHT)
+        self.frame.grid_propagate(False)
+        self.windowId = editor.canvas.create_window(0, 0, window=self.frame, anchor="nw", width=editor.width, height=CHAT_STATE_ROW_HEIGHT, state="hidden")
+
+        self.text = StringVar()
+        self.probabilityText = StringVar()
+        self.label = Label(self.frame, anchor=E, bg=myPurple)
+        self.entry = Entry(self.frame, textvariable=self.text)
+        self.probabilityLabel = Label(self.frame, text="Probability:", anchor=E, bg=myPurple)
+        self.probabilityEntry = Entry(self.frame, width=6, textvariable=self.probabilityText,
+            validate="focusout", validatecommand=(geqZeroNumberValidationReg, '%P', "Probability"))
+        self.button_deleteState = Button(self.frame, text="Delete State", bg=myRed, command=partial(editor.onClickDeleteState, self))
+        self.frame_buttons = Frame(self.frame, bg=myPurple)
+        Button(self.frame_buttons, text="+", bg=myGreen, width=2, command=partial(editor.onClickAddMessage, self)).grid(row=0, column=0, sticky=W, pady=2)
+        self.button_deleteMessage = Button(self.frame_buttons, text="-", bg=myRed, width=2, command=partial(editor.onClickDeleteMessage, self))
+        self.button_deleteMessage.grid(row=0, column=1, sticky=W, padx=4)
+        self.button_addState = Button(self.frame, text="Add State", bg=myGreen, command=partial(editor.onClickAddState, self))
+
+        self.label.grid(row=0, column=0)
+        self.entry.grid(row=0, column=1, sticky=W)
+        self.probabilityLabel.grid(row=0, column=2, padx=0)
+        self.probabilityEntry.grid(row=0, column=3, padx=4)
+        self.button_deleteState.grid(row=0, column=2, columnspan=2, sticky=E, padx=4)
+        self.frame_buttons.grid(row=0, column=1, sticky=W)
+        self.button_addState.place(relx=0.5, rely=0.5, anchor=CENTER)
+        self.hideAll()
+
+        self.kind = None
+        self.stateIndex = -1
+        self.outputIndex = -1
+        self.filling = False
+        self.text.trace_add("write", partial(editor.onRowTextChanged, self))
+        self.probabilityText.trace_add("write", partial(editor.onRowTextChanged, self))
+
+    def hideAll(self):
+        for widget in [self.label, self.entry, self.probabilityLabel, self.probabilityEntry, self.button_deleteState, self.frame_buttons]:
+            widget.grid_remove()
+        self.button_addState.place_forget()
+
+    def setKind(self, kind):
+        if kind == self.kind:
+            return
+        self.hideAll()
+
+        if kind == "duration":
+            self.label.config(text="Duration:")
+            self.entry.config(width=20, validate="focusout", validatecommand=(geqZeroNumberValidationReg, '%P', "Duration"))
+            self.label.grid()
+            self.entry.grid()
+        elif kind == "output":
+            self.label.config(text="Message:")
+            self.entry.config(width=58, validate="none")
+            self.label.grid()
+            self.entry.grid()
+            self.probabilityLabel.grid()
+            self.probabilityEntry.grid()
+        elif kind == "buttons":
+            self.frame_buttons.grid()
+        else:
+            self.button_addState.place(relx=0.5, rely=0.5, anchor=CENTER)
+        self.frame.config(bg=myPurple if kind != "addState" else frame_settingsParent.cget("bg"))
+        self.kind = kind
+
+    def setText(self, variable, value):
+        # Only when it changed, so the cursor of an entry being typed in stays put
+        if variable.get() != value:
+            variable.set(value)
+
+# Builds widgets only for the rows in view and a couple more. Scrolling moves
+# the same rows down the canvas and fills them in from chatStatesEntries, and
+# adding or deleting states and messages just works out the row offsets again,
+# so clicks cost the same however big the scenario is.
+class ChatStateEditor(ttk.Frame):
+    def __init__(self, container, width, height):
+        super().__init__(container)
+        self.width = width
+        self.canvas = Canvas(self, width=width, height=height, yscrollincrement=CHAT_STATE_ROW_HEIGHT)
+        scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.onScroll)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+
+        self.canvas.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+
+        self.canvas.bind('<Configure>', self.layout)
+        self.canvas.bind('<Enter>', self._bound_to_mousewheel)
+        self.canvas.bind('<Leave>', self._unbound_to_mousewheel)
+
+        self.chatStates = []
+        # First row of each state, then the total number of rows
+        self.rowOffsets = [0]
+        self.rows = []
+
+    def _bound_to_mousewheel(self, event):
+        self.canvas.bind_all("<MouseWheel>", self._on_mousewheel)
+
+    def _unbound_to_mousewheel(self, event):
+        self.canvas.unbind_all("<MouseWheel>")
+
+    def _on_mousewheel(self, event):
+        self.canvas.yview_scroll(int(-1*(event.delta/120)), "units")
+        self.layout()
+
+    def onScroll(self, *args):
+        self.canvas.yview(*args)
+        self.layout()
+
+    def setChatStates(self, chatStates):
+        self.chatStates = chatStates
+        self.canvas.yview_moveto(0)
+        self.refresh()
+
+    # Call after adding or deleting states or messages
+    def refresh(self):
+        # A state has its duration row, a row per message, the +/- row and the Add State row
+        offsets = [0]
+        for chatState in self.chatStates:
+            offsets.append(offsets[-1] + len(chatState.outputs) + 3)
+        self.rowOffsets = offsets
+        self.canvas.configure(scrollregion=(0, 0, self.width, offsets[-1] * CHAT_STATE_ROW_HEIGHT))
+        self.layout()
+
+    def layout(self, event=None):
+        rowCount = self.rowOffsets[-1]
+        visibleRows = self.canvas.winfo_height() // CHAT_STATE_ROW_HEIGHT + 2
+        while len(self.rows) < visibleRows:
+            self.rows.append(ChatStateRow(self))
+
+        poolSize = len(self.rows)
+        firstRow = int(self.canvas.canvasy(0)) // CHAT_STATE_ROW_HEIGHT
+        # Row n is always drawn by the same widgets while it is in view
+        for rowIndex in range(firstRow, firstRow + poolSize):
+            row = self.rows[rowIndex % poolSize]
+            if rowIndex < rowCount:
+                self.fillRow(row, rowIndex)
+                self.canvas.coords(row.windowId, 0, rowIndex * CHAT_STATE_ROW_HEIGHT)
+                self.canvas.itemconfigure(row.windowId, state="normal")
+            else:
+                self.canvas.itemconfigure(row.windowId, state="hidden")
+
+    def fillRow(self, row, rowIndex):
+        stateIndex = bisect_right(self.rowOffsets, rowIndex) - 1
+        chatState = self.chatStates[stateIndex]
+        outputIndex = rowIndex - self.rowOffsets[stateIndex] - 1
+
+        row.filling = True
+        row.stateIndex = stateIndex
+        row.outputIndex = outputIndex
+        if outputIndex < 0:
+            row.setKind("duration")
+            row.setText(row.text, chatState.durationText)
+            if len(self.chatStates) > 1:
+                row.button_deleteState.grid()
+            else:
+                row.button_deleteState.grid_remove()
+        elif outputIndex < len(chatState.outputs):
+            row.setKind("output")
+            row.setText(row.text, chatState.outputs[outputIndex].messageText)
+            row.setText(row.probabilityText, chatState.outputs[outputIndex].probabilityText)
+        elif outputIndex == len(chatState.outputs):
+            row.setKind("buttons")
+            if len(chatState.outputs) > 1:
+                row.button_deleteMessage.grid()
+            else:
+                row.button_deleteMessage.grid_remove()
+        else:
+            row.setKind("addState")
+        row.filling = False
+
+    def onRowTextChanged(self, row, *args):
+        if row.filling:
+            return
+        chatState = self.chatStates[row.stateIndex]
+        if row.kind == "duration":
+            chatState.durationText = row.text.get()
+        elif row.kind == "output":
+            chatState.outputs[row.outputIndex].messageText = row.text.get()
+            chatState.outputs[row.outputIndex].probabilityText = row.probabilityText.get()
+
+    def onClickDeleteMessage(self, row):
+        self.chatStates[row.stateIndex].outputs.pop()
+        self.refresh()
+
+    def onClickAddMessage(self, row):
+        self.chatStates[row.stateIndex].outputs.append(ChatOutputEntries())
+        self.refresh()
+
+    def onClickDeleteState(self, row):
+        del self.chatStates[row.stateIndex]
+        self.refresh()
+
+    def onClickAddState(self, row):
+        self.chatStates.insert(row.stateIndex+1, ChatStateEntries([ChatOutputEntries()]))
+        self.refresh()
+
+chatStateEditor = ChatStateEditor(frame_settingsParent, 524, 530)
+chatStateEditor.grid(row=1, column=0, pady=10)
+
+class GlobalEntrySetting:
+    __slots__ = ['value', 'label', 'entry', 'formatFunction']
+    def __init__(self, labelText, value, row, formatFunction, validateCommand):
+        self.label = Label(frame_globalSettings, text=labelText, anchor=E)
+        self.label.grid(row=row, column=0, sticky=E)
+        
+        self.entry = Entry(frame_globalSettings)
+        if validateCommand is not None:
+            self.entry.config(validate="focusout", validatecommand=(validateCommand, '%P', labelText[0:len(labelText)-1]))
+            
+        self.entry.grid(row=row, column=1, sticky=W)
+        self.entry.insert(0, value)
+
+        self.value = value
+        self.formatFunction = formatFunction
+
+    def updateAllEntryValues(self):
+        if self.formatFunction is not None:
+            self.value = self.formatFunction(self.entry.get())
+        else:
+            self.value = self.entry.get()
+
+    def setValue(self, value):
+        self.entry.delete(0, 'end')
+        self.entry.insert(0, value)
+
+    def hide(self):
+        self.label.grid_remove()
+        self.entry.grid_remove()
+
+    def show(self):
+        self.label.grid()
+        self.entry.grid()
+
+class GlobalOptionSetting:
+    __slots__ = ['value', 'label', 'variable', 'optionMenu']
+    def __init__(self, labelText, value, row, options):
+        self.label = Label(frame_globalSettings, text=labelText, anchor=E)
+        self.label.grid(row=row, column=0, sticky=E)
+
+        self.variable = StringVar()
+        self.variable.set(value)
+        self.optionMenu = OptionMenu(frame_globalSettings, self.variable, *options)
+        self.optionMenu.grid(row=row, column=1, sticky=W)
+
+        self.value = value
+
+    def updateAllEntryValues(self):
+        self.value = self.variable.get()
+
+    def setValue(self, value):
+        self.variable.set(value)
+
+    def hide(self):
+        self.label.grid_remove()
+        self.optionMenu.grid_remove()
+
+    def show(self):
+        self.label.grid()
+        self.optionMenu.grid()
+
+class GlobalCheckSetting:
+    __slots__ = ['value', 'variable', 'checkbutton']
+    def __init__(self, labelText, value, row):
+        self.variable = BooleanVar()
+        self.variable.set(value)
+        self.checkbutton = Checkbutton(frame_globalSettings, text=labelText, variable=self.variable)
+        self.checkbutton.grid(row=row, column=1, sticky=W)
+
+        self.value = value
+
+    def updateAllEntryValues(self):
+        self.value = self.variable.get()
+
+    def setValue(self, value):
+        self.variable.set(value)
+
+    def hide(self):
+        self.checkbutton.grid_remove()
+
+    def show(self):
+        self.checkbutton.grid()
+
+def showTcpOptionsGui():
+    tcpHost.show()
+    tcpPort.show()
+    framing.show()
+    flushInterval.show()
+    tcpNoDelay.show()
+    queuePolicy.show()
+    queueMaxBytes.show()
+
+def showIrcOptionsGui():
+    tcpHost.show()
+    ircPort.show()
+    ircChannel.show()
+    ircTags.show()
+    tcpNoDelay.show()
+    queuePolicy.show()
+    queueMaxBytes.show()
+
+def showUnixOptionsGui():
+    unixPath.show()
+    framing.show()
+    flushInterval.show()
+    queuePolicy.show()
+    queueMaxBytes.show()
+
+def showUdpOptionsGui():
+    udpHost.show()
+    udpPort.show()
+    framing.show()
+    flushInterval.show()
+
+def showPipeOptionsGui():
+    pipeLocation.show()
+    framing.show()
+    flushInterval.show()
+
+def showFileOptionsGui():
+    fileLocation.show()
+    fileMaxSize.show()
+    fileLocationButton.grid()
+    fileFlushInterval.show()
+    fileSync.show()
+    fileRotate.show()
+    fileCompress.show()
+
+def hideOutputOptionsGui():
+    for setting in [tcpHost, tcpPort, ircPort, ircChannel, ircTags, unixPath, udpHost, udpPort, pipeLocation,
+                    framing, flushInterval, tcpNoDelay, queuePolicy, queueMaxBytes,
+                    fileLocation, fileMaxSize, fileFlushInterval, fileSync, fileRotate, fileCompress]:
+        setting.hide()
+    fileLocationButton.grid_remove()
+
+# Shows the settings of each output type
+outputTypeGuis = {
+    "TCP": showTcpOptionsGui,
+    "IRC": showIrcOptionsGui,
+    "Unix": showUnixOptionsGui,
+    "UDP": showUdpOptionsGui,
+    "Pipe": showPipeOptionsGui,
+    "File": showFileOptionsGui,
+}
+
+# Shows the settings every checked output type needs
+def updateOutputOptionsGui():
+    hideOutputOptionsGui()
+    for name, variable in outputTypeVariables.items():
+        if variable.get():
+            outputTypeGuis[name]()
+
+def getCheckedOutputTypes():
+    return [name for name, variable in outputTypeVariables.items() if variable.get()]
+
+def browseOutputFileLocation():
+    path = filedialog.asksaveasfilename(initialdir=cwd, title="Set Output File Name", initialfile="ChatOutput", defaultextension="*.", filetypes=[("Log File", "*.log"),("Text File", "*.txt"),("Any Extension", "*.")])
+    if (path is not None and path != ""):
+        fileLocation.entry.delete(0, 'end')
+        fileLocation.entry.insert(0, path)
+
+
+numberOfChatters = GlobalEntrySetting("Number Of Chat Users:", DEFAULT_NUMBER_OF_CHATTERS, 0, getIntFromString, positiveIntValidationReg)
+rateMode = GlobalOptionSetting("Rate Mode:", DEFAULT_RATE_MODE, 1, RATE_MODES)
+messagesPerSecond = GlobalEntrySetting("Messages Per Second:", DEFAULT_MESSAGES_PER_SECOND, 2, getFloatFromString, positiveNumberValidationReg)
+minTimeBetweenMessages = GlobalEntrySetting("Min Time Between Messages:", DEFAULT_MIN_TIME_BETWEEN_MESSAGES, 3, getFloatFromString, positiveNumberValidationReg)
+maxTimeBetweenMessages = GlobalEntrySetting("Max Time Between Messages:", DEFAULT_MAX_TIME_BETWEEN_MESSAGES, 4, getFloatFromString, positiveNumberValidationReg)
+transitionDuration = GlobalEntrySetting("Fade Between States Duration:", DEFAULT_TRANSITION_DURATION, 5, getFloatFromString, geqZeroNumberValidationReg)
+
+la = Label(frame_globalSettings, text="Output To:", anchor=E)
+la.grid(row=6, column=0, sticky=E)
+
+# Chat goes to every checked output at once, none checked only shows it here
+frame_outputCheckbuttons = LabelFrame(frame_globalSettings, bd=0)
+frame_outputCheckbuttons.grid(row=6, column=1, sticky=W)
+outputTypeVariables = {}
+outputTypeLabels = [("TCP", "TCP Server"), ("IRC", "IRC Server"), ("Unix", "Unix Socket"), ("UDP", "UDP"), ("Pipe", "Pipe"), ("File", "File")]
+for i in range(len(outputTypeLabels)):
+    name, labelText = outputTypeLabels[i]
+    outputTypeVariables[name] = BooleanVar()
+    outputTypeVariables[name].set(name in DEFAULT_OUTPUT_TYPES)
+    Checkbutton(frame_outputCheckbuttons, text=labelText, variable=outputTypeVariables[name], command=updateOutputOptionsGui).grid(row=i // 4, column=i % 4, sticky=W)
+
+tcpHost = GlobalEntrySetting("Server Host:", DEFAULT_HOST, 7, None, None)
+tcpPort = GlobalEntrySetting("TCP Port:", DEFAULT_PORT, 8, getIntFromString, positiveIntValidationReg)
+ircPort = GlobalEntrySetting("IRC Port:", DEFAULT_IRC_PORT, 9, getIntFromString, positiveIntValidationReg)
+ircChannel = GlobalEntrySetting("IRC Channel (blank = any):", "", 10, None, None)
+ircTags = GlobalCheckSetting("Send IRCv3 tags", True, 11)
+unixPath = GlobalEntrySetting("Socket Location:", DEFAULT_UNIX_PATH, 12, None, None)
+udpHost = GlobalEntrySetting("UDP Host:", DEFAULT_HOST, 13, None, None)
+udpPort = GlobalEntrySetting("UDP Port:", DEFAULT_UDP_PORT, 14, getIntFromString, positiveIntValidationReg)
+pipeLocation = GlobalEntrySetting("Named Pipe (blank = stdout):", "", 15, None, None)
+framing = GlobalOptionSetting("Message Framing:", DEFAULT_FRAMING, 16, list(FRAMINGS))
+flushInterval = GlobalEntrySetting("Batch Flush Interval:", DEFAULT_FLUSH_INTERVAL, 17, getFloatFromString, geqZeroNumberValidationReg)
+tcpNoDelay = GlobalCheckSetting("TCP_NODELAY", False, 18)
+queuePolicy = GlobalOptionSetting("Slow Client Policy:", DEFAULT_QUEUE_POLICY, 19, QUEUE_POLICIES)
+queueMaxBytes = GlobalEntrySetting("Client Queue Limit (bytes):", DEFAULT_QUEUE_MAX_BYTES, 20, getIntFromString, geqZeroIntValidationReg)
+fileLocation = GlobalEntrySetting("File Location:", DEFAULT_FILE_LOCATION, 21, None, None)
+fileLocation.entry.config(width=50)
+fileLocationButton = Button(frame_globalSettings, text="Browse", command=browseOutputFileLocation)
+fileLocationButton.grid(row=21, column=2, padx=4)
+fileMaxSize = GlobalEntrySetting("Max File Size (KB):", DEFAULT_MAX_FILE_SIZE, 22, getIntFromString, positiveIntValidationReg)
+fileFlushInterval = GlobalEntrySetting("File Flush Interval:", DEFAULT_FILE_FLUSH_INTERVAL, 23, getFloatFromString, geqZeroNumberValidationReg)
+fileSync = GlobalOptionSetting("File Sync:", DEFAULT_FILE_SYNC, 24, FILE_SYNC_POLICIES)
+fileRotate = GlobalCheckSetting("Rotate to numbered files when full", True, 25)
+fileCompress = GlobalCheckSetting("Compress rotated files", False, 26)
+workers = GlobalEntrySetting("Worker Processes:", DEFAULT_WORKERS, 27, getIntFromString, positiveIntValidationReg)
+metricsFile = GlobalEntrySetting("Metrics File:", "", 28, None, None)
+metricsPort = GlobalEntrySetting("Metrics Port (0 = off):", 0, 29, getIntFromString, geqZeroIntValidationReg)
+controlPort = GlobalEntrySetting("Control Port (0 = off):", 0, 30, getIntFromString, geqZeroIntValidationReg)
+recordingLocation = GlobalEntrySetting("Record Session To:", "", 31, None, None)
+chatterActivity = GlobalOptionSetting("Chat User Activity:", DEFAULT_CHATTER_ACTIVITY, 32, ACTIVITY_MODELS)
+chatterNamesLocation = GlobalEntrySetting("Chat User Names File:", "", 33, None, None)
+batchGeneration = GlobalCheckSetting("Generate in blocks (faster at high rates)", False, 34)
+
+updateOutputOptionsGui()
+
+# Scenario setting names and the widgets editing them, for loading scenarios
+globalSettings = {
+    'numberOfChatters': numberOfChatters,
+    'rateMode': rateMode,
+    'messagesPerSecond': messagesPerSecond,
+    'minTimeBetweenMessages': minTimeBetweenMessages,
+    'maxTimeBetweenMessages': maxTimeBetweenMessages,
+    'transitionDuration': transitionDuration,
+    'tcpHost': tcpHost,
+    'tcpPort': tcpPort,
+    'ircPort': ircPort,
+    'framing': framing,
+    'flushInterval': flushInterval,
+    'tcpNoDelay': tcpNoDelay,
+    'queuePolicy': queuePolicy,
+    'queueMaxBytes': queueMaxBytes,
+    'ircChannel': ircChannel,
+    'ircTags': ircTags,
+    'unixPath': unixPath,
+    'udpHost': udpHost,
+    'udpPort': udpPort,
+    'pipeLocation': pipeLocation,
+    'fileLocation': fileLocation,
+    'fileMaxSize': fileMaxSize,
+    'fileFlushInterval': fileFlushInterval,
+    'fileSync': fileSync,
+    'fileRotate': fileRotate,
+    'fileCompress': fileCompress,
+    'workers': workers,
+    'metricsFile': metricsFile,
+    'metricsPort': metricsPort,
+    'controlPort': controlPort,
+    'recordingLocation': recordingLocation,
+    'chatterActivity': chatterActivity,
+    'chatterNamesLocation': chatterNamesLocation,
+    'batchGeneration': batchGeneration,
+}
+
+# Settings a loaded scenario can have but the GUI has no widget for
+SETTINGS_WITHOUT_WIDGETS = ['tcpWaitForClient', 'flushBytes', 'metricsInterval', 'seed', 'zipfExponent', 'chatterNameFormat', 'pools']
+loadedSettings = ChatSettingsValues()
+
+chatStatesValues = [createDefaultChatState()]
+chatStatesEntries = []
+
+# For use in the chat generation thread
+outputTypesValue = []
+
+def setAllEntryValues():
+    numberOfChatters.updateAllEntryValues()
+    rateMode.updateAllEntryValues()
+    messagesPerSecond.updateAllEntryValues()
+    minTimeBetweenMessages.updateAllEntryValues()
+    maxTimeBetweenMessages.updateAllEntryValues()
+    transitionDuration.updateAllEntryValues()
+
+    global outputTypesValue
+    outputTypesValue = getCheckedOutputTypes()
+
+    tcpHost.updateAllEntryValues()
+    tcpPort.updateAllEntryValues()
+    ircPort.updateAllEntryValues()
+    framing.updateAllEntryValues()
+    flushInterval.updateAllEntryValues()
+    tcpNoDelay.updateAllEntryValues()
+    queuePolicy.updateAllEntryValues()
+    queueMaxBytes.updateAllEntryValues()
+    ircChannel.updateAllEntryValues()
+    ircTags.updateAllEntryValues()
+    unixPath.updateAllEntryValues()
+    udpHost.updateAllEntryValues()
+    udpPort.updateAllEntryValues()
+    pipeLocation.updateAllEntryValues()
+    fileLocation.updateAllEntryValues()
+    fileMaxSize.updateAllEntryValues()
+    fileFlushInterval.updateAllEntryValues()
+    fileSync.updateAllEntryValues()
+    fileRotate.updateAllEntryValues()
+    fileCompress.updateAllEntryValues()
+    workers.updateAllEntryValues()
+    metricsFile.updateAllEntryValues()
+    metricsPort.updateAllEntryValues()
+    controlPort.updateAllEntryValues()
+    recordingLocation.updateAllEntryValues()
+    chatterActivity.updateAllEntryValues()
+    chatterNamesLocation.updateAllEntryValues()
+    batchGeneration.updateAllEntryValues()
+
+    global chatStatesValues
+    chatStatesValues = []
+    for state in chatStatesEntries:
+        chatStatesValues.append(state.getChatStateValues())
+
+def getChatSettingsValues():
+    settings = ChatSettingsValues(chatStatesValues)
+    settings.numberOfChatters = numberOfChatters.value
+    settings.rateMode = rateMode.value
+    settings.messagesPerSecond = messagesPerSecond.value
+    settings.minTimeBetweenMessages = minTimeBetweenMessages.value
+    settings.maxTimeBetweenMessages = maxTimeBetweenMessages.value
+    settings.transitionDuration = transitionDuration.value
+    settings.outputTypes = list(outputTypesValue)
+    settings.tcpHost = tcpHost.value
+    settings.tcpPort = tcpPort.value
+    settings.ircPort = ircPort.value
+    settings.framing = framing.value
+    settings.flushInterval = flushInterval.value
+    settings.tcpNoDelay = tcpNoDelay.value
+    settings.queuePolicy = queuePolicy.value
+    settings.queueMaxBytes = queueMaxBytes.value
+    settings.ircChannel = ircChannel.value
+    settings.ircTags = ircTags.value
+    settings.unixPath = unixPath.value
+    settings.udpHost = udpHost.value
+    settings.udpPort = udpPort.value
+    settings.pipeLocation = pipeLocation.value
+    settings.fileLocation = fileLocation.value
+    settings.fileMaxSize = fileMaxSize.value
+    settings.fileFlushInterval = fileFlushInterval.value
+    settings.fileSync = fileSync.value
+    settings.fileRotate = fileRotate.value
+    settings.fileCompress = fileCompress.value
+    settings.workers = workers.value
+    settings.metricsFile = metricsFile.value
+    settings.metricsPort = metricsPort.value
+    settings.controlPort = controlPort.value
+    settings.recordingLocation = recordingLocation.value
+    settings.chatterActivity = chatterActivity.value
+    settings.chatterNamesLocation = chatterNamesLocation.value
+    settings.batchGeneration = batchGeneration.value
+    for name in SETTINGS_WITHOUT_WIDGETS:
+        setattr(settings, name, getattr(loadedSettings, name))
+    return settings
+
+######## Draw Chat States ########
+
+def drawInitialChatStates():
+    global chatStatesEntries
+    chatStatesEntries = [createChatStateEntries(chatState) for chatState in chatStatesValues]
+    chatStateEditor.setChatStates(chatStatesEntries)
+
+######## On Click Global Action Buttons ########
+
+chatGenerator = None
+
+maxInternalMessageCount = 38
+# Starts full of blank lines so the first messages show at the bottom of the chat
+chatHistory = deque(['']*maxInternalMessageCount, maxlen=maxInternalMessageCount)
+
+# The generator thread never touches Tk. It appends to these deques, which are
+# safe to share between threads, and refreshChat() drains them on the Tk main
+# loop a fixed number of times per second. pendingChatMessages is bounded the
+# same as the visible history, so however fast chat is generated a frame costs
+# at most one redraw of maxInternalMessageCount lines.
+chatFrameInterval = 33
+pendingChatMessages = deque(maxlen=maxInternalMessageCount)
+pendingChatStatus = deque()
+pendingWarnings = deque()
+
+def chatHistoryToString():
+    return "\n".join(chatHistory)
+
+def addToMessageList(message):
+    chatHistory.append(message)
+    return chatHistoryToString()
+
+def queueChatStatus(text):
+    pendingChatStatus.append(text)
+
+def queueChatMessage(outputString):
+    pendingChatMessages.append(outputString)
+
+def queueWarning(title, text):
+    pendingWarnings.append((title, text))
+
+def refreshChat():
+    while pendingChatStatus:
+        message_chat.config(text=pendingChatStatus.popleft())
+
+    newMessageCount = 0
+    for i in range(maxInternalMessageCount):
+        try:
+            chatHistory.append(pendingChatMessages.popleft())
+        except IndexError:
+            break
+        newMessageCount += 1
+
+    if newMessageCount > 0:
+        message_chat.config(text=chatHistoryToString())
+
+    while pendingWarnings:
+        title, text = pendingWarnings.popleft()
+        messagebox.showwarning(title, text)
+
+    # Runs also end by themselves, e.g. when an output fails, and their outputs are closed then
+    if button_sendChat['state'] != DISABLED and (chatGenerationThread is None or not chatGenerationThread.is_alive()):
+        button_stop.config(state=DISABLED)
+        button_sendChat.config(state=DISABLED)
+
+    root.after(chatFrameInterval, refreshChat)
+
+# TCP, IRC and Unix socket servers keep listening between runs so clients stay
+# connected across STOP and START. Each is replaced when its settings change.
+serverOutputs = {}
+
+def createChatGenerator():
+    setAllEntryValues()
+
+    global serverOutputs
+    settings = getChatSettingsValues()
+    serverOutputs = createServerOutputs(settings, serverOutputs, keepListening=True)
+    return ChatGenerator(settings, createChatOutput(settings, serverOutputs),
+        onMessage=queueChatMessage, onStatus=queueChatStatus, onWarning=queueWarning)
+
+statsUpdateInterval = 1000
+
+def formatLatency(seconds):
+    if seconds is None:
+        return "-"
+    if seconds == float('inf'):
+        return ">1s"
+    return "%.0fus" % (seconds * 1e6) if seconds < 1e-3 else "%.1fms" % (seconds * 1e3)
+
+def updateStatsPanel():
+    if chatGenerationThread is not None and chatGenerationThread.is_alive():
+        metrics = chatGenerator.metrics
+        label_rate.config(text="Rate: " + "%.1f" % metrics.sampleRate() + " / " + "%.1f" % metrics.targetRate + " msgs/sec")
+
+        statsLines = ["State " + str(metrics.stateIndex+1) + ("" if metrics.fadePercentage >= 1.0 else ", fading in " + "%.0f" % (metrics.fadePercentage * 100) + "%")]
+        for sink in list(metrics.sinks.values()):
+            statsLines.append(sink.name + ": " + str(sink.messages) + " msgs, " + "%.1f" % (sink.bytes / 1000.0) + " KB, send p50 "
+                + formatLatency(sink.latencyPercentile(50)) + " p99 " + formatLatency(sink.latencyPercentile(99))
+                + ", " + str(sink.failures) + " failed, " + str(sink.dropped) + " dropped, "
+                + "%.1f" % (sink.queuedBytes / 1000.0) + " KB queued, " + str(sink.disconnects) + " slow clients disconnected")
+        label_stats.config(text="\n".join(statsLines))
+
+    root.after(statsUpdateInterval, updateStatsPanel)
+
+chatGenerationThread = None
+def stopChatGenerationThread():
+    global chatGenerationThread
+
+    if chatGenerationThread is not None and chatGenerationThread.is_alive():
+        chatGenerator.stop()
+        chatGenerationThread.join()
+
+        button_stop.config(state=DISABLED)
+        button_sendChat.config(state=DISABLED)
+
+        # Get rid of connection to TCP message if there
+        pendingChatStatus.clear()
+        message_chat.config(text=chatHistoryToString())
+
+def startChatGenerationThread():
+    if not doesAllValidationPass():
+        return
+
+    global chatGenerationThread
+    global chatGenerator
+
+    stopChatGenerationThread()
+
+    chatGenerator = createChatGenerator()
+    chatGenerationThread = threading.Thread(target=chatGenerator.run, daemon=True)
+    chatGenerationThread.start()
+
+    button_sendChat.config(state=ACTIVE)
+    button_stop.config(state=ACTIVE)
+
+def onClickSaveSettings():
+    if not doesAllValidationPass():
+        return
+
+    # Tried stopping thread after selecting file but weird behavior where thread was still alive but wasn't reaching new code
+    stopChatGenerationThread()
+    path = filedialog.asksaveasfilename(initialdir=cwd, title="Save as", initialfile="ChatSimulatorSettings", defaultextension=".json",
+        filetypes=[("Scenario", "*.json"),("Compact Scenario", "*.chatscn"),("Any Extension", "*.*")])
+    if not path:
+        return
+    try:
+        setAllEntryValues()
+        saveScenario(getChatSettingsValues(), path)
+    except (OSError, ScenarioError) as e:
+        messagebox.showwarning("Save Failed", "Error saving settings: " + str(e))
+
+def applySettings(settings):
+    for name, setting in globalSettings.items():
+        setting.setValue(getattr(settings, name))
+
+    for name, variable in outputTypeVariables.items():
+        variable.set(name in settings.outputTypes)
+    updateOutputOptionsGui()
+
+    global loadedSettings
+    global chatStatesValues
+    loadedSettings = settings
+    chatStatesValues = settings.chatStates
+
+    drawInitialChatStates()
+
+def onClickLoadSettings():
+    stopChatGenerationThread()
+    path = filedialog.askopenfilename(initialdir=cwd, title="Load Settings",
+        filetypes=[("Scenario", "*.json *.chatscn"),("Old Settings", "*.pkl"),("Any File", "*.*")])
+    if not path:
+        return
+    try:
+        settings = loadScenario(path)
+    except ScenarioError as e:
+        messagebox.showwarning("Load Failed", str(e))
+        return
+    applySettings(settings)
+
+######## Global Action Buttons ########
+
+button_save = Button(frame_actions, text="Save Settings", width=36, command=onClickSaveSettings)
+button_load = Button(frame_actions, text="Load Settings", width=36, command=onClickLoadSettings)
+button_stop = Button(frame_actions, text="STOP", command=stopChatGenerationThread, state=DISABLED)
+button_start = Button(frame_actions, text="START", command=startChatGenerationThread, height=2)
+
+button_save.grid(row=0, column=0, padx=2, pady=2)
+button_load.grid(row=0, column=1, padx=2, pady=2)
+button_stop.grid(row=1, column=0, columnspan=2, sticky=W+E, padx=2, pady=2)
+button_start.grid(row=2, column=0, columnspan=2, sticky=W+E, padx=2, pady=2)
+
+drawInitialChatStates()
+updateStatsPanel()
+refreshChat()
+root.mainloop()
\ No newline at end of file
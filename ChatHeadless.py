@@ -0,0 +1,174 @@
+import argparse
+import sys
+
+from ChatEngine import ChatGenerator
+from ChatOutputs import createChatOutput, OUTPUT_TYPES, FRAMINGS, FILE_SYNC_POLICIES, QUEUE_POLICIES
+from ChatScenario import loadScenario, validateSettings, ScenarioError
+from ChatScheduler import RATE_MODES
+from ChatPopulation import ACTIVITY_MODELS
+
+# Runs a scenario without the GUI. Started with
+#   py ChatSimulator.py --headless scenario.json --duration 600
+# or directly with
+#   py ChatHeadless.py scenario.json --duration 600
+
+def createArgumentParser():
+    parser = argparse.ArgumentParser(prog="ChatSimulator.py --headless", description="Run a chat scenario without the GUI.")
+    parser.add_argument("scenario", help="scenario JSON file")
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds (default: run until interrupted)")
+    parser.add_argument("--workers", type=int, default=None, help="generate in this many processes (default: the scenario's, usually 1)")
+    parser.add_argument("--rate-mode", choices=RATE_MODES, default=None, help="override how the time between messages is chosen")
+    parser.add_argument("--rate", type=float, default=None, help="override messages per second for the Fixed and Poisson rate modes")
+    parser.add_argument("--chatters", type=int, default=None, help="override the number of chat users")
+    parser.add_argument("--activity", choices=ACTIVITY_MODELS, default=None, help="override how much each chat user talks compared to the others")
+    parser.add_argument("--zipf-exponent", type=float, default=None, help="how steeply activity falls off in the Zipf activity model")
+    parser.add_argument("--names", default=None, help="name chat users from this file, one name per line")
+    parser.add_argument("--output", choices=OUTPUT_TYPES, action="append", default=None,
+        help="override the scenario output types, repeat to send chat to several at once")
+    parser.add_argument("--host", default=None, help="override the host TCP and IRC listen on")
+    parser.add_argument("--port", type=int, default=None, help="override the TCP port")
+    parser.add_argument("--irc-port", type=int, default=None, help="override the IRC port")
+    parser.add_argument("--udp-host", default=None, help="override where UDP is sent")
+    parser.add_argument("--udp-port", type=int, default=None, help="override the port UDP is sent to")
+    parser.add_argument("--unix-path", default=None, help="override the Unix domain socket location")
+    parser.add_argument("--pipe", default=None, help="write Pipe output to this named pipe instead of stdout")
+    parser.add_argument("--no-wait-for-client", action="store_true", help="start generating before the first TCP client connects")
+    parser.add_argument("--irc-channel", default=None, help="only send IRC chat on this channel (default: every channel clients join)")
+    parser.add_argument("--no-irc-tags", action="store_true", help="never send IRCv3 tags to IRC clients")
+    parser.add_argument("--framing", choices=list(FRAMINGS), default=None, help="override how TCP, Unix, UDP and Pipe messages are delimited")
+    parser.add_argument("--flush-interval", type=float, default=None, help="batch TCP, Unix, UDP and Pipe messages for up to this many seconds (0 sends each message right away)")
+    parser.add_argument("--flush-bytes", type=int, default=None, help="send a batch early once it reaches this many bytes (for UDP, the largest datagram)")
+    parser.add_argument("--queue-policy", choices=QUEUE_POLICIES, default=None, help="what to do when a TCP, IRC or Unix socket client falls behind and its queue is full")
+    parser.add_argument("--queue-max-bytes", type=int, default=None, help="bytes queued per TCP, IRC or Unix socket client before the queue policy applies (0 = unbounded)")
+    parser.add_argument("--no-delay", action="store_true", help="set TCP_NODELAY on client sockets")
+    parser.add_argument("--file", default=None, help="override the output file location")
+    parser.add_argument("--max-file-size", type=int, default=None, help="override the max file size in KB")
+    parser.add_argument("--file-flush-interval", type=float, default=None, help="seconds between file flushes (0 flushes every message)")
+    parser.add_argument("--file-sync", choices=FILE_SYNC_POLICIES, default=None, help="when to fsync the output file")
+    parser.add_argument("--no-rotate", action="store_true", help="stop at the max file size instead of rotating")
+    parser.add_argument("--compress", action="store_true", help="gzip rotated files")
+    parser.add_argument("--metrics-file", default=None, help="rewrite this JSON file with live metrics every metrics interval")
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on 127.0.0.1 at this port")
+    parser.add_argument("--metrics-interval", type=float, default=None, help="seconds between metrics file updates")
+    parser.add_argument("--seed", type=int, default=None, help="seed the random numbers so runs say the same things in the same order (0 = different every run)")
+    parser.add_argument("--batch", action="store_true", help="generate messages in blocks, faster at high rates, see ChatBatch.py")
+    parser.add_argument("--control-port", type=int, default=None, help="accept control commands on 127.0.0.1 at this port, see ChatControl.py")
+    parser.add_argument("--record", default=None, help="also record the run to this file, see ChatRecording.py")
+    parser.add_argument("--echo", action="store_true", help="print every message to stdout")
+    return parser
+
+def printStatus(text):
+    print(text, file=sys.stderr, flush=True)
+
+def printWarning(title, text):
+    print(title + ": " + text, file=sys.stderr, flush=True)
+
+def printMessage(outputString):
+    print(outputString, flush=True)
+
+def applyOverrides(settings, args):
+    if args.workers is not None:
+        settings.workers = max(1, args.workers)
+    if args.rate_mode is not None:
+        settings.rateMode = args.rate_mode
+    if args.rate is not None:
+        settings.messagesPerSecond = args.rate
+    if args.chatters is not None:
+        settings.numberOfChatters = max(1, args.chatters)
+    if args.activity is not None:
+        settings.chatterActivity = args.activity
+    if args.zipf_exponent is not None:
+        settings.zipfExponent = max(0.0, args.zipf_exponent)
+    if args.names is not None:
+        settings.chatterNamesLocation = args.names
+    if args.output is not None:
+        settings.outputTypes = [outputType for outputType in args.output if outputType != "None"]
+    if args.host is not None:
+        settings.tcpHost = args.host
+    if args.port is not None:
+        settings.tcpPort = args.port
+    if args.irc_port is not None:
+        settings.ircPort = args.irc_port
+    if args.udp_host is not None:
+        settings.udpHost = args.udp_host
+    if args.udp_port is not None:
+        settings.udpPort = args.udp_port
+    if args.unix_path is not None:
+        settings.unixPath = args.unix_path
+    if args.pipe is not None:
+        settings.pipeLocation = args.pipe
+    if args.no_wait_for_client:
+        settings.tcpWaitForClient = False
+    if args.irc_channel is not None:
+        settings.ircChannel = args.irc_channel
+    if args.no_irc_tags:
+        settings.ircTags = False
+    if args.framing is not None:
+        settings.framing = args.framing
+    if args.flush_interval is not None:
+        settings.flushInterval = args.flush_interval
+    if args.flush_bytes is not None:
+        settings.flushBytes = args.flush_bytes
+    if args.queue_policy is not None:
+        settings.queuePolicy = args.queue_policy
+    if args.queue_max_bytes is not None:
+        settings.queueMaxBytes = max(0, args.queue_max_bytes)
+    if args.no_delay:
+        settings.tcpNoDelay = True
+    if args.file is not None:
+        settings.fileLocation = args.file
+    if args.max_file_size is not None:
+        settings.fileMaxSize = args.max_file_size
+    if args.file_flush_interval is not None:
+        settings.fileFlushInterval = args.file_flush_interval
+    if args.file_sync is not None:
+        settings.fileSync = args.file_sync
+    if args.no_rotate:
+        settings.fileRotate = False
+    if args.compress:
+        settings.fileCompress = True
+    if args.metrics_file is not None:
+        settings.metricsFile = args.metrics_file
+    if args.metrics_port is not None:
+        settings.metricsPort = args.metrics_port
+    if args.metrics_interval is not None:
+        settings.metricsInterval = args.metrics_interval
+    if args.seed is not None:
+        settings.seed = args.seed
+    if args.batch:
+        settings.batchGeneration = True
+    if args.control_port is not None:
+        settings.controlPort = args.control_port
+    if args.record is not None:
+        settings.recordingLocation = args.record
+
+def main(argv=None):
+    args = createArgumentParser().parse_args(argv)
+
+    try:
+        settings = loadScenario(args.scenario)
+        # Overrides are held to the same rules as the scenario
+        applyOverrides(settings, args)
+        validateSettings(settings)
+    except ScenarioError as e:
+        printWarning("Error", str(e))
+        return 2
+    if args.echo and "Pipe" in settings.outputTypes and not settings.pipeLocation:
+        printWarning("Error", "--echo can't be used while chat is written to stdout")
+        return 2
+
+    generator = ChatGenerator(settings, createChatOutput(settings),
+        onMessage=printMessage if args.echo else None, onStatus=printStatus, onWarning=printWarning, duration=args.duration)
+
+    try:
+        generator.run()
+    except KeyboardInterrupt:
+        pass
+
+    scheduler = generator.scheduler
+    printStatus("Generated " + str(generator.messageCount) + " messages in " + "%.2f" % generator.elapsed + "s (achieved "
+        + "%.1f" % (generator.messageCount / generator.elapsed if generator.elapsed > 0 else 0.0) + " msgs/sec, target " + "%.1f" % scheduler.targetRate() + ")")
+    return 1 if generator.failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+import bisect
+import json
+import os
+import selectors
+import socket
+import threading
+import time
+
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Live counters for a run. The generator thread updates them for every message
+# with a few attribute writes and one bisect, and readers (the GUI stats panel,
+# the metrics file and the Prometheus endpoint) take snapshots whenever they
+# like. Readers may see a message counted in one field but not yet in another,
+# which is fine for monitoring.
+
+# Send latency histogram bucket upper bounds in seconds: 1us, 2us, 4us ... ~1s
+LATENCY_BUCKETS = [1e-6 * 2**i for i in range(21)]
+
+DEFAULT_METRICS_INTERVAL = 1.0
+METRICS_HOST = "127.0.0.1"
+
+class SinkMetrics:
+    __slots__ = ['name', 'messages', 'bytes', 'failures', 'dropped', 'disconnects', 'queuedBytes', 'queuePeakBytes', 'latencyCounts', 'latencySum']
+    def __init__(self, name):
+        self.name = name
+        self.messages = 0
+        self.bytes = 0
+        self.failures = 0
+        self.dropped = 0
+        # Clients the output disconnected for reading too slowly
+        self.disconnects = 0
+        # Bytes waiting to be sent to all clients together, and the most any one client has had waiting
+        self.queuedBytes = 0
+        self.queuePeakBytes = 0
+        # One more bucket than bounds for anything slower than the last bound
+        self.latencyCounts = array('Q', [0]*(len(LATENCY_BUCKETS)+1))
+        self.latencySum = 0.0
+
+    def recordSend(self, byteCount, latency):
+        self.messages += 1
+        self.bytes += byteCount
+        self.latencyCounts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.latencySum += latency
+
+    # A batch of messages handed over in one write call
+    def recordBatch(self, messageCount, byteCount, latency):
+        self.messages += messageCount
+        self.bytes += byteCount
+        self.latencyCounts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.latencySum += latency
+
+    def latencyPercentile(self, percentile):
+        total = sum(self.latencyCounts)
+        if total == 0:
+            return None
+        target = total * percentile / 100.0
+        seen = 0
+        for i in range(len(self.latencyCounts)):
+            seen += self.latencyCounts[i]
+            if seen >= target:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+class ChatMetrics:
+    def __init__(self):
+        self.sinks = {}
+        self.reset()
+
+    def reset(self):
+        self.sinks = {}
+        self.messageCount = 0
+        self.stateIndex = 0
+        self.fadePercentage = 1.0
+        self.targetRate = 0.0
+        self.startTime = time.monotonic()
+
+        self.achievedRate = 0.0
+        self.rateSampleTime = self.startTime
+        self.rateSampleCount = 0
+
+    def getSink(self, name):
+        sink = self.sinks.get(name)
+        if sink is None:
+            sink = SinkMetrics(name)
+            self.sinks[name] = sink
+        return sink
+
+    # The achieved rate is measured over windows of at least a second, whoever
+    # asks for it first in a window moves it on
+    def sampleRate(self):
+        now = time.monotonic()
+        elapsed = now - self.rateSampleTime
+        if elapsed >= 1.0:
+            messageCount = self.messageCount
+            self.achievedRate = (messageCount - self.rateSampleCount) / elapsed
+            self.rateSampleTime = now
+            self.rateSampleCount = messageCount
+        return self.achievedRate
+
+    def snapshot(self):
+        sinks = {}
+        for sink in list(self.sinks.values()):
+            sinks[sink.name] = {
+                'messages': sink.messages,
+                'bytes': sink.bytes,
+                'failures': sink.failures,
+                'dropped': sink.dropped,
+                'disconnects': sink.disconnects,
+                'queuedBytes': sink.queuedBytes,
+                'queuePeakBytes': sink.queuePeakBytes,
+                'latencyP50': sink.latencyPercentile(50),
+                'latencyP99': sink.latencyPercentile(99),
+                'latencyBuckets': dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"], sink.latencyCounts.tolist())),
+                'latencySum': sink.latencySum,
+            }
+
+        return {
+            'time': time.time(),
+            'uptime': time.monotonic() - self.startTime,
+            'messages': self.messageCount,
+            'stateIndex': self.stateIndex,
+            'fadePercentage': self.fadePercentage,
+            'achievedRate': self.sampleRate(),
+            'targetRate': self.targetRate,
+            'sinks': sinks,
+        }
+
+def formatPrometheusValue(value):
+    if value is None:
+        return "NaN"
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def formatPrometheus(snapshot):
+    lines = []
+
+    def addMetric(name, metricType, helpText, samples):
+        lines.append("# HELP " + name + " " + helpText)
+        lines.append("# TYPE " + name + " " + metricType)
+        for labels, value in samples:
+            lines.append(name + labels + " " + formatPrometheusValue(value))
+
+    sinks = snapshot['sinks']
+    def sinkSamples(field):
+        return [('{sink="' + name + '"}', sink[field]) for name, sink in sinks.items()]
+
+    addMetric("chatsim_messages_total", "counter", "Messages generated.", [("", snapshot['messages'])])
+    addMetric("chatsim_sink_messages_total", "counter", "Messages written per sink.", sinkSamples('messages'))
+    addMetric("chatsim_sink_bytes_total", "counter", "Bytes written per sink.", sinkSamples('bytes'))
+    addMetric("chatsim_sink_failures_total", "counter", "Failed sends per sink.", sinkSamples('failures'))
+    addMetric("chatsim_sink_dropped_total", "counter", "Messages a sink dropped instead of sending.", sinkSamples('dropped'))
+    addMetric("chatsim_sink_disconnects_total", "counter", "Clients a sink disconnected for reading too slowly.", sinkSamples('disconnects'))
+    addMetric("chatsim_sink_queued_bytes", "gauge", "Bytes waiting to be sent to a sink's clients.", sinkSamples('queuedBytes'))
+    addMetric("chatsim_sink_queue_peak_bytes", "gauge", "Most bytes any one client of a sink has had waiting.", sinkSamples('queuePeakBytes'))
+
+    lines.append("# HELP chatsim_send_latency_seconds Time spent in each sink write call.")
+    lines.append("# TYPE chatsim_send_latency_seconds histogram")
+    for name, sink in sinks.items():
+        cumulative = 0
+        for bound, count in sink['latencyBuckets'].items():
+            cumulative += count
+            lines.append('chatsim_send_latency_seconds_bucket{sink="' + name + '",le="' + bound + '"} ' + str(cumulative))
+        lines.append('chatsim_send_latency_seconds_sum{sink="' + name + '"} ' + formatPrometheusValue(sink['latencySum']))
+        lines.append('chatsim_send_latency_seconds_count{sink="' + name + '"} ' + str(cumulative))
+
+    addMetric("chatsim_state_index", "gauge", "Chat state currently generating, starting at 1.", [("", snapshot['stateIndex'] + 1)])
+    addMetric("chatsim_fade_ratio", "gauge", "How far the fade into the current state is, 1 when not fading.", [("", snapshot['fadePercentage'])])
+    addMetric("chatsim_achieved_rate", "gauge", "Messages per second over the last second.", [("", snapshot['achievedRate'])])
+    addMetric("chatsim_target_rate", "gauge", "Messages per second the settings ask for.", [("", snapshot['targetRate'])])
+    return "\n".join(lines) + "\n"
+
+# Publishes snapshots of a ChatMetrics while a run is going: rewritten as JSON
+# to metricsFile every interval, and/or served as Prometheus text on
+# http://127.0.0.1:metricsPort/metrics
+class MetricsReporter:
+    def __init__(self, metrics, metricsFile="", metricsPort=0, interval=DEFAULT_METRICS_INTERVAL):
+        self.metrics = metrics
+        self.metricsFile = metricsFile
+        self.metricsPort = metricsPort
+        self.interval = interval
+
+        self.stopEvent = threading.Event()
+        self.fileThread = None
+        self.httpServer = None
+        self.httpThread = None
+        self.wakeupReader = None
+        self.wakeupWriter = None
+
+    def start(self):
+        self.stopEvent.clear()
+        if self.metricsFile:
+            self.fileThread = threading.Thread(target=self.writePeriodically, daemon=True)
+            self.fileThread.start()
+
+        if self.metricsPort > 0:
+            reporter = self
+            class MetricsRequestHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = formatPrometheus(reporter.metrics.snapshot()).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            # Raises OSError if the port is taken, callers report it
+            self.httpServer = ThreadingHTTPServer((METRICS_HOST, self.metricsPort), MetricsRequestHandler)
+            self.httpServer.daemon_threads = True
+            self.wakeupReader, self.wakeupWriter = socket.socketpair()
+            self.httpThread = threading.Thread(target=self.serveHttp, daemon=True)
+            self.httpThread.start()
+
+    # Like serve_forever(), but stop() wakes it through wakeupWriter instead of
+    # it polling for shutdown every half second
+    def serveHttp(self):
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.httpServer, selectors.EVENT_READ)
+            selector.register(self.wakeupReader, selectors.EVENT_READ)
+            while not self.stopEvent.is_set():
+                for key, mask in selector.select():
+                    if key.fileobj is self.httpServer:
+                        self.httpServer.handle_request()
+
+    def writeFile(self):
+        temporaryFile = self.metricsFile + ".tmp"
+        with open(temporaryFile, "w", encoding="utf-8") as f:
+            json.dump(self.metrics.snapshot(), f)
+        os.replace(temporaryFile, self.metricsFile)
+
+    def writePeriodically(self):
+        while not self.stopEvent.wait(self.interval):
+            try:
+                self.writeFile()
+            except OSError:
+                pass
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.fileThread is not None:
+            self.fileThread.join()
+            self.fileThread = None
+            # Leave the final numbers behind
+            try:
+                self.writeFile()
+            except OSError:
+                pass
+
+        if self.httpServer is not None:
+            self.wakeupWriter.send(b'\0')
+            self.httpThread.join()
+            self.httpServer.server_close()
+            self.wakeupReader.close()
+            self.wakeupWriter.close()
+            self.httpServer = None
+            self.httpThread = None
+            self.wakeupReader = None
+            self.wakeupWriter = None
@@ -0,0 +1,1631 @@
+import socket
+import selectors
+import threading
+import struct
+import time
+
+from collections import deque
+
+import os
+import stat
+import sys
+import gzip
+import shutil
+import uuid
+import zlib
+
+# Every output has the same shape so the generator doesn't care where chat goes:
+#   open(onStatus) is called once on the generator thread before the first message
+#   write(outputString) sends one message and returns how many bytes that took,
+#     it may also be called from the GUI thread
+#   writeFramed(data, messageCount) sends messages already framed with
+#     frameMessages(outputStrings, framing) and returns how many bytes that took
+#   cancel() may be called from another thread to unblock open()
+#   close() releases everything and may be called more than once
+# Failures are raised as ChatOutputError with a message that can be shown to the user.
+# framing is how writeFramed expects messages to be framed, None if they aren't
+# needed at all. name identifies the output in metrics, and if metrics is set to a
+# ChatMetrics.SinkMetrics the output counts messages it had to drop there.
+# nonBlocking is True if writes never wait on a reader or the disk. sinks lists
+# the outputs a FanOutChatOutput writes to, and is empty for every other output.
+
+class ChatOutputError(Exception):
+    pass
+
+# Values of the outputTypes setting, see createChatOutput()
+OUTPUT_TYPES = ["TCP", "IRC", "Unix", "UDP", "Pipe", "File", "None"]
+
+######## Framing ########
+
+# How each encoded message is delimited on a stream so consumers can split them.
+# "None" sends the bare message like older versions did.
+def frameNone(data):
+    return data
+
+def frameNewline(data):
+    return data + b'\n'
+
+def frameCrlf(data):
+    return data + b'\r\n'
+
+def frameLengthPrefix(data):
+    # 4 byte big-endian length, then the message
+    return struct.pack('>I', len(data)) + data
+
+FRAMINGS = {
+    "None": frameNone,
+    "Newline": frameNewline,
+    "CRLF": frameCrlf,
+    "Length": frameLengthPrefix,
+}
+
+DEFAULT_FRAMING = "None"
+# With a flush interval of 0 every message is handed to the clients as soon as it is written
+DEFAULT_FLUSH_INTERVAL = 0.0
+DEFAULT_FLUSH_BYTES = 65536
+
+# How long close() keeps sending what clients haven't received yet
+CLOSE_DRAIN_TIMEOUT = 1.0
+
+# What a TCP or IRC output does when a client reads slower than chat is
+# generated and its queue is full:
+#   "Block" makes the generator wait until every client has room again, so
+#     the whole run slows down to the slowest client
+#   "DropOldest" throws away the oldest queued messages to make room
+#   "DropNewest" throws away the new message
+#   "Disconnect" disconnects the client
+# Anything dropped is counted in the output's metrics.
+QUEUE_POLICIES = ["Block", "DropOldest", "DropNewest", "Disconnect"]
+
+DEFAULT_QUEUE_POLICY = "DropOldest"
+# Per client, 0 lets queues grow without limit
+DEFAULT_QUEUE_MAX_BYTES = 8388608
+
+# Queued writes are packed into sends of up to this many bytes
+SEND_CHUNK_BYTES = 262144
+# How often a blocked write checks whether the output was cancelled
+BLOCK_CHECK_INTERVAL = 0.1
+
+def getFramingFunction(framing):
+    try:
+        return FRAMINGS[framing]
+    except KeyError:
+        raise ChatOutputError("Unknown framing " + str(framing) + ". Use one of: " + ", ".join(FRAMINGS))
+
+# Frames a list of messages into one buffer, the same bytes as framing them one at a time
+def frameMessages(outputStrings, framing):
+    if framing is None or not outputStrings:
+        return b''
+    if framing == "Newline":
+        return ("\n".join(outputStrings) + "\n").encode('utf-8')
+    if framing == "CRLF":
+        return ("\r\n".join(outputStrings) + "\r\n").encode('utf-8')
+    if framing == "None":
+        return "".join(outputStrings).encode('utf-8')
+    frameMessage = getFramingFunction(framing)
+    return b''.join([frameMessage(outputString.encode('utf-8')) for outputString in outputStrings])
+
+######## Outputs ########
+
+class NoChatOutput:
+    name = "None"
+    framing = None
+    metrics = None
+    nonBlocking = True
+    sinks = ()
+
+    def open(self, onStatus=None):
+        pass
+
+    def write(self, outputString):
+        return 0
+
+    def writeFramed(self, data, messageCount):
+        return 0
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+class TcpChatClient:
+    __slots__ = ['socket', 'address', 'queue', 'queueCounts', 'queuedBytes', 'sentOffset', 'wantsWrite', 'overflowed']
+    def __init__(self, clientSocket, address):
+        self.socket = clientSocket
+        self.address = address
+        # Framed data of each write, and how many messages it holds. The first
+        # one may be sent up to sentOffset already.
+        self.queue = deque()
+        self.queueCounts = deque()
+        self.queuedBytes = 0
+        self.sentOffset = 0
+        self.wantsWrite = False
+        # Set when the "Disconnect" policy gave up on the client
+        self.overflowed = False
+
+# TCP server that any number of clients can join or leave at any time. Each
+# message is encoded once and queued for every client, and a selector thread
+# does all the socket I/O so slow or extra clients never cost the generator
+# thread a syscall. A client that disconnects is just dropped.
+#
+# Client queues hold up to queueMaxBytes, after which queuePolicy decides
+# what happens, see QUEUE_POLICIES. Whole writes are dropped, never part of one.
+#
+# When flushInterval is above 0, messages are first packed into one pending
+# buffer that goes out once it reaches flushBytes or is flushInterval seconds
+# old, so at high rates many messages share one send() per client.
+#
+# With keepListening, close() only ends the run: the server keeps listening,
+# keeps its clients and goes on sending what they haven't received, and the
+# next open() starts right away. shutdown() closes everything.
+class TcpChatOutput:
+    name = "TCP"
+    sinks = ()
+
+    def __init__(self, host, port, waitForClient=True, framing=DEFAULT_FRAMING,
+            flushInterval=DEFAULT_FLUSH_INTERVAL, flushBytes=DEFAULT_FLUSH_BYTES, noDelay=False,
+            queuePolicy=DEFAULT_QUEUE_POLICY, queueMaxBytes=DEFAULT_QUEUE_MAX_BYTES, keepListening=False):
+        if queuePolicy not in QUEUE_POLICIES:
+            raise ChatOutputError("Unknown queue policy " + str(queuePolicy) + ". Use one of: " + ", ".join(QUEUE_POLICIES))
+        self.host = host
+        self.port = port
+        self.waitForClient = waitForClient
+        self.framing = framing
+        self.frameMessage = getFramingFunction(framing)
+        self.flushInterval = flushInterval
+        self.flushBytes = flushBytes
+        self.noDelay = noDelay
+        self.queuePolicy = queuePolicy
+        self.queueMaxBytes = queueMaxBytes
+        self.nonBlocking = queuePolicy != "Block"
+        self.keepListening = keepListening
+        # What createServerOutput() made the output from, see getServerOutputKey()
+        self.settingsKey = None
+        self.metrics = None
+
+        self.pending = bytearray()
+        self.pendingCount = 0
+        self.pendingSince = 0.0
+        # Bytes queued for all clients together
+        self.queuedBytes = 0
+        self.cancelled = False
+
+        self.serverSocket = None
+        self.selector = None
+        self.wakeupReader = None
+        self.wakeupWriter = None
+        self.wakeupPending = False
+        self.ioThread = None
+        self.closing = False
+        self.closeDeadline = 0.0
+
+        self.clients = []
+        self.clientsLock = threading.Lock()
+        self.clientsHaveRoom = threading.Condition(self.clientsLock)
+        self.clientConnected = threading.Event()
+
+    def address(self):
+        return str(self.host) + ":" + str(self.port)
+
+    def clientCount(self):
+        return len(self.clients)
+
+    def open(self, onStatus=None):
+        if self.ioThread is None:
+            self.listen()
+
+        with self.clientsLock:
+            self.cancelled = False
+            # Clients kept from the last run count as connected
+            if not self.clients:
+                self.clientConnected.clear()
+
+        if self.waitForClient and not self.clientConnected.is_set():
+            if onStatus is not None:
+                onStatus("Waiting for " + self.name + " client at " + self.address() + "...")
+            self.clientConnected.wait()
+
+    def listen(self):
+        self.shutdown()
+
+        try:
+            self.serverSocket = self.createServerSocket()
+            self.serverSocket.listen()
+            self.serverSocket.setblocking(False)
+        except OSError:
+            self.shutdown()
+            raise ChatOutputError("Unable to create " + self.name + " server at " + self.address() + ". Try another "
+                + ("location." if self.name == "Unix" else "host or port."))
+
+        self.wakeupReader, self.wakeupWriter = socket.socketpair()
+        self.wakeupReader.setblocking(False)
+        self.wakeupWriter.setblocking(False)
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.serverSocket, selectors.EVENT_READ, None)
+        self.selector.register(self.wakeupReader, selectors.EVENT_READ, None)
+
+        self.closing = False
+        self.ioThread = threading.Thread(target=self.serve, daemon=True)
+        self.ioThread.start()
+
+    def createServerSocket(self):
+        serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Restarting on the same port mustn't wait for old connections to time out
+        serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        serverSocket.bind((self.host, self.port))
+        return serverSocket
+
+    def write(self, outputString):
+        return self.writeFramed(self.frameMessage(outputString.encode('utf-8')), 1)
+
+    def writeFramed(self, data, messageCount):
+        with self.clientsLock:
+            self.waitForRoom()
+            if not self.clients:
+                # Nobody is connected to receive it
+                self.countDropped(messageCount)
+
+            if self.flushInterval <= 0:
+                self.sendToClients(data, messageCount)
+                return len(data)
+
+            if not self.pending:
+                self.pendingSince = time.monotonic()
+            self.pending += data
+            self.pendingCount += messageCount
+            if len(self.pending) >= self.flushBytes:
+                self.flushPending()
+        return len(data)
+
+    # These must be called holding clientsLock
+    def sendToClients(self, data, messageCount):
+        needsWakeup = False
+        for client in self.clients:
+            if self.enqueue(client, data, messageCount):
+                needsWakeup = True
+
+        if needsWakeup:
+            self.requestWakeup()
+
+    def countDropped(self, messageCount):
+        if self.metrics is not None:
+            self.metrics.dropped += messageCount
+
+    def updateQueueMetrics(self, client):
+        metrics = self.metrics
+        if metrics is not None:
+            metrics.queuedBytes = self.queuedBytes
+            if client.queuedBytes > metrics.queuePeakBytes:
+                metrics.queuePeakBytes = client.queuedBytes
+
+    # With the "Block" policy, waits until no client's queue is full. Only
+    # called on the generator side, never on the selector thread.
+    def waitForRoom(self):
+        if self.queuePolicy != "Block" or self.queueMaxBytes <= 0:
+            return
+        while not self.cancelled and not self.closing \
+                and any(client.queuedBytes >= self.queueMaxBytes for client in self.clients):
+            self.clientsHaveRoom.wait(BLOCK_CHECK_INTERVAL)
+
+    # Queues data for client whatever the policy
+    def queueData(self, client, data, messageCount):
+        client.queue.append(data)
+        client.queueCounts.append(messageCount)
+        client.queuedBytes += len(data)
+        self.queuedBytes += len(data)
+        self.updateQueueMetrics(client)
+
+    # Queues data for client following the queue policy. Returns True if the
+    # selector thread has to be woken up.
+    def enqueue(self, client, data, messageCount):
+        if client.overflowed:
+            self.countDropped(messageCount)
+            return False
+
+        needsWakeup = not client.queue
+        if self.queueMaxBytes > 0 and client.queuedBytes + len(data) > self.queueMaxBytes and client.queue:
+            if self.queuePolicy == "DropNewest":
+                self.countDropped(messageCount)
+                return False
+            elif self.queuePolicy == "DropOldest":
+                self.dropOldest(client, len(data))
+            elif self.queuePolicy == "Disconnect":
+                self.disconnectSlowClient(client, messageCount)
+                return True
+        self.queueData(client, data, messageCount)
+        return needsWakeup
+
+    def dropOldest(self, client, byteCount):
+        # The first write may be partly sent already, so it has to go out whole
+        queue = client.queue
+        counts = client.queueCounts
+        first = queue.popleft()
+        firstCount = counts.popleft()
+        while queue and client.queuedBytes + byteCount > self.queueMaxBytes:
+            data = queue.popleft()
+            client.queuedBytes -= len(data)
+            self.queuedBytes -= len(data)
+            self.countDropped(counts.popleft())
+        queue.appendleft(first)
+        counts.appendleft(firstCount)
+
+    def disconnectSlowClient(self, client, messageCount):
+        client.overflowed = True
+        self.countDropped(messageCount + sum(client.queueCounts))
+        self.clearQueue(client)
+        if self.metrics is not None:
+            self.metrics.disconnects += 1
+
+    def clearQueue(self, client):
+        self.queuedBytes -= client.queuedBytes
+        client.queue.clear()
+        client.queueCounts.clear()
+        client.queuedBytes = 0
+        client.sentOffset = 0
+        if self.metrics is not None:
+            self.metrics.queuedBytes = self.queuedBytes
+
+    def requestWakeup(self):
+        if not self.wakeupPending:
+            self.wakeupPending = True
+            self.wakeup()
+
+    def flushPending(self):
+        if self.pending:
+            self.sendToClients(self.pending, self.pendingCount)
+            self.pending = bytearray()
+            self.pendingCount = 0
+
+    def wakeup(self):
+        try:
+            self.wakeupWriter.send(b'\0')
+        except (OSError, AttributeError):
+            pass
+
+    def cancel(self):
+        # Unblocks open() if it is still waiting for the first client, and writes
+        # waiting for room
+        self.clientConnected.set()
+        with self.clientsLock:
+            self.cancelled = True
+            self.clientsHaveRoom.notify_all()
+
+    def close(self):
+        if self.keepListening and self.ioThread is not None:
+            with self.clientsLock:
+                self.flushPending()
+            return
+        self.shutdown()
+
+    def shutdown(self):
+        if self.ioThread is not None:
+            with self.clientsLock:
+                self.flushPending()
+                self.closeDeadline = time.monotonic() + CLOSE_DRAIN_TIMEOUT
+                self.closing = True
+                self.clientsHaveRoom.notify_all()
+            self.wakeup()
+            self.ioThread.join()
+            self.ioThread = None
+
+        with self.clientsLock:
+            for client in self.clients:
+                client.socket.close()
+            self.clients = []
+            self.pending = bytearray()
+            self.pendingCount = 0
+            self.queuedBytes = 0
+
+        for openSocket in (self.serverSocket, self.wakeupReader, self.wakeupWriter):
+            if openSocket is not None:
+                openSocket.close()
+        self.serverSocket = None
+        self.wakeupReader = None
+        self.wakeupWriter = None
+
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+
+    ######## Selector thread ########
+
+    def serve(self):
+        timeout = self.flushInterval if self.flushInterval > 0 else None
+        while True:
+            if self.closing:
+                # Give clients what was already written before shutting down
+                if not self.hasUnsentData() or time.monotonic() >= self.closeDeadline:
+                    return
+                timeout = 0.05
+            elif timeout is not None:
+                self.flushPendingIfDue()
+
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj is self.serverSocket:
+                    self.acceptClients()
+                elif key.fileobj is self.wakeupReader:
+                    self.onWakeup()
+                else:
+                    client = key.data
+                    if mask & selectors.EVENT_READ:
+                        self.readClient(client)
+                    if mask & selectors.EVENT_WRITE:
+                        self.flushClient(client)
+
+    def hasUnsentData(self):
+        with self.clientsLock:
+            return any(client.queue for client in self.clients)
+
+    def flushPendingIfDue(self):
+        with self.clientsLock:
+            if self.pending and time.monotonic() - self.pendingSince >= self.flushInterval:
+                self.flushPending()
+
+    def acceptClients(self):
+        while True:
+            try:
+                clientSocket, addr = self.serverSocket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+
+            clientSocket.setblocking(False)
+            if self.noDelay:
+                clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = self.createClient(clientSocket, addr)
+            with self.clientsLock:
+                self.clients.append(client)
+            self.selector.register(clientSocket, selectors.EVENT_READ, client)
+            self.onClientAccepted(client)
+
+    # Subclasses speaking a protocol hook in here, see IrcChatOutput
+    def createClient(self, clientSocket, address):
+        return TcpChatClient(clientSocket, address)
+
+    def onClientAccepted(self, client):
+        self.clientConnected.set()
+
+    def onClientData(self, client, data):
+        pass
+
+    def onWakeup(self):
+        try:
+            while self.wakeupReader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        slowClients = []
+        with self.clientsLock:
+            self.wakeupPending = False
+            for client in self.clients:
+                if client.overflowed:
+                    slowClients.append(client)
+                elif client.queue and not client.wantsWrite:
+                    client.wantsWrite = True
+                    self.selector.modify(client.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+        for client in slowClients:
+            self.dropClient(client)
+
+    def readClient(self, client):
+        # Plain TCP clients aren't expected to send anything, reading mostly notices when they leave
+        try:
+            data = client.socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+
+        if not data:
+            self.dropClient(client)
+        else:
+            self.onClientData(client, data)
+
+    def flushClient(self, client):
+        with self.clientsLock:
+            if not client.queue:
+                return
+            try:
+                sent = client.socket.send(self.nextSendData(client))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                sent = -1
+
+            if sent >= 0:
+                self.consumeSent(client, sent)
+                if not client.queue:
+                    client.wantsWrite = False
+                    self.selector.modify(client.socket, selectors.EVENT_READ, client)
+                if self.queuePolicy == "Block":
+                    self.clientsHaveRoom.notify_all()
+                return
+
+        self.dropClient(client)
+
+    # These must be called holding clientsLock
+    def nextSendData(self, client):
+        queue = client.queue
+        if client.sentOffset == 0 and len(queue) > 1 and len(queue[0]) < SEND_CHUNK_BYTES:
+            # Pack small writes into one send
+            chunks = []
+            messageCount = 0
+            byteCount = 0
+            while queue and byteCount < SEND_CHUNK_BYTES:
+                data = queue.popleft()
+                chunks.append(data)
+                byteCount += len(data)
+                messageCount += client.queueCounts.popleft()
+            queue.appendleft(b''.join(chunks))
+            client.queueCounts.appendleft(messageCount)
+        return memoryview(queue[0])[client.sentOffset:]
+
+    def consumeSent(self, client, sent):
+        client.sentOffset += sent
+        client.queuedBytes -= sent
+        self.queuedBytes -= sent
+        if client.sentOffset >= len(client.queue[0]):
+            client.queue.popleft()
+            client.queueCounts.popleft()
+            client.sentOffset = 0
+        if self.metrics is not None:
+            self.metrics.queuedBytes = self.queuedBytes
+
+    def dropClient(self, client):
+        with self.clientsLock:
+            if client not in self.clients:
+                return
+            self.clients.remove(client)
+            self.clearQueue(client)
+            self.clientsHaveRoom.notify_all()
+
+        self.selector.unregister(client.socket)
+        client.socket.close()
+
+######## IRC ########
+
+# Stand-in for Twitch's chat server (tmi.twitch.tv) so bots can connect to the
+# simulator unmodified. Clients log in with PASS/NICK (anything is accepted),
+# may request the twitch.tv/tags capability, JOIN channels and get PING'd back.
+# Chat goes to every client that joined the channel as PRIVMSG lines, with
+# IRCv3 tags for clients that asked for them:
+#   @badge-info=;badges=;color=#1E90FF;display-name=ChatUser7;...;user-type= :chatuser7!chatuser7@chatuser7.tmi.twitch.tv PRIVMSG #channel :hello
+# The chatter name is whatever comes before ": " in the message.
+
+IRC_SERVER_NAME = "tmi.twitch.tv"
+IRC_CAPABILITIES = ["twitch.tv/tags", "twitch.tv/commands", "twitch.tv/membership"]
+IRC_COLORS = ["#FF0000", "#0000FF", "#008000", "#B22222", "#FF7F50", "#9ACD32", "#FF4500", "#2E8B57",
+    "#DAA520", "#D2691E", "#5F9EA0", "#1E90FF", "#FF69B4", "#8A2BE2", "#00FF7F"]
+IRC_ROOM_ID = "100000001"
+
+# Chatters whose prefix and tag bytes are kept ready, the cache starts over when full
+IRC_CHATTER_CACHE_SIZE = 100000
+# A client sending a line longer than this is dropped
+IRC_MAX_LINE_LENGTH = 8192
+
+def escapeIrcTagValue(value):
+    return value.replace("\\", "\\\\").replace(";", "\\:").replace(" ", "\\s").replace("\r", "\\r").replace("\n", "\\n")
+
+# Everything about a chatter's lines that doesn't change between messages
+class IrcChatter:
+    __slots__ = ['prefix', 'tagsHead', 'tagsMiddle', 'tagsTail']
+    def __init__(self, name):
+        login = "".join(name.lower().split()) or "chatuser"
+        userId = str(zlib.crc32(login.encode('utf-8')))
+        self.prefix = (":" + login + "!" + login + "@" + login + "." + IRC_SERVER_NAME + " PRIVMSG ").encode('utf-8')
+        # The message id and timestamp go between these
+        self.tagsHead = ("@badge-info=;badges=;color=" + IRC_COLORS[int(userId) % len(IRC_COLORS)] + ";display-name="
+            + escapeIrcTagValue(name) + ";emotes=;first-msg=0;flags=;id=").encode('utf-8')
+        self.tagsMiddle = (";mod=0;returning-chatter=0;room-id=" + IRC_ROOM_ID + ";subscriber=0;tmi-sent-ts=").encode('utf-8')
+        self.tagsTail = (";turbo=0;user-id=" + userId + ";user-type= ").encode('utf-8')
+
+class IrcChatClient(TcpChatClient):
+    __slots__ = ['readBuffer', 'nick', 'wantsTags', 'channels']
+    def __init__(self, clientSocket, address):
+        super().__init__(clientSocket, address)
+        self.readBuffer = bytearray()
+        self.nick = None
+        self.wantsTags = False
+        self.channels = []
+
+class IrcChatOutput(TcpChatOutput):
+    name = "IRC"
+
+    # channel sends chat only on that channel, "" on whatever channels clients join.
+    # tags False never sends IRCv3 tags even to clients that ask for them.
+    def __init__(self, host, port, waitForClient=True, channel="", tags=True, noDelay=False,
+            queuePolicy=DEFAULT_QUEUE_POLICY, queueMaxBytes=DEFAULT_QUEUE_MAX_BYTES, keepListening=False):
+        super().__init__(host, port, waitForClient, "None", 0.0, DEFAULT_FLUSH_BYTES, noDelay, queuePolicy, queueMaxBytes, keepListening)
+        # Only used for batches, which are split back into messages. Length
+        # framing keeps a message with a line break in it whole.
+        self.framing = "Length"
+        self.channel = channel.lower()
+        self.tags = tags
+        self.chatters = {}
+        # (channel bytes, with tags, clients) for every kind of line that has to be built
+        self.deliveries = []
+        self.deliveriesChanged = True
+        self.messageIdPrefix = uuid.uuid4().hex[:20]
+        self.messageNumber = 0
+
+    def getChatter(self, name):
+        chatter = self.chatters.get(name)
+        if chatter is None:
+            if len(self.chatters) >= IRC_CHATTER_CACHE_SIZE:
+                self.chatters = {}
+            chatter = IrcChatter(name)
+            self.chatters[name] = chatter
+        return chatter
+
+    # Returns the bytes of every line built for the message, one line per
+    # channel and tags kind. Like TCP, a line going to several clients counts once.
+    def write(self, outputString):
+        name, separator, message = outputString.partition(": ")
+        if not separator:
+            name, message = "", outputString
+        chatter = self.getChatter(name)
+        if "\n" in message or "\r" in message:
+            # A line break would end the PRIVMSG early and start a line of its own
+            message = message.replace("\r\n", " ").replace("\r", " ").replace("\n", " ")
+        body = b" :" + message.encode('utf-8') + b"\r\n"
+
+        with self.clientsLock:
+            self.waitForRoom()
+            if self.deliveriesChanged:
+                self.updateDeliveries()
+            if not self.deliveries:
+                self.countDropped(1)
+                return 0
+
+            tags = None
+            byteCount = 0
+            needsWakeup = False
+            for channel, withTags, clients in self.deliveries:
+                line = chatter.prefix + channel + body
+                if withTags:
+                    if tags is None:
+                        tags = self.buildTags(chatter)
+                    line = tags + line
+                byteCount += len(line)
+                for client in clients:
+                    if self.enqueue(client, line, 1):
+                        needsWakeup = True
+
+            if needsWakeup:
+                self.requestWakeup()
+        return byteCount
+
+    def writeFramed(self, data, messageCount):
+        # Every client may need different lines, so batches go message by message
+        byteCount = 0
+        for message in splitLengthFramed(data):
+            byteCount += self.write(str(message, 'utf-8'))
+        return byteCount
+
+    def buildTags(self, chatter):
+        self.messageNumber += 1
+        messageId = self.messageIdPrefix[:8] + "-" + self.messageIdPrefix[8:12] + "-" + self.messageIdPrefix[12:16] + "-" \
+            + self.messageIdPrefix[16:20] + "-" + "%012x" % self.messageNumber
+        return b''.join([chatter.tagsHead, messageId.encode('ascii'), chatter.tagsMiddle,
+            str(int(time.time() * 1000)).encode('ascii'), chatter.tagsTail])
+
+    # Must be called holding clientsLock
+    def updateDeliveries(self):
+        deliveries = {}
+        for client in self.clients:
+            for channel in client.channels:
+                if self.channel and channel != self.channel:
+                    continue
+                key = (channel, self.tags and client.wantsTags)
+                deliveries.setdefault(key, []).append(client)
+        self.deliveries = [(channel.encode('utf-8'), withTags, clients) for (channel, withTags), clients in deliveries.items()]
+        self.deliveriesChanged = False
+
+    ######## Selector thread ########
+
+    def createClient(self, clientSocket, address):
+        return IrcChatClient(clientSocket, address)
+
+    def onClientAccepted(self, client):
+        # Only clients that joined a channel count as connected
+        pass
+
+    def dropClient(self, client):
+        super().dropClient(client)
+        with self.clientsLock:
+            self.deliveriesChanged = True
+
+    def onClientData(self, client, data):
+        client.readBuffer += data
+        while True:
+            end = client.readBuffer.find(b'\n')
+            if end < 0:
+                if len(client.readBuffer) > IRC_MAX_LINE_LENGTH:
+                    self.dropClient(client)
+                return
+            line = bytes(client.readBuffer[:end]).rstrip(b'\r').decode('utf-8', 'replace')
+            del client.readBuffer[:end+1]
+            if line and not self.onClientCommand(client, line):
+                self.dropClient(client)
+                return
+
+    def reply(self, client, lines):
+        # Replies always go out, whatever the queue policy
+        with self.clientsLock:
+            for line in lines:
+                self.queueData(client, (line + "\r\n").encode('utf-8'), 0)
+            self.requestWakeup()
+
+    # Returns False when the client should be disconnected
+    def onClientCommand(self, client, line):
+        command, params = parseIrcLine(line)
+        nick = client.nick or "*"
+        server = ":" + IRC_SERVER_NAME
+
+        if command == "PING":
+            self.reply(client, [server + " PONG " + IRC_SERVER_NAME + " :" + (params[-1] if params else IRC_SERVER_NAME)])
+        elif command == "CAP":
+            subcommand = params[0].upper() if params else ""
+            if subcommand == "LS":
+                self.reply(client, [server + " CAP * LS :" + " ".join(IRC_CAPABILITIES)])
+            elif subcommand == "REQ" and len(params) > 1:
+                requested = params[-1].split()
+                if all(capability in IRC_CAPABILITIES for capability in requested):
+                    if "twitch.tv/tags" in requested:
+                        client.wantsTags = True
+                        with self.clientsLock:
+                            self.deliveriesChanged = True
+                    self.reply(client, [server + " CAP * ACK :" + params[-1]])
+                else:
+                    self.reply(client, [server + " CAP * NAK :" + params[-1]])
+        elif command == "PASS" or command == "USER" or command == "PONG":
+            pass
+        elif command == "NICK":
+            if not params:
+                return False
+            client.nick = params[0].lower()
+            nick = client.nick
+            self.reply(client, [
+                server + " 001 " + nick + " :Welcome, GLHF!",
+                server + " 002 " + nick + " :Your host is " + IRC_SERVER_NAME,
+                server + " 003 " + nick + " :This server is rather new",
+                server + " 004 " + nick + " :-",
+                server + " 375 " + nick + " :-",
+                server + " 372 " + nick + " :You are in a maze of twisty passages, all alike.",
+                server + " 376 " + nick + " :>"])
+        elif client.nick is None:
+            self.reply(client, [server + " 451 * :You have not registered"])
+        elif command == "JOIN" and params:
+            userPrefix = ":" + nick + "!" + nick + "@" + nick + "." + IRC_SERVER_NAME
+            for channel in params[0].lower().split(","):
+                if channel in client.channels:
+                    continue
+                replies = [userPrefix + " JOIN " + channel]
+                if client.wantsTags:
+                    replies.append("@emote-only=0;followers-only=-1;r9k=0;room-id=" + IRC_ROOM_ID + ";slow=0;subs-only=0 "
+                        + server + " ROOMSTATE " + channel)
+                replies.append(":" + nick + "." + IRC_SERVER_NAME + " 353 " + nick + " = " + channel + " :" + nick)
+                replies.append(":" + nick + "." + IRC_SERVER_NAME + " 366 " + nick + " " + channel + " :End of /NAMES list")
+                self.reply(client, replies)
+                with self.clientsLock:
+                    client.channels.append(channel)
+                    self.deliveriesChanged = True
+            self.clientConnected.set()
+        elif command == "PART" and params:
+            userPrefix = ":" + nick + "!" + nick + "@" + nick + "." + IRC_SERVER_NAME
+            for channel in params[0].lower().split(","):
+                if channel in client.channels:
+                    with self.clientsLock:
+                        client.channels.remove(channel)
+                        self.deliveriesChanged = True
+                    self.reply(client, [userPrefix + " PART " + channel])
+        elif command == "PRIVMSG":
+            # What bots say isn't sent on to anyone
+            pass
+        elif command == "QUIT":
+            return False
+        else:
+            self.reply(client, [server + " 421 " + nick + " " + command + " :Unknown command"])
+        return True
+
+# Splits a line from a client into the command and its parameters, ignoring
+# any tags and prefix
+def parseIrcLine(line):
+    if line.startswith("@"):
+        line = line.partition(" ")[2]
+    if line.startswith(":"):
+        line = line.partition(" ")[2]
+
+    line, separator, trailing = line.partition(" :")
+    params = line.split()
+    if not params:
+        return "", []
+    if separator:
+        params.append(trailing)
+    return params[0].upper(), params[1:]
+
+# When a file output writes to disk: every second or so by default, and fsync
+# only if asked. "Flush" fsyncs every write to disk, "Close" only when a file is
+# closed or rotated.
+FILE_SYNC_POLICIES = ["None", "Flush", "Close"]
+
+DEFAULT_FILE_FLUSH_INTERVAL = 1.0
+DEFAULT_FILE_SYNC = "None"
+
+# Keeps the file open for the whole run and buffers lines in memory. The size is
+# tracked as bytes are written instead of asking the file system. Once the file
+# reaches maxSizeKB it is renamed to the next free location.1, location.2, ...
+# (gzipped in the background if compress is set) and a new file is started.
+# Without rotate the run stops at the size limit like older versions did.
+class FileChatOutput:
+    name = "File"
+    framing = "CRLF" if os.linesep == "\r\n" else "Newline"
+    nonBlocking = False
+    sinks = ()
+
+    def __init__(self, location, maxSizeKB, flushInterval=DEFAULT_FILE_FLUSH_INTERVAL, sync=DEFAULT_FILE_SYNC,
+            rotate=True, compress=False, flushBytes=DEFAULT_FLUSH_BYTES):
+        self.location = location
+        self.maxSizeKB = maxSizeKB
+        self.flushInterval = flushInterval
+        self.sync = sync
+        self.rotate = rotate
+        self.compress = compress
+        self.flushBytes = flushBytes
+        self.metrics = None
+
+        self.file = None
+        self.fileSize = 0
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.error = None
+        self.nextRotationNumber = 1
+
+        self.closedEvent = threading.Event()
+        self.flushThread = None
+        self.compressThreads = []
+
+    def open(self, onStatus=None):
+        self.close()
+
+        try:
+            self.file = open(self.location, "ab")
+            self.fileSize = self.file.tell()
+        except OSError:
+            raise ChatOutputError("Unable to write to file " + str(self.location))
+
+        self.error = None
+        self.closedEvent.clear()
+        if self.flushInterval > 0:
+            self.flushThread = threading.Thread(target=self.flushPeriodically, daemon=True)
+            self.flushThread.start()
+
+    def write(self, outputString):
+        return self.writeFramed((outputString + os.linesep).encode('utf-8'), 1)
+
+    # A batch is never split, so a file can go over the size limit by up to one batch
+    def writeFramed(self, data, messageCount):
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            if self.file is None:
+                raise ChatOutputError("Unable to write to file " + str(self.location))
+
+            self.buffer += data
+            self.fileSize += len(data)
+
+            try:
+                if self.fileSize >= self.maxSizeKB * 1000:
+                    if not self.rotate:
+                        self.flushBuffer()
+                        raise ChatOutputError("File size limit " + str(self.maxSizeKB) + "KB reached. Increase max file size or save to a new file.")
+                    self.rotateFile()
+                elif self.flushInterval <= 0 or len(self.buffer) >= self.flushBytes:
+                    self.flushBuffer()
+            except OSError:
+                raise ChatOutputError("Unable to write to file " + str(self.location))
+        return len(data)
+
+    # These must be called holding lock
+    def flushBuffer(self):
+        if not self.buffer:
+            return
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer = bytearray()
+        if self.sync == "Flush":
+            os.fsync(self.file.fileno())
+
+    def closeFile(self):
+        self.flushBuffer()
+        if self.sync != "None":
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.file = None
+
+    def getRotationLocation(self):
+        while True:
+            rotationLocation = self.location + "." + str(self.nextRotationNumber)
+            self.nextRotationNumber += 1
+            if not os.path.exists(rotationLocation) and not os.path.exists(rotationLocation + ".gz"):
+                return rotationLocation
+
+    def rotateFile(self):
+        self.closeFile()
+
+        rotationLocation = self.getRotationLocation()
+        os.replace(self.location, rotationLocation)
+        if self.compress:
+            compressThread = threading.Thread(target=compressFile, args=(rotationLocation,), daemon=True)
+            compressThread.start()
+            self.compressThreads = [thread for thread in self.compressThreads if thread.is_alive()]
+            self.compressThreads.append(compressThread)
+
+        self.file = open(self.location, "ab")
+        self.fileSize = 0
+
+    def flushPeriodically(self):
+        while not self.closedEvent.wait(self.flushInterval):
+            with self.lock:
+                if self.file is None:
+                    return
+                try:
+                    self.flushBuffer()
+                except OSError:
+                    self.error = ChatOutputError("Unable to write to file " + str(self.location))
+                    return
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        self.closedEvent.set()
+        if self.flushThread is not None:
+            self.flushThread.join()
+            self.flushThread = None
+
+        with self.lock:
+            if self.file is not None:
+                try:
+                    self.closeFile()
+                except OSError:
+                    self.file = None
+
+        for compressThread in self.compressThreads:
+            compressThread.join()
+        self.compressThreads = []
+
+def compressFile(location):
+    try:
+        with open(location, "rb") as source, gzip.open(location + ".gz", "wb") as destination:
+            shutil.copyfileobj(source, destination)
+        os.remove(location)
+    except OSError:
+        # Keep the uncompressed file rather than lose it
+        pass
+
+######## Unix domain sockets ########
+
+DEFAULT_UNIX_PATH = "ChatSimulator.sock"
+
+# The TCP server on a Unix domain socket at path, for consumers on the same
+# machine: the same framing, batching and client queues without the loopback
+# TCP stack. A socket file left at path by an earlier run is replaced, and the
+# file is removed again on shutdown.
+class UnixChatOutput(TcpChatOutput):
+    name = "Unix"
+
+    def __init__(self, path, waitForClient=True, framing=DEFAULT_FRAMING,
+            flushInterval=DEFAULT_FLUSH_INTERVAL, flushBytes=DEFAULT_FLUSH_BYTES,
+            queuePolicy=DEFAULT_QUEUE_POLICY, queueMaxBytes=DEFAULT_QUEUE_MAX_BYTES, keepListening=False):
+        super().__init__(None, None, waitForClient, framing, flushInterval, flushBytes, False, queuePolicy, queueMaxBytes, keepListening)
+        self.path = path
+
+    def address(self):
+        return str(self.path)
+
+    def createServerSocket(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError("Unix domain sockets aren't available")
+        try:
+            # Never remove anything that isn't a socket
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+        serverSocket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            serverSocket.bind(self.path)
+        except OSError:
+            serverSocket.close()
+            raise
+        return serverSocket
+
+    def shutdown(self):
+        listening = self.serverSocket is not None
+        super().shutdown()
+        if listening:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+######## UDP ########
+
+# Largest payload of one UDP datagram over IPv4
+UDP_MAX_DATAGRAM_BYTES = 65507
+
+# Sends chat as UDP datagrams to host:port, for testing lossy ingestion at high
+# packet rates. Nothing waits on the receiver: a datagram the socket can't take
+# right away, that is too big or that is refused is counted as dropped.
+#
+# With framing "None" every message is its own datagram. Otherwise messages are
+# framed like TCP, and with flushInterval above 0 packed into datagrams of up to
+# flushBytes (at most UDP_MAX_DATAGRAM_BYTES), never splitting a message.
+class UdpChatOutput:
+    name = "UDP"
+    nonBlocking = True
+    sinks = ()
+
+    def __init__(self, host, port, framing=DEFAULT_FRAMING, flushInterval=DEFAULT_FLUSH_INTERVAL, flushBytes=DEFAULT_FLUSH_BYTES):
+        self.host = host
+        self.port = port
+        self.messageFraming = framing
+        self.frameMessage = getFramingFunction(framing)
+        # Batches from worker processes are cut into datagrams at message
+        # boundaries, so unframed messages come length-prefixed
+        self.framing = "Length" if framing == "None" else framing
+        self.delimiter = {"Newline": b'\n', "CRLF": b'\r\n'}.get(framing)
+        self.flushInterval = flushInterval
+        self.datagramBytes = max(1, min(flushBytes, UDP_MAX_DATAGRAM_BYTES))
+        self.metrics = None
+
+        self.socket = None
+        self.pending = bytearray()
+        self.lock = threading.Lock()
+        self.closedEvent = threading.Event()
+        self.flushThread = None
+
+    def address(self):
+        return str(self.host) + ":" + str(self.port)
+
+    def open(self, onStatus=None):
+        self.close()
+
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.socket.connect((self.host, self.port))
+            self.socket.setblocking(False)
+        except OSError:
+            self.close()
+            raise ChatOutputError("Unable to send UDP to " + self.address() + ". Try another host or port.")
+
+        self.closedEvent.clear()
+        if self.flushInterval > 0 and self.messageFraming != "None":
+            self.flushThread = threading.Thread(target=self.flushPeriodically, daemon=True)
+            self.flushThread.start()
+
+    def write(self, outputString):
+        data = self.frameMessage(outputString.encode('utf-8'))
+        if self.flushInterval <= 0 or self.messageFraming == "None":
+            self.sendDatagram(data)
+            return len(data)
+
+        with self.lock:
+            self.pending += data
+            if len(self.pending) >= self.datagramBytes:
+                self.sendFullDatagrams()
+        return len(data)
+
+    def writeFramed(self, data, messageCount):
+        if self.messageFraming == "None":
+            view = memoryview(data)
+            offset = 0
+            while offset < len(data):
+                end = offset + 4 + struct.unpack_from('>I', data, offset)[0]
+                self.sendDatagram(view[offset+4:end])
+                offset = end
+            return len(data) - 4 * messageCount
+
+        with self.lock:
+            self.pending += data
+            if self.flushInterval <= 0:
+                self.flushPending()
+            else:
+                self.sendFullDatagrams()
+        return len(data)
+
+    def sendDatagram(self, data):
+        try:
+            self.socket.send(data)
+        except OSError:
+            # The socket buffer is full, the datagram is too big or nobody is listening
+            if self.metrics is not None:
+                self.metrics.dropped += self.countMessages(data)
+
+    def countMessages(self, data):
+        if self.messageFraming == "None":
+            return 1
+        if self.delimiter is not None:
+            return data.count(self.delimiter)
+        count = 0
+        offset = 0
+        while offset < len(data):
+            offset += 4 + struct.unpack_from('>I', data, offset)[0]
+            count += 1
+        return count
+
+    # How many bytes from the start of data fit in one datagram without
+    # splitting a message. A message bigger than a datagram goes on its own.
+    def findDatagramEnd(self, data):
+        if self.delimiter is not None:
+            end = data.rfind(self.delimiter, 0, self.datagramBytes)
+            if end < 0:
+                end = data.find(self.delimiter)
+            return end + len(self.delimiter)
+
+        end = 0
+        while end < len(data):
+            nextEnd = end + 4 + struct.unpack_from('>I', data, end)[0]
+            if nextEnd > self.datagramBytes and end > 0:
+                break
+            end = nextEnd
+        return end
+
+    # These must be called holding lock
+    def sendFullDatagrams(self):
+        while len(self.pending) >= self.datagramBytes:
+            end = self.findDatagramEnd(self.pending)
+            self.sendDatagram(self.pending[:end])
+            del self.pending[:end]
+
+    def flushPending(self):
+        self.sendFullDatagrams()
+        if self.pending:
+            self.sendDatagram(self.pending)
+            self.pending = bytearray()
+
+    def flushPeriodically(self):
+        while not self.closedEvent.wait(self.flushInterval):
+            with self.lock:
+                if self.socket is None:
+                    return
+                self.flushPending()
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        self.closedEvent.set()
+        if self.flushThread is not None:
+            self.flushThread.join()
+            self.flushThread = None
+
+        with self.lock:
+            if self.socket is not None:
+                self.flushPending()
+                self.socket.close()
+                self.socket = None
+            self.pending = bytearray()
+
+######## Pipes ########
+
+# Writes chat to standard output when location is "", otherwise to the named
+# pipe (or file) at location, so a consumer can read it straight from the
+# simulator:
+#   py ChatSimulator.py --headless scenario.json --output Pipe | consumer
+# Messages are framed like TCP and written in batches like the file output.
+# Nothing is dropped: when the reader falls behind, writes wait for it.
+class PipeChatOutput:
+    name = "Pipe"
+    nonBlocking = False
+    sinks = ()
+
+    def __init__(self, location="", framing=DEFAULT_FRAMING, flushInterval=DEFAULT_FLUSH_INTERVAL, flushBytes=DEFAULT_FLUSH_BYTES):
+        self.location = location
+        self.framing = framing
+        self.frameMessage = getFramingFunction(framing)
+        self.flushInterval = flushInterval
+        self.flushBytes = flushBytes
+        self.metrics = None
+
+        self.pipe = None
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.error = None
+        # While open() waits for a named pipe's reader, and the reader cancel() opened to end the wait
+        self.opening = False
+        self.cancelReader = None
+
+        self.closedEvent = threading.Event()
+        self.flushThread = None
+
+    def address(self):
+        return "standard output" if not self.location else "pipe " + str(self.location)
+
+    def open(self, onStatus=None):
+        self.close()
+
+        if not self.location:
+            self.pipe = getattr(sys.stdout, 'buffer', None)
+            if self.pipe is None:
+                raise ChatOutputError("There is no standard output to write to.")
+            sys.stdout.flush()
+        else:
+            if onStatus is not None and os.path.exists(self.location) and stat.S_ISFIFO(os.stat(self.location).st_mode):
+                onStatus("Waiting for a reader on " + self.address() + "...")
+            # Opening a named pipe waits until something opens it for reading
+            with self.lock:
+                self.opening = True
+            try:
+                self.pipe = open(self.location, "ab")
+            except OSError:
+                raise ChatOutputError("Unable to write to " + self.address())
+            finally:
+                with self.lock:
+                    self.opening = False
+                    if self.cancelReader is not None:
+                        os.close(self.cancelReader)
+                        self.cancelReader = None
+
+        self.error = None
+        self.closedEvent.clear()
+        if self.flushInterval > 0:
+            self.flushThread = threading.Thread(target=self.flushPeriodically, daemon=True)
+            self.flushThread.start()
+
+    def write(self, outputString):
+        return self.writeFramed(self.frameMessage(outputString.encode('utf-8')), 1)
+
+    def writeFramed(self, data, messageCount):
+        with self.lock:
+            if self.error is not None:
+                raise self.error
+            if self.pipe is None:
+                raise ChatOutputError("Unable to write to " + self.address())
+
+            self.buffer += data
+            if self.flushInterval <= 0 or len(self.buffer) >= self.flushBytes:
+                self.flushBuffer()
+        return len(data)
+
+    # Must be called holding lock
+    def flushBuffer(self):
+        if not self.buffer:
+            return
+        try:
+            self.pipe.write(self.buffer)
+            self.pipe.flush()
+        except BrokenPipeError:
+            raise ChatOutputError("The reader of " + self.address() + " has gone away.")
+        except OSError:
+            raise ChatOutputError("Unable to write to " + self.address())
+        finally:
+            self.buffer = bytearray()
+
+    def flushPeriodically(self):
+        while not self.closedEvent.wait(self.flushInterval):
+            with self.lock:
+                if self.pipe is None:
+                    return
+                try:
+                    self.flushBuffer()
+                except ChatOutputError as e:
+                    self.error = e
+                    return
+
+    def cancel(self):
+        # Become the reader a named pipe is waiting for, so open() can return
+        with self.lock:
+            if self.opening and self.cancelReader is None and hasattr(os, 'O_NONBLOCK'):
+                try:
+                    self.cancelReader = os.open(self.location, os.O_RDONLY | os.O_NONBLOCK)
+                except OSError:
+                    pass
+
+    def close(self):
+        self.closedEvent.set()
+        if self.flushThread is not None:
+            self.flushThread.join()
+            self.flushThread = None
+
+        with self.lock:
+            if self.pipe is not None:
+                try:
+                    self.flushBuffer()
+                except ChatOutputError:
+                    pass
+                if self.location:
+                    try:
+                        self.pipe.close()
+                    except OSError:
+                        pass
+                self.pipe = None
+
+######## Fan-out ########
+
+# Bytes a sink written on its own thread may have waiting before new messages
+# to it are dropped
+FANOUT_QUEUE_MAX_BYTES = 33554432
+
+# Splits a batch framed with frameLengthPrefix() back into messages
+def splitLengthFramed(data):
+    view = memoryview(data)
+    messages = []
+    offset = 0
+    while offset < len(data):
+        end = offset + 4 + struct.unpack_from('>I', data, offset)[0]
+        messages.append(view[offset+4:end])
+        offset = end
+    return messages
+
+# One of the outputs a FanOutChatOutput writes to. Outputs that can block are
+# written on their own thread from a bounded queue, the rest straight away.
+# Once a sink fails everything sent to it is counted as dropped.
+class FanOutSink:
+    __slots__ = ['output', 'name', 'fanOut', 'failed', 'queue', 'queuedBytes', 'queueLock', 'hasData', 'closing', 'thread']
+    def __init__(self, output, fanOut):
+        self.output = output
+        self.name = output.name
+        self.fanOut = fanOut
+        self.failed = False
+        self.queue = deque()
+        self.queuedBytes = 0
+        # A plain lock and an event cost less per message than a Condition
+        self.queueLock = threading.Lock()
+        self.hasData = threading.Event()
+        self.closing = False
+        self.thread = None
+
+    def start(self):
+        self.closing = False
+        self.hasData.clear()
+        if not self.output.nonBlocking:
+            self.thread = threading.Thread(target=self.writeQueued, daemon=True)
+            self.thread.start()
+
+    def send(self, data, messageCount):
+        if self.failed:
+            self.countDropped(messageCount)
+        elif self.thread is None:
+            self.write(data, messageCount)
+        else:
+            with self.queueLock:
+                if self.queuedBytes + len(data) > FANOUT_QUEUE_MAX_BYTES:
+                    self.countDropped(messageCount)
+                    return
+                wasEmpty = not self.queue
+                self.queue.append((data, messageCount))
+                self.queuedBytes += len(data)
+            if wasEmpty:
+                self.hasData.set()
+
+    def write(self, data, messageCount):
+        sendStartTime = time.perf_counter()
+        try:
+            byteCount = self.output.writeFramed(data, messageCount)
+        except ChatOutputError as e:
+            self.fanOut.onSinkFailed(self, e)
+            self.countDropped(messageCount)
+            return
+        metrics = self.output.metrics
+        if metrics is not None:
+            metrics.recordBatch(messageCount, byteCount, time.perf_counter() - sendStartTime)
+
+    def countDropped(self, messageCount):
+        metrics = self.output.metrics
+        if metrics is not None:
+            metrics.dropped += messageCount
+
+    # Runs on the sink's own thread, writing everything queued in one go
+    def writeQueued(self):
+        while True:
+            if not self.closing:
+                self.hasData.wait()
+            with self.queueLock:
+                self.hasData.clear()
+                if not self.queue:
+                    if self.closing:
+                        return
+                    continue
+                batches = list(self.queue)
+                self.queue.clear()
+                self.queuedBytes = 0
+
+            if self.failed:
+                self.countDropped(sum([messageCount for data, messageCount in batches]))
+            elif len(batches) == 1:
+                self.write(batches[0][0], batches[0][1])
+            else:
+                self.write(b''.join([data for data, messageCount in batches]), sum([messageCount for data, messageCount in batches]))
+
+    # Writes what is still queued, then stops the thread
+    def stop(self):
+        if self.thread is not None:
+            self.closing = True
+            self.hasData.set()
+            self.thread.join()
+            self.thread = None
+
+# Sends one stream of chat to several outputs. Each message is encoded once
+# and framed once per framing the outputs use, then handed to every output.
+# A slow output only drops its own messages (see FanOutSink) and one that
+# fails is reported through onStatus and left out while the others go on; the
+# run only stops when every output has failed.
+class FanOutChatOutput:
+    def __init__(self, outputs):
+        self.sinks = [FanOutSink(output, self) for output in outputs]
+        self.name = "+".join([output.name for output in outputs])
+        self.metrics = None
+        self.nonBlocking = all([output.nonBlocking for output in outputs])
+
+        framings = []
+        for output in outputs:
+            if output.framing not in framings:
+                framings.append(output.framing)
+        # Batches from worker processes are split back into messages when the
+        # outputs don't all frame them the same way
+        self.framing = framings[0] if len(framings) == 1 else "Length"
+        self.framingGroups = [(framing, getFramingFunction(framing) if framing is not None else None,
+            [sink for sink in self.sinks if sink.output.framing == framing]) for framing in framings]
+
+        self.onStatus = None
+        self.failedCount = 0
+        self.lastError = ""
+        self.failedLock = threading.Lock()
+
+    def open(self, onStatus=None):
+        self.onStatus = onStatus
+        self.failedCount = 0
+        for sink in self.sinks:
+            sink.failed = False
+            try:
+                sink.output.open(onStatus)
+            except ChatOutputError as e:
+                self.onSinkFailed(sink, e)
+            sink.start()
+        if self.failedCount == len(self.sinks):
+            # The run won't close an output that didn't open
+            self.close()
+            self.checkFailed()
+
+    def checkFailed(self):
+        if self.failedCount == len(self.sinks):
+            raise ChatOutputError("Every output failed. The last one: " + self.lastError)
+
+    def onSinkFailed(self, sink, error):
+        with self.failedLock:
+            if sink.failed:
+                return
+            sink.failed = True
+            self.failedCount += 1
+            self.lastError = str(error)
+        if sink.output.metrics is not None:
+            sink.output.metrics.failures += 1
+        if self.onStatus is not None:
+            self.onStatus(sink.name + " output stopped, the others go on: " + str(error))
+
+    def write(self, outputString):
+        data = outputString.encode('utf-8')
+        for framing, frameMessage, sinks in self.framingGroups:
+            framedData = frameMessage(data) if frameMessage is not None else data
+            for sink in sinks:
+                sink.send(framedData, 1)
+        self.checkFailed()
+        return len(data)
+
+    def writeFramed(self, data, messageCount):
+        if len(self.framingGroups) == 1:
+            for sink in self.sinks:
+                sink.send(data, messageCount)
+        else:
+            messages = splitLengthFramed(data)
+            for framing, frameMessage, sinks in self.framingGroups:
+                if framing == "Length":
+                    framedData = data
+                elif frameMessage is None:
+                    framedData = b''
+                else:
+                    framedData = b''.join([frameMessage(bytes(message)) for message in messages])
+                for sink in sinks:
+                    sink.send(framedData, messageCount)
+        self.checkFailed()
+        return len(data)
+
+    def cancel(self):
+        for sink in self.sinks:
+            sink.output.cancel()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.stop()
+            try:
+                sink.output.close()
+            except ChatOutputError as e:
+                self.onSinkFailed(sink, e)
+
+######## Creating outputs ########
+
+# Everything each kind of server output is created from. A kept server is reused
+# while these stay the same.
+SERVER_OUTPUT_SETTINGS = {
+    "TCP": ['tcpHost', 'tcpPort', 'tcpWaitForClient', 'tcpNoDelay', 'framing', 'flushInterval', 'flushBytes', 'queuePolicy', 'queueMaxBytes'],
+    "IRC": ['tcpHost', 'ircPort', 'tcpWaitForClient', 'tcpNoDelay', 'ircChannel', 'ircTags', 'queuePolicy', 'queueMaxBytes'],
+    "Unix": ['unixPath', 'tcpWaitForClient', 'framing', 'flushInterval', 'flushBytes', 'queuePolicy', 'queueMaxBytes'],
+}
+
+def getServerOutputKey(settings, outputType):
+    return tuple([outputType] + [getattr(settings, name) for name in SERVER_OUTPUT_SETTINGS[outputType]])
+
+# Returns a TCP, IRC or Unix socket server. keptOutput is a server kept listening
+# from an earlier run (see TcpChatOutput), it is returned again if it was made
+# from the same settings and shut down if not.
+def createServerOutput(settings, outputType, keptOutput=None, keepListening=False):
+    settingsKey = getServerOutputKey(settings, outputType)
+    if keptOutput is not None:
+        if keptOutput.settingsKey == settingsKey:
+            return keptOutput
+        keptOutput.shutdown()
+
+    if outputType == "TCP":
+        output = TcpChatOutput(settings.tcpHost, settings.tcpPort, settings.tcpWaitForClient, settings.framing,
+            settings.flushInterval, settings.flushBytes, settings.tcpNoDelay, settings.queuePolicy, settings.queueMaxBytes, keepListening)
+    elif outputType == "IRC":
+        output = IrcChatOutput(settings.tcpHost, settings.ircPort, settings.tcpWaitForClient, settings.ircChannel,
+            settings.ircTags, settings.tcpNoDelay, settings.queuePolicy, settings.queueMaxBytes, keepListening)
+    else:
+        output = UnixChatOutput(settings.unixPath, settings.tcpWaitForClient, settings.framing, settings.flushInterval,
+            settings.flushBytes, settings.queuePolicy, settings.queueMaxBytes, keepListening)
+    output.settingsKey = settingsKey
+    return output
+
+# Returns the servers settings.outputTypes needs by output type. keptOutputs are
+# the ones returned last time, those no longer needed are shut down.
+def createServerOutputs(settings, keptOutputs=None, keepListening=False):
+    keptOutputs = keptOutputs if keptOutputs is not None else {}
+    serverOutputs = {}
+    for outputType, keptOutput in keptOutputs.items():
+        if outputType not in settings.outputTypes:
+            keptOutput.shutdown()
+    for outputType in settings.outputTypes:
+        if outputType in SERVER_OUTPUT_SETTINGS:
+            serverOutputs[outputType] = createServerOutput(settings, outputType, keptOutputs.get(outputType), keepListening)
+    return serverOutputs
+
+# serverOutputs are used for TCP, IRC and Unix instead of new ones, see createServerOutputs()
+def createOutput(settings, outputType, serverOutputs=None):
+    if outputType in SERVER_OUTPUT_SETTINGS:
+        if serverOutputs is not None and outputType in serverOutputs:
+            return serverOutputs[outputType]
+        return createServerOutput(settings, outputType)
+    elif outputType == "UDP":
+        return UdpChatOutput(settings.udpHost, settings.udpPort, settings.framing, settings.flushInterval, settings.flushBytes)
+    elif outputType == "Pipe":
+        return PipeChatOutput(settings.pipeLocation, settings.framing, settings.flushInterval, settings.flushBytes)
+    elif outputType == "File":
+        return FileChatOutput(settings.fileLocation, settings.fileMaxSize, settings.fileFlushInterval, settings.fileSync,
+            settings.fileRotate, settings.fileCompress)
+    return NoChatOutput()
+
+# The output for a run: every output in settings.outputTypes, fanned out if
+# there is more than one
+def createChatOutput(settings, serverOutputs=None):
+    outputs = [createOutput(settings, outputType, serverOutputs) for outputType in settings.outputTypes if outputType != "None"]
+    if not outputs:
+        output = NoChatOutput()
+    elif len(outputs) == 1:
+        output = outputs[0]
+    else:
+        output = FanOutChatOutput(outputs)
+
+    if settings.recordingLocation:
+        # Imported here because recordings build on this module
+        from ChatRecording import RecordingChatOutput
+        output = RecordingChatOutput(output, settings.recordingLocation, settings.framing)
+    return output
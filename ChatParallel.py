@@ -0,0 +1,280 @@
+import multiprocessing
+import queue
+import random
+import time
+
+from ChatEngine import createTimeline
+from ChatBatch import ChatBatchGenerator
+from ChatTemplates import TemplateError
+from ChatOutputs import frameMessages
+from ChatScheduler import RateScheduler
+from ChatPopulation import ChatterScheduler, PopulationError
+
+# Generates chat in several processes so the rate isn't capped by one Python
+# thread. Every worker runs its own scheduler for a share of the chat: in
+# "PerChatter" mode a slice of the chatters, otherwise an equal share of the
+# rate. All workers count time from one shared start on the monotonic clock,
+# so they agree on which state the chat is in and how far a fade has got.
+#
+# Workers frame their messages for the output themselves and hand them over in
+# batches through a bounded queue. The process that owns the output writes each
+# batch with one writeFramed() call, so it does little more than copy bytes.
+# Messages from different workers are interleaved a batch at a time.
+
+# A worker hands over a batch once it has this many messages or its oldest
+# message is this old, whichever comes first
+BATCH_MESSAGES = 2048
+BATCH_INTERVAL = 0.01
+
+# Batches each worker may have waiting before it blocks until the output catches up
+QUEUED_BATCHES_PER_WORKER = 4
+
+# How often the merging loop checks for crashed workers, control commands and
+# the run's end. stop() doesn't wait for this: workers wake on stopEvent and
+# report "done".
+STOP_CHECK_INTERVAL = 0.1
+
+######## Worker processes ########
+
+def createWorkerScheduler(settings, workerIndex, workerCount, population):
+    if settings.rateMode == "PerChatter":
+        # Worker k simulates chatters k, k+workerCount, k+2*workerCount... and
+        # sends their share of the activity
+        weights = population.activityWeights()
+        workerWeights = weights[workerIndex::workerCount]
+        return ChatterScheduler(len(workerWeights), settings.messagesPerSecond * sum(workerWeights) / sum(weights), workerWeights)
+
+    return RateScheduler(settings.rateMode, settings.messagesPerSecond / workerCount,
+        settings.minTimeBetweenMessages * workerCount, settings.maxTimeBetweenMessages * workerCount)
+
+# Every worker gets the same population, so they agree on how active each chatter is
+def runWorker(settings, population, workerIndex, workerCount, framing, keepMessages, batches, startEvent, startTimeValue, stopEvent):
+    # Forked or not, workers must not all draw the same random numbers
+    if settings.seed:
+        random.seed(str(settings.seed) + "/" + str(workerIndex))
+    else:
+        random.seed()
+
+    timeline = createTimeline(settings, population)
+    scheduler = createWorkerScheduler(settings, workerIndex, workerCount, population)
+    scheduler.prepare()
+    # Each worker's share of the rate follows the same curve
+    scheduler.setRateCurve(timeline.rateCurve)
+    batches.put(("ready", workerIndex))
+
+    startEvent.wait()
+    if stopEvent.is_set():
+        batches.put(("done", workerIndex))
+        return
+
+    startTime = startTimeValue.value
+    if settings.rateMode == "Fixed":
+        # Take turns so the merged messages are still evenly spaced
+        scheduler.start(startTime, workerIndex / settings.messagesPerSecond)
+    else:
+        scheduler.start(startTime)
+
+    prefixes = population.prefixes
+    # With batch generation messages come from blocks already framed
+    blocks = None
+    if settings.batchGeneration:
+        blocks = ChatBatchGenerator(timeline, scheduler, framing, keepMessages, workerIndex, workerCount)
+    outputStrings = []
+    chunks = []
+    pendingCount = 0
+    batchDeadline = 0.0
+    elapsed = 0.0
+
+    def sendBatch():
+        data = frameMessages(outputStrings, framing) if blocks is None else b''.join(chunks)
+        compiledState = timeline.stateAt(elapsed)
+        batches.put(("batch", workerIndex, data, pendingCount,
+            compiledState.index, compiledState.fadePercentage(elapsed), outputStrings if keepMessages else None))
+
+    while True:
+        timeRemaining = scheduler.timeUntilDeadline()
+        if pendingCount:
+            timeUntilBatchDue = batchDeadline - time.monotonic()
+            if timeUntilBatchDue <= 0 or pendingCount >= BATCH_MESSAGES:
+                sendBatch()
+                outputStrings = []
+                chunks = []
+                pendingCount = 0
+                if stopEvent.is_set():
+                    break
+                continue
+            timeRemaining = min(timeRemaining, timeUntilBatchDue)
+
+        if timeRemaining > 0:
+            # A state with a rate of 0 has no next message
+            if stopEvent.wait(None if timeRemaining == float('inf') else timeRemaining):
+                break
+            continue
+
+        if not pendingCount:
+            batchDeadline = time.monotonic() + BATCH_INTERVAL
+
+        if blocks is not None:
+            block = blocks.takeDue(scheduler.elapsed(), BATCH_MESSAGES - pendingCount)
+            if block is None:
+                continue
+            chunks.append(block.data)
+            if keepMessages:
+                outputStrings.extend(block.outputStrings)
+            pendingCount += block.count
+            elapsed = block.times[-1]
+            continue
+
+        # The timeline follows when the message was due, not when it got sent
+        elapsed = scheduler.advance() - startTime
+        compiledState, outputIndex = timeline.sampleOutput(elapsed, random.random())
+
+        chatter = scheduler.lastChatter
+        if chatter is None:
+            chatter = population.pickChatter()
+        else:
+            chatter = chatter*workerCount + workerIndex
+
+        outputStrings.append(prefixes[chatter] + compiledState.renderMessage(outputIndex))
+        pendingCount += 1
+
+    if pendingCount:
+        sendBatch()
+    batches.put(("done", workerIndex))
+
+######## Merging ########
+
+class ChatWorkerPool:
+    def __init__(self, settings, population, workerCount, framing, keepMessages):
+        # Spawned rather than forked everywhere, forking a process with GUI and
+        # socket threads running isn't safe. Spawned processes import the
+        # parent's __main__ module again, so programs that start workers only
+        # run when __name__ == "__main__", see ChatSimulator.py.
+        context = multiprocessing.get_context("spawn")
+        self.batches = context.Queue(QUEUED_BATCHES_PER_WORKER * workerCount)
+        self.startEvent = context.Event()
+        self.stopEvent = context.Event()
+        self.startTimeValue = context.Value('d', 0.0, lock=False)
+
+        self.workers = [context.Process(target=runWorker, daemon=True,
+            args=(settings, population, i, workerCount, framing, keepMessages, self.batches, self.startEvent, self.startTimeValue, self.stopEvent))
+            for i in range(workerCount)]
+        self.readyWorkers = set()
+        self.doneWorkers = set()
+        self.crashedWorkers = 0
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def isRunning(self):
+        return len(self.doneWorkers) < len(self.workers)
+
+    def isReady(self):
+        return len(self.readyWorkers | self.doneWorkers) == len(self.workers)
+
+    # Returns the next batch, or None if nothing came within timeout
+    def getBatch(self, timeout):
+        try:
+            item = self.batches.get(timeout=timeout)
+        except queue.Empty:
+            self.checkWorkers()
+            return None
+
+        if item[0] == "batch":
+            return item
+        elif item[0] == "ready":
+            self.readyWorkers.add(item[1])
+        else:
+            self.doneWorkers.add(item[1])
+        return None
+
+    def checkWorkers(self):
+        # A worker that finished normally already queued "done" before exiting
+        for i in range(len(self.workers)):
+            exitcode = self.workers[i].exitcode
+            if i not in self.doneWorkers and exitcode is not None and exitcode != 0:
+                self.doneWorkers.add(i)
+                self.crashedWorkers += 1
+
+    def begin(self):
+        self.startTimeValue.value = time.monotonic()
+        self.startEvent.set()
+        return self.startTimeValue.value
+
+    def requestStop(self):
+        self.stopEvent.set()
+        self.startEvent.set()
+
+    def close(self):
+        self.requestStop()
+        # Workers can't exit while their batches are stuck in the queue
+        while self.isRunning():
+            self.getBatch(STOP_CHECK_INTERVAL)
+        for worker in self.workers:
+            worker.join()
+        self.batches.close()
+
+# Runs the generator's settings on settings.workers processes and writes what
+# they generate to the generator's output. Called by ChatGenerator.run().
+def generateParallel(generator):
+    settings = generator.settings
+    workerCount = min(settings.workers, settings.numberOfChatters)
+    if settings.seed:
+        # For the population's activity, workers seed their own
+        random.seed(settings.seed)
+    try:
+        # Templates and names are checked here so a bad one is reported instead
+        # of crashing every worker, and the population is made once for all of them
+        timeline = createTimeline(settings)
+    except (TemplateError, PopulationError) as e:
+        generator.warn(str(e))
+        return
+    rateCurve = timeline.rateCurve
+    # For control commands
+    generator.population = timeline.population
+    pool = ChatWorkerPool(settings, timeline.population, workerCount, generator.output.framing, generator.onMessage is not None)
+
+    if generator.onStatus is not None:
+        generator.onStatus("Starting " + str(workerCount) + " worker processes...")
+    pool.start()
+    generator.workerPool = pool
+    startTime = None
+    try:
+        while not pool.isReady() and not generator.shouldStop():
+            pool.getBatch(STOP_CHECK_INTERVAL)
+        if generator.shouldStop():
+            return
+
+        startTime = pool.begin()
+        generator.endTime = None if generator.duration is None else startTime + generator.duration
+
+        while pool.isRunning():
+            if generator.shouldStop():
+                pool.requestStop()
+            elif generator.commands:
+                generator.runCommands()
+
+            timeout = STOP_CHECK_INTERVAL
+            if generator.endTime is not None:
+                timeout = max(0.0, min(timeout, generator.endTime - time.monotonic()))
+
+            batch = pool.getBatch(timeout)
+            if batch is None or generator.failed:
+                continue
+            kind, workerIndex, data, messageCount, stateIndex, fadePercentage, outputStrings = batch
+            generator.writeBatch(data, messageCount, outputStrings)
+            generator.metrics.stateIndex = stateIndex
+            generator.metrics.fadePercentage = fadePercentage
+            if rateCurve is not None:
+                generator.metrics.targetRate = generator.scheduler.targetRate() * rateCurve.scaleAt(time.monotonic() - startTime)
+
+        if pool.crashedWorkers > 0 and not generator.failed:
+            generator.warn(str(pool.crashedWorkers) + " worker process(es) stopped unexpectedly.")
+    finally:
+        # Also when Ctrl-C interrupts the run, the summary still needs the time
+        if startTime is not None:
+            generator.elapsed = time.monotonic() - startTime
+        generator.workerPool = None
+        generator.population = None
+        pool.close()
@@ -0,0 +1,247 @@
+import random
+import time
+
+from array import array
+
+from functools import partial
+
+from ChatSampler import AliasSampler
+from ChatScheduler import RateScheduler, MAX_SCHEDULE_LAG
+
+# Per-chatter simulation: every chatter posts on their own Poisson schedule at
+# their own rate, and the chat is whatever comes out of all of them together.
+# Chatters aren't objects, their rates and next post times live in flat arrays
+# so a million chatters take tens of MB, and finding who posts next is a heap
+# operation.
+
+# Spread of how active chatters are compared to each other. Rates are drawn
+# from a lognormal distribution with this sigma, 0 makes every chatter the same.
+ACTIVITY_SPREAD = 1.0
+
+def createActivityWeights(numberOfChatters, spread=ACTIVITY_SPREAD):
+    return array('d', (random.lognormvariate(0.0, spread) for i in range(numberOfChatters)))
+
+######## Population ########
+
+# Who is in the chat and how much each of them talks. "Uniform" makes everyone
+# equally chatty, "Lognormal" spreads them like ACTIVITY_SPREAD above and
+# "Zipf" gives the heavy tail of real channels: a handful of regulars write
+# most of the chat and most chatters barely say anything. "Default" is
+# Lognormal in the PerChatter rate mode and Uniform otherwise.
+ACTIVITY_MODELS = ["Default", "Uniform", "Lognormal", "Zipf"]
+DEFAULT_CHATTER_ACTIVITY = "Default"
+# The chatter ranked k-th posts 1/k^exponent as often as the most active one
+DEFAULT_ZIPF_EXPONENT = 1.0
+
+# Chatters without an imported name are named after their number
+NAME_NUMBER_PLACEHOLDER = "{number}"
+DEFAULT_CHATTER_NAME_FORMAT = "ChatUser" + NAME_NUMBER_PLACEHOLDER
+
+# Between a chatter's name and their message, outputs like IRC split on it
+NAME_SEPARATOR = ": "
+
+class PopulationError(Exception):
+    pass
+
+# Chatters earlier in the list are more active
+def createZipfWeights(numberOfChatters, exponent=DEFAULT_ZIPF_EXPONENT):
+    return array('d', (rank ** -exponent for rank in range(1, numberOfChatters+1)))
+
+# None means everyone is equally chatty
+def createPopulationWeights(numberOfChatters, activity, zipfExponent=DEFAULT_ZIPF_EXPONENT):
+    if activity == "Lognormal":
+        return createActivityWeights(numberOfChatters)
+    elif activity == "Zipf":
+        return createZipfWeights(numberOfChatters, zipfExponent)
+    return None
+
+# One name per line, blank lines are skipped
+def loadChatterNames(location):
+    try:
+        with open(location, "r", encoding="utf-8") as f:
+            names = [line.strip() for line in f]
+    except (OSError, UnicodeDecodeError) as e:
+        raise PopulationError("Unable to read chat user names from " + str(location) + ": " + str(e))
+
+    names = [name for name in names if name]
+    for name in names:
+        if NAME_SEPARATOR in name:
+            raise PopulationError("Chat user name " + name + " in " + str(location) + " can't contain \"" + NAME_SEPARATOR + "\"")
+    return names
+
+# The imported names go to the first chatters, the rest are numbered with nameFormat
+def createChatterPrefixes(numberOfChatters, nameFormat=DEFAULT_CHATTER_NAME_FORMAT, importedNames=()):
+    prefixes = [name + NAME_SEPARATOR for name in importedNames[:numberOfChatters]]
+    head, separator, tail = nameFormat.partition(NAME_NUMBER_PLACEHOLDER)
+    tail += NAME_SEPARATOR
+    prefixes.extend([head + str(number) + tail for number in range(len(prefixes)+1, numberOfChatters+1)])
+    return prefixes
+
+# Every chatter's "name: " prefix is built once, so putting a name on a message
+# is one list lookup even with a million chatters. pickChatter() returns a
+# chatter index by activity for rate modes that don't decide who posts.
+class ChatterPopulation:
+    __slots__ = ['prefixes', 'weights', 'sampler', 'pickChatter', 'encodedPrefixes']
+    def __init__(self, prefixes, weights=None):
+        self.prefixes = prefixes
+        self.weights = weights
+        self.sampler = None
+        if weights is None:
+            self.pickChatter = partial(random.randrange, 0, len(prefixes))
+        else:
+            self.pickChatter = self.pickFirstChatter
+        self.encodedPrefixes = None
+
+    # A million chatters take a second to build an alias table for, which
+    # PerChatter runs never use, so it's built when it's first needed
+    def getSampler(self):
+        if self.sampler is None:
+            self.sampler = AliasSampler(self.weights)
+        return self.sampler
+
+    # Call population.pickChatter() rather than keeping the first one around
+    def pickFirstChatter(self):
+        sample = self.getSampler().sample
+        rand = random.random
+        self.pickChatter = lambda: sample(rand())
+        return self.pickChatter()
+
+    # Sent to worker processes as its names and weights, pickChatter can't be pickled
+    def __reduce__(self):
+        return (ChatterPopulation, (self.prefixes, self.weights))
+
+    def __len__(self):
+        return len(self.prefixes)
+
+    def nameAt(self, chatter):
+        return self.prefixes[chatter][:-len(NAME_SEPARATOR)]
+
+    # ChatterScheduler always needs weights, equal ones for a Uniform population
+    def activityWeights(self):
+        if self.weights is None:
+            return array('d', [1.0]) * len(self.prefixes)
+        return self.weights
+
+    # The prefixes as UTF-8 for code that builds output bytes itself, made the first time they're asked for
+    def getEncodedPrefixes(self):
+        if self.encodedPrefixes is None:
+            self.encodedPrefixes = [prefix.encode('utf-8') for prefix in self.prefixes]
+        return self.encodedPrefixes
+
+# Binary min-heap over (next post time, chatter) stored as two parallel arrays.
+# The chat only ever needs the earliest post and then reschedules that chatter,
+# so the one operation is replacing the root and sifting it down.
+class ChatterEventQueue:
+    __slots__ = ['times', 'chatters']
+    def __init__(self, firstTimes):
+        # A sorted array is already a valid heap
+        order = sorted(range(len(firstTimes)), key=firstTimes.__getitem__)
+        self.times = array('d', (firstTimes[i] for i in order))
+        self.chatters = array('I', order)
+
+    def __len__(self):
+        return len(self.times)
+
+    def peekTime(self):
+        return self.times[0]
+
+    def peekChatter(self):
+        return self.chatters[0]
+
+    def replaceRoot(self, newTime):
+        times = self.times
+        chatters = self.chatters
+        count = len(times)
+        chatter = chatters[0]
+
+        position = 0
+        child = 1
+        while child < count:
+            rightChild = child + 1
+            if rightChild < count and times[rightChild] < times[child]:
+                child = rightChild
+            if times[child] >= newTime:
+                break
+            times[position] = times[child]
+            chatters[position] = chatters[child]
+            position = child
+            child = 2*position + 1
+
+        times[position] = newTime
+        chatters[position] = chatter
+
+# Drop-in for RateScheduler in the "PerChatter" rate mode. messagesPerSecond is
+# the rate of the whole chat, shared between chatters by their activity weight.
+class ChatterScheduler(RateScheduler):
+    def __init__(self, numberOfChatters, messagesPerSecond, activityWeights=None, clock=time.monotonic):
+        super().__init__("PerChatter", messagesPerSecond, 0.0, 0.0, clock)
+        self.numberOfChatters = numberOfChatters
+        self.activityWeights = activityWeights
+        self.rates = None
+        self.queue = None
+        self.prepared = False
+        # Added to every post time, so resume() can move the whole population in time
+        self.baseOffset = 0.0
+
+    def targetRate(self):
+        return self.messagesPerSecond
+
+    # Chatters post as often as the population's activity weights say
+    def setPopulation(self, population):
+        self.activityWeights = population.activityWeights()
+        self.prepared = False
+
+    def prepare(self):
+        weights = self.activityWeights
+        if weights is None:
+            weights = createActivityWeights(self.numberOfChatters)
+
+        rateScale = self.messagesPerSecond / sum(weights)
+        self.rates = array('d', (weight * rateScale for weight in weights))
+        self.queue = ChatterEventQueue(array('d', (random.expovariate(rate) if rate > 0 else float('inf') for rate in self.rates)))
+        self.prepared = True
+
+    # Post times in the queue are base seconds, see RateCurve. Chatters are
+    # already spread out, so offset isn't needed.
+    def start(self, startTime=None, offset=0.0):
+        # A population is only good for one run, the next one gets a fresh one
+        if not self.prepared:
+            self.prepare()
+        self.prepared = False
+
+        self.startTime = self.clock() if startTime is None else startTime
+        self.baseOffset = 0.0
+        self.deadline = self.deadlineAt(self.queue.peekTime())
+        self.messageCount = 0
+        self.lastChatter = None
+
+    def rescheduleNext(self):
+        chatter = self.queue.peekChatter()
+        self.queue.replaceRoot(self.queue.peekTime() + random.expovariate(self.rates[chatter]))
+        self.deadline = self.deadlineAt(self.queue.peekTime() + self.baseOffset)
+        return chatter
+
+    # Moves every chatter's next post so the earliest one is due at elapsed
+    def moveTo(self, elapsed):
+        baseTime = elapsed if self.rateCurve is None else self.rateCurve.baseTime(elapsed)
+        self.baseOffset = baseTime - self.queue.peekTime()
+        self.deadline = self.deadlineAt(baseTime)
+
+    def resume(self, elapsed):
+        self.startTime = self.clock() - elapsed
+        self.moveTo(elapsed)
+
+    def timeUntilDeadline(self):
+        now = self.clock()
+        # Like RateScheduler the chat carries on from now when it's too far
+        # behind, the missed posts are neither sent in one burst nor skipped
+        # one at a time
+        if now - self.deadline > MAX_SCHEDULE_LAG:
+            self.moveTo(now - self.startTime)
+        return self.deadline - now
+
+    def advance(self):
+        sentDeadline = self.deadline
+        self.lastChatter = self.rescheduleNext()
+        self.messageCount += 1
+        return sentDeadline
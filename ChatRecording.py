@@ -0,0 +1,598 @@
+import argparse
+import bisect
+import math
+import mmap
+import os
+import random
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+
+from array import array
+
+from ChatOutputs import ChatOutputError, getFramingFunction, FRAMINGS
+
+# Recordings hold chat that was already generated so it can be sent again later
+# without spending CPU on generating it, and so exactly the same load can be
+# replayed against different versions of a bot. A recording is made from a live
+# run (the recordingLocation setting, --record headless) or rendered straight
+# from a scenario, and replayed to TCP clients at the original pace, N times
+# faster or as fast as possible:
+#   py ChatRecording.py render scenario.json chat.rec --duration 600
+#   py ChatRecording.py render scenario.json chat.txt --duration 3600 --seed 42 --transcript
+#   py ChatRecording.py replay chat.rec --port 10000 --speed 2
+#   py ChatRecording.py info chat.rec
+#
+# File layout, all little-endian:
+#   header      HEADER_FORMAT below
+#   payload     every message already framed, back to back
+#   padding     up to the next multiple of 8 bytes
+#   times       one double per entry, seconds since the recording started
+#   offsets     one uint64 per entry where it starts in the payload, then the payload size
+# An entry is usually one message. Batches from worker processes are recorded
+# as one entry each.
+
+RECORDING_MAGIC = b"CHATREC\0"
+RECORDING_VERSION = 1
+
+# magic, version, framing name, entry count, payload offset, payload size, index offset, duration
+HEADER_FORMAT = '<8sI20sQQQQd'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+TRANSCRIPT_BUFFER_SIZE = 1 << 20
+
+class RecordingError(Exception):
+    pass
+
+######## Writing ########
+
+class ChatRecordingWriter:
+    def __init__(self, location, framing):
+        self.location = location
+        self.framing = framing
+        self.frameMessage = getFramingFunction(framing)
+        self.times = array('d')
+        self.offsets = array('Q')
+        self.payloadSize = 0
+        self.lock = threading.Lock()
+
+        try:
+            self.file = open(location, "wb")
+            # Filled in properly once the index is known
+            self.file.write(bytes(HEADER_SIZE))
+        except OSError:
+            raise ChatOutputError("Unable to write recording " + str(location))
+
+    def addFramed(self, timestamp, data):
+        with self.lock:
+            if self.file is None:
+                return
+            self.times.append(timestamp)
+            self.offsets.append(self.payloadSize)
+            self.file.write(data)
+            self.payloadSize += len(data)
+
+    def add(self, timestamp, outputString):
+        self.addFramed(timestamp, self.frameMessage(outputString.encode('utf-8')))
+
+    # A ChatBatch's messages: data holds them one after another and ends are
+    # where each one ends, counted from dataOffset
+    def addFramedBlock(self, times, data, ends, dataOffset):
+        with self.lock:
+            if self.file is None:
+                return
+            base = self.payloadSize - dataOffset
+            self.times.extend(times)
+            self.offsets.append(self.payloadSize)
+            self.offsets.extend(map(base.__add__, ends[:-1]))
+            self.file.write(data)
+            self.payloadSize += len(data)
+
+    def close(self, duration=None):
+        with self.lock:
+            if self.file is None:
+                return
+            if duration is None:
+                duration = self.times[-1] if self.times else 0.0
+
+            self.offsets.append(self.payloadSize)
+            indexOffset = HEADER_SIZE + self.payloadSize
+            padding = -indexOffset % 8
+            indexOffset += padding
+
+            times = self.times
+            offsets = self.offsets
+            if sys.byteorder != "little":
+                times = array('d', times)
+                offsets = array('Q', offsets)
+                times.byteswap()
+                offsets.byteswap()
+
+            try:
+                self.file.write(bytes(padding))
+                times.tofile(self.file)
+                offsets.tofile(self.file)
+                self.file.seek(0)
+                self.file.write(struct.pack(HEADER_FORMAT, RECORDING_MAGIC, RECORDING_VERSION, self.framing.encode('ascii'),
+                    len(self.times), HEADER_SIZE, self.payloadSize, indexOffset, duration))
+                self.file.close()
+            except OSError:
+                raise ChatOutputError("Unable to write recording " + str(self.location))
+            finally:
+                self.file = None
+
+# Wraps another output and records everything written to it, with the time it
+# was written. Recorded messages are framed the way the wrapped output frames
+# them, or with framing if it doesn't.
+class RecordingChatOutput:
+    def __init__(self, output, location, framing):
+        self.output = output
+        self.name = output.name
+        self.framing = output.framing if output.framing is not None else framing
+        self.sinks = output.sinks
+        self.location = location
+        self.writer = None
+        self.startTime = 0.0
+
+    @property
+    def metrics(self):
+        return self.output.metrics
+
+    @metrics.setter
+    def metrics(self, sinkMetrics):
+        self.output.metrics = sinkMetrics
+
+    def open(self, onStatus=None):
+        self.close()
+        self.output.open(onStatus)
+        try:
+            self.writer = ChatRecordingWriter(self.location, self.framing)
+        except ChatOutputError:
+            self.output.close()
+            raise
+        # The recording starts when the chat does, not while waiting for clients
+        self.startTime = time.monotonic()
+
+    def getWriter(self):
+        writer = self.writer
+        if writer is None:
+            raise ChatOutputError("The recording " + str(self.location) + " isn't open")
+        return writer
+
+    def write(self, outputString):
+        writer = self.getWriter()
+        byteCount = self.output.write(outputString)
+        writer.add(time.monotonic() - self.startTime, outputString)
+        return byteCount
+
+    def writeFramed(self, data, messageCount):
+        writer = self.getWriter()
+        byteCount = self.output.writeFramed(data, messageCount)
+        writer.addFramed(time.monotonic() - self.startTime, data)
+        return byteCount
+
+    def cancel(self):
+        self.output.cancel()
+
+    def close(self):
+        self.output.close()
+        if self.writer is not None:
+            writer = self.writer
+            self.writer = None
+            writer.close(time.monotonic() - self.startTime)
+
+# Generates a scenario on a virtual clock as fast as possible. Timing and
+# content follow the same rules as a live run of the same settings. With a
+# seed (or the scenario's) the same scenario always renders the same bytes.
+# transcript writes a ChatTranscriptWriter text file instead of a recording.
+# batch draws the chat in blocks, see ChatBatch.py. Raises RecordingError if
+# no time passes between messages.
+def renderScenario(settings, location, duration, framing=None, seed=None, transcript=False, batch=None):
+    # Imported here so replaying doesn't need the generator
+    from ChatEngine import createTimeline, createScheduler, getBaseRate
+    from ChatBatch import ChatBatchGenerator
+
+    # No time passes between messages, so the virtual clock would never reach duration
+    if getBaseRate(settings) == float('inf'):
+        raise RecordingError("Can't render chat with no time between messages, use the Fixed or Poisson rate mode or set a time between messages")
+
+    seed = settings.seed if seed is None else seed
+    if seed:
+        # Everything random in a run comes from the random module
+        random.seed(seed)
+    framing = settings.framing if framing is None else framing
+    timeline = createTimeline(settings)
+    if transcript:
+        writer = ChatTranscriptWriter(location)
+    else:
+        writer = ChatRecordingWriter(location, framing)
+    scheduler = createScheduler(settings)
+    scheduler.setPopulation(timeline.population)
+    scheduler.setRateCurve(timeline.rateCurve)
+    scheduler.start(0.0)
+
+    batch = settings.batchGeneration if batch is None else batch
+    if batch:
+        blocks = ChatBatchGenerator(timeline, scheduler, None if transcript else framing, transcript)
+        # Messages due before duration, like the loop below
+        lastTime = math.nextafter(duration, -math.inf)
+        try:
+            while True:
+                chatBatch = blocks.takeDue(lastTime)
+                if chatBatch is None:
+                    break
+                if transcript:
+                    writer.addBlock(chatBatch.times, chatBatch.outputStrings)
+                else:
+                    writer.addFramedBlock(chatBatch.times, chatBatch.data, chatBatch.ends, chatBatch.dataOffset)
+        finally:
+            writer.close(duration)
+        return len(writer.times)
+
+    frameMessage = getFramingFunction(framing)
+    # Looked up once, this loop runs for every message
+    advance = scheduler.advance
+    sampleOutput = timeline.sampleOutput
+    randomValue = random.random
+    population = timeline.population
+    prefixes = population.prefixes
+    add = writer.add if transcript else None
+    try:
+        while True:
+            elapsed = advance()
+            if elapsed >= duration:
+                break
+            compiledState, outputIndex = sampleOutput(elapsed, randomValue())
+            chatter = scheduler.lastChatter
+            if chatter is None:
+                chatter = population.pickChatter()
+            outputString = prefixes[chatter] + compiledState.renderMessage(outputIndex)
+            if add is not None:
+                add(elapsed, outputString)
+            else:
+                writer.addFramed(elapsed, frameMessage(outputString.encode('utf-8')))
+    finally:
+        writer.close(duration)
+    return len(writer.times)
+
+# Writes chat as text, one message per line after the seconds since the start
+# and a tab, for tests that want to read or diff what was said
+class ChatTranscriptWriter:
+    def __init__(self, location):
+        self.location = location
+        self.times = array('d')
+        try:
+            self.file = open(location, "w", encoding="utf-8", newline="\n", buffering=TRANSCRIPT_BUFFER_SIZE)
+        except OSError:
+            raise ChatOutputError("Unable to write transcript " + str(location))
+
+    def add(self, timestamp, outputString):
+        self.times.append(timestamp)
+        self.file.write("%.6f\t%s\n" % (timestamp, outputString))
+
+    def addBlock(self, times, outputStrings):
+        self.times.extend(times)
+        self.file.write("".join(map("%.6f\t%s\n".__mod__, zip(times, outputStrings))))
+
+    def close(self, duration=None):
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+        except OSError:
+            raise ChatOutputError("Unable to write transcript " + str(self.location))
+        finally:
+            self.file = None
+
+######## Reading ########
+
+# A recording mapped into memory. times and offsets are views straight into
+# the mapping, nothing is read until it's used.
+class ChatRecording:
+    def __init__(self, location):
+        self.location = location
+        try:
+            self.file = open(location, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            raise RecordingError("Unable to read recording " + str(location))
+
+        if len(self.map) < HEADER_SIZE:
+            self.close()
+            raise RecordingError(str(location) + " is not a chat recording")
+        magic, version, framing, count, payloadOffset, payloadSize, indexOffset, duration = struct.unpack_from(HEADER_FORMAT, self.map, 0)
+        if magic != RECORDING_MAGIC:
+            self.close()
+            raise RecordingError(str(location) + " is not a chat recording")
+        if version != RECORDING_VERSION:
+            self.close()
+            raise RecordingError(str(location) + " is recording version " + str(version) + ", expected " + str(RECORDING_VERSION))
+        if indexOffset + count*8 + (count+1)*8 > len(self.map):
+            self.close()
+            raise RecordingError(str(location) + " is incomplete, it may not have been closed properly")
+
+        self.framing = framing.rstrip(b'\0').decode('ascii')
+        self.messageCount = count
+        self.payloadOffset = payloadOffset
+        self.payloadSize = payloadSize
+        self.duration = duration
+
+        view = memoryview(self.map)
+        timesBytes = view[indexOffset:indexOffset + count*8]
+        offsetsBytes = view[indexOffset + count*8:indexOffset + count*8 + (count+1)*8]
+        if sys.byteorder == "little":
+            self.times = timesBytes.cast('d')
+            self.offsets = offsetsBytes.cast('Q')
+        else:
+            self.times = array('d', timesBytes.tobytes())
+            self.offsets = array('Q', offsetsBytes.tobytes())
+            self.times.byteswap()
+            self.offsets.byteswap()
+        self.payload = view[payloadOffset:payloadOffset + payloadSize]
+
+    def close(self):
+        # Views have to go before the mapping can close
+        for name in ('times', 'offsets', 'payload'):
+            value = getattr(self, name, None)
+            if isinstance(value, memoryview):
+                value.release()
+            setattr(self, name, None)
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+            self.map = None
+        if getattr(self, 'file', None) is not None:
+            self.file.close()
+            self.file = None
+
+######## Replay ########
+
+# Replayed data is sent straight from the file, with sendfile where the
+# platform has it and from the memory mapping otherwise
+HAS_SENDFILE = hasattr(os, "sendfile")
+REPLAY_SEND_SIZE = 1 << 20
+
+class ReplayClient:
+    __slots__ = ['socket', 'address', 'position', 'wantsWrite']
+    def __init__(self, clientSocket, address, position):
+        self.socket = clientSocket
+        self.address = address
+        # Where in the payload this client has been sent up to
+        self.position = position
+        self.wantsWrite = False
+
+# Serves a recording to any number of TCP clients. The replay clock decides how
+# much of the payload is available; each client just remembers how far it has
+# got, so a slow client costs no memory. Clients joining late start from the
+# current point like they would in live chat. speed 1 is the original pace,
+# 0 sends everything as fast as the clients take it.
+class ChatReplayServer:
+    def __init__(self, recording, host, port, speed=1.0, waitForClient=True, onStatus=None):
+        self.recording = recording
+        self.host = host
+        self.port = port
+        self.speed = speed
+        self.waitForClient = waitForClient
+        self.onStatus = onStatus
+
+        self.clients = []
+        self.stopRequested = False
+        self.wakeupReader, self.wakeupWriter = socket.socketpair()
+        self.wakeupReader.setblocking(False)
+        self.wakeupWriter.setblocking(False)
+        self.serverSocket = None
+        self.selector = None
+
+        self.available = 0
+        self.availableEnd = 0
+        self.startTime = None
+
+    def address(self):
+        return str(self.host) + ":" + str(self.port)
+
+    def stop(self):
+        self.stopRequested = True
+        try:
+            self.wakeupWriter.send(b'\0')
+        except OSError:
+            pass
+
+    def run(self):
+        try:
+            self.serverSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.serverSocket.bind((self.host, self.port))
+            self.serverSocket.listen()
+            self.serverSocket.setblocking(False)
+        except OSError:
+            self.close()
+            raise ChatOutputError("Unable to create TCP server at " + self.address() + ". Try another host or port.")
+
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.serverSocket, selectors.EVENT_READ, None)
+        self.selector.register(self.wakeupReader, selectors.EVENT_READ, None)
+        try:
+            if self.waitForClient and self.onStatus is not None:
+                self.onStatus("Waiting for TCP client at " + self.address() + "...")
+            if not self.waitForClient:
+                self.startTime = time.monotonic()
+            self.serve()
+        finally:
+            self.close()
+        return self.available
+
+    def serve(self):
+        times = self.recording.times
+        offsets = self.recording.offsets
+        count = self.recording.messageCount
+
+        while not self.stopRequested:
+            timeout = None
+            if self.startTime is not None:
+                if self.speed > 0:
+                    elapsed = (time.monotonic() - self.startTime) * self.speed
+                    self.available = bisect.bisect_right(times, elapsed, self.available)
+                    if self.available < count:
+                        timeout = (times[self.available] - elapsed) / self.speed
+                else:
+                    self.available = count
+                self.availableEnd = offsets[self.available]
+
+                if self.available == count and not any(client.position < self.availableEnd for client in self.clients):
+                    return
+
+                for client in self.clients:
+                    if client.position < self.availableEnd and not client.wantsWrite:
+                        client.wantsWrite = True
+                        self.selector.modify(client.socket, selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj is self.serverSocket:
+                    self.acceptClients()
+                elif key.fileobj is self.wakeupReader:
+                    try:
+                        self.wakeupReader.recv(4096)
+                    except OSError:
+                        pass
+                else:
+                    client = key.data
+                    if mask & selectors.EVENT_READ:
+                        self.readClient(client)
+                    if mask & selectors.EVENT_WRITE and client in self.clients:
+                        self.sendToClient(client)
+
+    def acceptClients(self):
+        while True:
+            try:
+                clientSocket, addr = self.serverSocket.accept()
+            except OSError:
+                return
+            clientSocket.setblocking(False)
+            self.clients.append(ReplayClient(clientSocket, addr, self.availableEnd))
+            self.selector.register(clientSocket, selectors.EVENT_READ, self.clients[-1])
+            if self.startTime is None:
+                self.startTime = time.monotonic()
+
+    def readClient(self, client):
+        try:
+            data = client.socket.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.dropClient(client)
+
+    def sendToClient(self, client):
+        count = min(self.availableEnd - client.position, REPLAY_SEND_SIZE)
+        try:
+            if HAS_SENDFILE:
+                sent = os.sendfile(client.socket.fileno(), self.recording.file.fileno(), self.recording.payloadOffset + client.position, count)
+            else:
+                sent = client.socket.send(self.recording.payload[client.position:client.position + count])
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.dropClient(client)
+            return
+
+        client.position += sent
+        if client.position >= self.availableEnd:
+            client.wantsWrite = False
+            self.selector.modify(client.socket, selectors.EVENT_READ, client)
+
+    def dropClient(self, client):
+        self.clients.remove(client)
+        self.selector.unregister(client.socket)
+        client.socket.close()
+
+    def close(self):
+        for client in self.clients:
+            client.socket.close()
+        self.clients = []
+        for openSocket in (self.serverSocket, self.wakeupReader, self.wakeupWriter):
+            if openSocket is not None:
+                openSocket.close()
+        self.serverSocket = None
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+
+######## Command line ########
+
+def createArgumentParser():
+    parser = argparse.ArgumentParser(description="Render chat scenarios to recordings and replay them.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    render = commands.add_parser("render", help="generate a scenario into a recording without waiting for real time")
+    render.add_argument("scenario", help="scenario JSON file")
+    render.add_argument("recording", help="recording file to write, or transcript with --transcript")
+    render.add_argument("--duration", type=float, required=True, help="seconds of chat to render")
+    render.add_argument("--framing", choices=list(FRAMINGS), default=None, help="how messages are delimited (default: the scenario's)")
+    render.add_argument("--seed", type=int, default=None, help="render the same chat every time for this seed, 0 doesn't (default: the scenario's seed)")
+    render.add_argument("--transcript", action="store_true", help="write a text transcript with a timestamp per line instead of a recording")
+    render.add_argument("--batch", action="store_true", default=None, help="draw the chat in blocks, see ChatBatch.py (default: the scenario's)")
+
+    replay = commands.add_parser("replay", help="serve a recording to TCP clients")
+    replay.add_argument("recording", help="recording file to replay")
+    replay.add_argument("--host", default="127.0.0.1", help="TCP host (default: %(default)s)")
+    replay.add_argument("--port", type=int, default=10000, help="TCP port (default: %(default)s)")
+    replay.add_argument("--speed", type=float, default=1.0, help="1 replays at the original pace, 2 twice as fast, 0 as fast as possible")
+    replay.add_argument("--no-wait-for-client", action="store_true", help="start the replay clock before the first client connects")
+
+    info = commands.add_parser("info", help="describe a recording")
+    info.add_argument("recording", help="recording file")
+    return parser
+
+def printStatus(text):
+    print(text, file=sys.stderr, flush=True)
+
+def main(argv=None):
+    args = createArgumentParser().parse_args(argv)
+
+    if args.command == "render":
+        from ChatScenario import loadScenario, ScenarioError
+        from ChatTemplates import TemplateError
+        from ChatPopulation import PopulationError
+        try:
+            settings = loadScenario(args.scenario)
+            startTime = time.perf_counter()
+            count = renderScenario(settings, args.recording, args.duration, args.framing, args.seed, args.transcript, args.batch)
+        except (ScenarioError, ChatOutputError, RecordingError, TemplateError, PopulationError) as e:
+            printStatus("Error: " + str(e))
+            return 2
+        printStatus("Rendered " + str(count) + " messages in " + "%.2f" % (time.perf_counter() - startTime) + "s")
+        return 0
+
+    try:
+        recording = ChatRecording(args.recording)
+    except RecordingError as e:
+        printStatus("Error: " + str(e))
+        return 2
+
+    try:
+        if args.command == "info":
+            print("Framing: " + recording.framing)
+            print("Entries: " + str(recording.messageCount))
+            print("Duration: " + "%.3f" % recording.duration + "s")
+            print("Payload: " + str(recording.payloadSize) + " bytes")
+            return 0
+
+        server = ChatReplayServer(recording, args.host, args.port, args.speed, not args.no_wait_for_client, printStatus)
+        try:
+            startTime = time.monotonic()
+            sent = server.run()
+        except ChatOutputError as e:
+            printStatus("Error: " + str(e))
+            return 1
+        except KeyboardInterrupt:
+            sent = server.available
+        printStatus("Replayed " + str(sent) + " of " + str(recording.messageCount) + " entries in " + "%.2f" % (time.monotonic() - startTime) + "s")
+        return 0
+    finally:
+        recording.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# Weighted samplers for picking a chat output. They are built once when a run
+# starts so picking a message costs the same no matter how many outputs a state has.
+# Both take a single uniform random number in [0, 1) so callers control the RNG.
+
+class AliasSampler:
+    # Walker/Vose alias table, O(n) to build and O(1) per sample
+    __slots__ = ['count', 'probabilities', 'aliases']
+    def __init__(self, weights):
+        self.count = len(weights)
+        if self.count == 0:
+            raise ValueError("AliasSampler needs at least one weight")
+
+        totalWeight = float(sum(weights))
+        if totalWeight <= 0.0:
+            # All weights zero, every output is equally likely
+            weights = [1.0]*self.count
+            totalWeight = float(self.count)
+
+        scaled = [weight * self.count / totalWeight for weight in weights]
+        self.probabilities = [1.0]*self.count
+        self.aliases = list(range(self.count))
+
+        small = [i for i in range(self.count) if scaled[i] < 1.0]
+        large = [i for i in range(self.count) if scaled[i] >= 1.0]
+        while small and large:
+            smallIndex = small.pop()
+            largeIndex = large.pop()
+
+            self.probabilities[smallIndex] = scaled[smallIndex]
+            self.aliases[smallIndex] = largeIndex
+
+            scaled[largeIndex] = (scaled[largeIndex] + scaled[smallIndex]) - 1.0
+            if scaled[largeIndex] < 1.0:
+                small.append(largeIndex)
+            else:
+                large.append(largeIndex)
+
+        # Whatever is left over is 1.0 apart from float rounding, so it keeps its own column
+
+    def sample(self, randomValue):
+        # The integer part picks the column and the fractional part is the coin flip
+        scaledValue = randomValue * self.count
+        column = int(scaledValue)
+        if column >= self.count:
+            column = self.count - 1
+        if scaledValue - column < self.probabilities[column]:
+            return column
+        return self.aliases[column]
+
+class BlendedSampler:
+    # Picks from toSampler with probability percentage, otherwise from fromSampler.
+    # The same random number chooses the table and is then rescaled for the pick.
+    __slots__ = ['fromSampler', 'toSampler']
+    def __init__(self, fromSampler, toSampler):
+        self.fromSampler = fromSampler
+        self.toSampler = toSampler
+
+    # Returns (True, index) when the pick came from toSampler
+    def sample(self, randomValue, percentage):
+        if randomValue < percentage:
+            return True, self.toSampler.sample(randomValue / percentage)
+        return False, self.fromSampler.sample((randomValue - percentage) / (1.0 - percentage))
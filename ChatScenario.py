@@ -0,0 +1,495 @@
+import io
+import json
+import pickle
+import struct
+import sys
+
+from array import array
+
+from ChatEngine import ChatSettingsValues, ChatStateValues, ChatOutputValues, getBaseRate
+from ChatTemplates import checkTemplate, mergePools, TemplateError
+from ChatOutputs import OUTPUT_TYPES, FRAMINGS, FILE_SYNC_POLICIES, QUEUE_POLICIES
+from ChatScheduler import RateProfile, RATE_MODES, RATE_SHAPES, DEFAULT_BURST_DECAY
+from ChatPopulation import ACTIVITY_MODELS, NAME_NUMBER_PLACEHOLDER
+from ChatEngine import DEFAULT_STATE_DURATION, DEFAULT_OUTPUT_MESSAGE, DEFAULT_OUTPUT_PROBABILITY
+
+# Scenario files are JSON objects using the same names as ChatSettingsValues.
+# version is the version of this schema the file was written with; files
+# without one are version 1. Any missing global setting keeps its default:
+#   {
+#     "version": 3,
+#     "numberOfChatters": 50,
+#     "chatterActivity": "Default",
+#     "zipfExponent": 1.0,
+#     "chatterNamesLocation": "",
+#     "chatterNameFormat": "ChatUser{number}",
+#     "workers": 1,
+#     "rateMode": "Uniform",
+#     "messagesPerSecond": 10.0,
+#     "minTimeBetweenMessages": 0.02,
+#     "maxTimeBetweenMessages": 0.2,
+#     "transitionDuration": 2.0,
+#     "outputTypes": ["TCP", "File"],
+#     "tcpHost": "127.0.0.1",
+#     "tcpPort": 10000,
+#     "tcpWaitForClient": true,
+#     "tcpNoDelay": false,
+#     "ircPort": 6667,
+#     "ircChannel": "",
+#     "ircTags": true,
+#     "unixPath": "ChatSimulator.sock",
+#     "udpHost": "127.0.0.1",
+#     "udpPort": 10001,
+#     "pipeLocation": "",
+#     "framing": "Newline",
+#     "flushInterval": 0.005,
+#     "flushBytes": 65536,
+#     "queuePolicy": "DropOldest",
+#     "queueMaxBytes": 8388608,
+#     "fileLocation": "ChatOutput.log",
+#     "fileMaxSize": 500,
+#     "fileFlushInterval": 1.0,
+#     "fileSync": "None",
+#     "fileRotate": true,
+#     "fileCompress": false,
+#     "metricsFile": "",
+#     "metricsPort": 0,
+#     "metricsInterval": 1.0,
+#     "controlPort": 0,
+#     "seed": 0,
+#     "batchGeneration": false,
+#     "recordingLocation": "",
+#     "pools": {"emotes": ["Kappa", "PogChamp", "LUL"]},
+#     "chatStates": [
+#       {"duration": 10.0, "outputs": [{"message": "hello", "probability": 1.0}]},
+#       {"duration": 10.0, "pools": {"emotes": ["gg", "GG"]},
+#        "outputs": [{"message": "@{user} {pool:emotes} x{number:2-10}", "probability": 1.0}]},
+#       {"duration": 60.0, "rate": {"shape": "Ramp", "rate": 10.0, "endRate": 5000.0},
+#        "outputs": [{"message": "PogChamp", "probability": 1.0}]}
+#     ]
+#   }
+#
+# A chat state's "rate" replaces the global rate while it runs, see RATE_SHAPES
+# in ChatScheduler.py. Each shape uses "rate" and some of:
+#   {"shape": "Constant", "rate": 100.0}
+#   {"shape": "Ramp", "rate": 10.0, "endRate": 5000.0}
+#   {"shape": "Burst", "rate": 50.0, "peakRate": 3000.0, "decay": 5.0}
+#   {"shape": "Step", "rate": 10.0, "steps": [[30.0, 500.0], [45.0, 10.0]]}
+# Version 2 added rates. Version 3 replaced "outputType" with "outputTypes",
+# chat goes to all of them at once, and gave IRC and UDP their own ports
+# (older files used tcpHost and tcpPort for whichever output they had).
+#
+# Large scenarios can also be saved in a compact binary form (files ending in
+# .chatscn) that loads much faster, see BINARY_HEADER_FORMAT. loadScenario()
+# reads either, and settings files pickled by older versions.
+
+SCENARIO_VERSION = 3
+
+class ScenarioError(Exception):
+    pass
+
+# A single output type is taken as a list of one, "None" as no output
+def outputTypesFromValue(value):
+    if isinstance(value, str):
+        value = [value]
+    return [str(outputType) for outputType in value if outputType != "None"]
+
+GLOBAL_SETTING_TYPES = {
+    'numberOfChatters': int,
+    'chatterActivity': str,
+    'zipfExponent': float,
+    'chatterNamesLocation': str,
+    'chatterNameFormat': str,
+    'workers': int,
+    'rateMode': str,
+    'messagesPerSecond': float,
+    'minTimeBetweenMessages': float,
+    'maxTimeBetweenMessages': float,
+    'transitionDuration': float,
+    'outputTypes': outputTypesFromValue,
+    'tcpHost': str,
+    'tcpPort': int,
+    'tcpWaitForClient': bool,
+    'tcpNoDelay': bool,
+    'ircPort': int,
+    'ircChannel': str,
+    'ircTags': bool,
+    'unixPath': str,
+    'udpHost': str,
+    'udpPort': int,
+    'pipeLocation': str,
+    'framing': str,
+    'flushInterval': float,
+    'flushBytes': int,
+    'queuePolicy': str,
+    'queueMaxBytes': int,
+    'fileLocation': str,
+    'fileMaxSize': int,
+    'fileFlushInterval': float,
+    'fileSync': str,
+    'fileRotate': bool,
+    'fileCompress': bool,
+    'metricsFile': str,
+    'metricsPort': int,
+    'metricsInterval': float,
+    'controlPort': int,
+    'seed': int,
+    'batchGeneration': bool,
+    'recordingLocation': str,
+}
+
+def chatStateFromDict(stateDict):
+    outputs = [ChatOutputValues(str(outputDict.get('message', DEFAULT_OUTPUT_MESSAGE)), float(outputDict.get('probability', DEFAULT_OUTPUT_PROBABILITY)))
+        for outputDict in stateDict.get('outputs', [])]
+    return ChatStateValues(outputs, float(stateDict.get('duration', DEFAULT_STATE_DURATION)), poolsFromDict(stateDict.get('pools')),
+        rateProfileFromDict(stateDict.get('rate')))
+
+def validateChatState(chatState, index):
+    if len(chatState.outputs) == 0:
+        raise ScenarioError("Chat state " + str(index+1) + " needs at least one output")
+    if chatState.duration < 0:
+        raise ScenarioError("Chat state " + str(index+1) + " has a negative duration")
+    if min([output.probability for output in chatState.outputs]) < 0:
+        raise ScenarioError("Chat state " + str(index+1) + " has a negative probability")
+    if chatState.rate is not None:
+        validateRateProfile(chatState.rate, index)
+
+def validateRateProfile(profile, index):
+    if profile.shape not in RATE_SHAPES:
+        raise ScenarioError("Chat state " + str(index+1) + ": unknown rate shape " + profile.shape + ". Use one of: " + ", ".join(RATE_SHAPES))
+    rates = [profile.rate, profile.endRate, profile.peakRate] + [stepRate for stepTime, stepRate in profile.steps]
+    if min(rates) < 0:
+        raise ScenarioError("Chat state " + str(index+1) + ": rates can't be negative")
+    if profile.decay <= 0:
+        raise ScenarioError("Chat state " + str(index+1) + ": decay must be greater than 0")
+    stepTimes = [stepTime for stepTime, stepRate in profile.steps]
+    if stepTimes != sorted(stepTimes) or (stepTimes and stepTimes[0] < 0):
+        raise ScenarioError("Chat state " + str(index+1) + ": steps must be in order of time from 0 on")
+
+# Templates are only checked here, compiling them is left to the run
+def checkChatStateTemplates(chatState, index, pools):
+    pools = mergePools(pools, chatState.pools)
+    checked = set()
+    try:
+        for output in chatState.outputs:
+            checkTemplate(output.message, pools, checked)
+    except TemplateError as e:
+        raise ScenarioError("Chat state " + str(index+1) + ": " + str(e))
+
+def chatStateToDict(chatState):
+    stateDict = {
+        'duration': chatState.duration,
+        'outputs': [{'message': output.message, 'probability': output.probability} for output in chatState.outputs]
+    }
+    if chatState.pools:
+        stateDict['pools'] = chatState.pools
+    if chatState.rate is not None:
+        stateDict['rate'] = rateProfileToDict(chatState.rate)
+    return stateDict
+
+# The fields each rate shape uses besides rate
+RATE_SHAPE_FIELDS = {
+    "Constant": [],
+    "Ramp": ['endRate'],
+    "Burst": ['peakRate', 'decay'],
+    "Step": ['steps'],
+}
+
+def rateProfileFromDict(rateDict):
+    if rateDict is None:
+        return None
+    if 'rate' not in rateDict:
+        raise ValueError("a chat state's rate needs a \"rate\"")
+    steps = [(float(stepTime), float(stepRate)) for stepTime, stepRate in rateDict.get('steps', [])]
+    return RateProfile(str(rateDict.get('shape', "Constant")), float(rateDict['rate']), float(rateDict.get('endRate', 0.0)),
+        float(rateDict.get('peakRate', 0.0)), float(rateDict.get('decay', DEFAULT_BURST_DECAY)), steps)
+
+def rateProfileToDict(profile):
+    rateDict = {'shape': profile.shape, 'rate': profile.rate}
+    for name in RATE_SHAPE_FIELDS.get(profile.shape, []):
+        rateDict[name] = getattr(profile, name)
+    if 'steps' in rateDict:
+        rateDict['steps'] = [[stepTime, stepRate] for stepTime, stepRate in profile.steps]
+    return rateDict
+
+def poolsFromDict(poolsDict):
+    if poolsDict is None:
+        return None
+    return {str(name): [str(entry) for entry in entries] for name, entries in poolsDict.items()}
+
+# Files from before version 3 had one output type, and IRC and UDP used
+# tcpHost and tcpPort unless they say otherwise
+def outputTypesFromLegacy(settings, outputType, scenarioDict):
+    settings.outputTypes = [outputType] if outputType != "None" else []
+    if outputType == "IRC" and 'ircPort' not in scenarioDict:
+        settings.ircPort = settings.tcpPort
+    elif outputType == "UDP" and 'udpPort' not in scenarioDict:
+        settings.udpHost = settings.tcpHost
+        settings.udpPort = settings.tcpPort
+
+# Ports that can be 0 are turned off by it
+def validatePort(settings, name, allowZero=False):
+    port = getattr(settings, name)
+    if port < (0 if allowZero else 1) or port > 65535:
+        raise ScenarioError(name + " must be from " + ("0" if allowZero else "1") + " to 65535")
+
+# Checks settings however they were made, e.g. a loaded scenario after
+# command line overrides. Anything the GUI refuses is refused here too.
+def validateSettings(settings):
+    for i in range(len(settings.chatStates)):
+        validateChatState(settings.chatStates[i], i)
+    if len(settings.chatStates) == 0:
+        raise ScenarioError("A scenario needs at least one chat state")
+    if settings.numberOfChatters < 1:
+        raise ScenarioError("numberOfChatters must be at least 1")
+    if settings.workers < 1:
+        raise ScenarioError("workers must be at least 1")
+    if settings.rateMode not in RATE_MODES:
+        raise ScenarioError("Unknown rate mode " + settings.rateMode + ". Use one of: " + ", ".join(RATE_MODES))
+    if settings.rateMode != "Uniform" and settings.messagesPerSecond <= 0:
+        raise ScenarioError("messagesPerSecond must be greater than 0")
+    if settings.minTimeBetweenMessages < 0 or settings.maxTimeBetweenMessages < 0:
+        raise ScenarioError("minTimeBetweenMessages and maxTimeBetweenMessages must be at least 0")
+    if settings.maxTimeBetweenMessages < settings.minTimeBetweenMessages:
+        raise ScenarioError("maxTimeBetweenMessages must be at least minTimeBetweenMessages")
+    if settings.transitionDuration < 0:
+        raise ScenarioError("transitionDuration must be at least 0")
+    # State rates are followed as multiples of the base rate, see RateCurve
+    baseRate = getBaseRate(settings)
+    if any(chatState.rate is not None for chatState in settings.chatStates) and not 0 < baseRate < float('inf'):
+        raise ScenarioError("Chat state rates need a limited base rate, use the Fixed or Poisson rate mode or some time between messages")
+    if settings.chatterActivity not in ACTIVITY_MODELS:
+        raise ScenarioError("Unknown chatter activity " + settings.chatterActivity + ". Use one of: " + ", ".join(ACTIVITY_MODELS))
+    if settings.zipfExponent < 0:
+        raise ScenarioError("zipfExponent must be at least 0")
+    if NAME_NUMBER_PLACEHOLDER not in settings.chatterNameFormat:
+        raise ScenarioError("chatterNameFormat needs " + NAME_NUMBER_PLACEHOLDER + " so every chat user gets their own name")
+    for outputType in settings.outputTypes:
+        if outputType not in OUTPUT_TYPES:
+            raise ScenarioError("Unknown output type " + outputType + ". Use one of: " + ", ".join(OUTPUT_TYPES))
+    if settings.framing not in FRAMINGS:
+        raise ScenarioError("Unknown framing " + settings.framing + ". Use one of: " + ", ".join(FRAMINGS))
+    if settings.queuePolicy not in QUEUE_POLICIES:
+        raise ScenarioError("Unknown queue policy " + settings.queuePolicy + ". Use one of: " + ", ".join(QUEUE_POLICIES))
+    validatePort(settings, 'tcpPort')
+    validatePort(settings, 'ircPort')
+    validatePort(settings, 'udpPort')
+    validatePort(settings, 'metricsPort', allowZero=True)
+    validatePort(settings, 'controlPort', allowZero=True)
+    if settings.queueMaxBytes < 0:
+        raise ScenarioError("queueMaxBytes must be at least 0")
+    if settings.flushInterval < 0:
+        raise ScenarioError("flushInterval must be at least 0")
+    if settings.flushBytes <= 0:
+        raise ScenarioError("flushBytes must be greater than 0")
+    if settings.fileMaxSize <= 0:
+        raise ScenarioError("fileMaxSize must be greater than 0")
+    if settings.fileFlushInterval < 0:
+        raise ScenarioError("fileFlushInterval must be at least 0")
+    if settings.metricsInterval <= 0:
+        raise ScenarioError("metricsInterval must be greater than 0")
+    if settings.fileSync not in FILE_SYNC_POLICIES:
+        raise ScenarioError("Unknown file sync policy " + settings.fileSync + ". Use one of: " + ", ".join(FILE_SYNC_POLICIES))
+    for i in range(len(settings.chatStates)):
+        checkChatStateTemplates(settings.chatStates[i], i, settings.pools)
+
+# chatStates are taken as given when they were already read some other way
+def settingsFromDict(scenarioDict, chatStates=None):
+    version = scenarioDict.get('version', 1)
+    if not isinstance(version, int) or version < 1:
+        raise ScenarioError("Invalid scenario version " + str(version))
+    if version > SCENARIO_VERSION:
+        raise ScenarioError("Scenario version " + str(version) + " is newer than this simulator supports (" + str(SCENARIO_VERSION) + ")")
+
+    settings = ChatSettingsValues()
+    try:
+        for name, valueType in GLOBAL_SETTING_TYPES.items():
+            if name in scenarioDict:
+                setattr(settings, name, valueType(scenarioDict[name]))
+        if 'outputType' in scenarioDict and 'outputTypes' not in scenarioDict:
+            outputTypesFromLegacy(settings, str(scenarioDict['outputType']), scenarioDict)
+
+        if chatStates is not None:
+            settings.chatStates = chatStates
+        elif 'chatStates' in scenarioDict:
+            settings.chatStates = [chatStateFromDict(stateDict) for stateDict in scenarioDict['chatStates']]
+        settings.pools = poolsFromDict(scenarioDict.get('pools'))
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ScenarioError("Invalid scenario: " + str(e))
+
+    validateSettings(settings)
+    return settings
+
+def settingsToDict(settings):
+    scenarioDict = {'version': SCENARIO_VERSION}
+    for name in GLOBAL_SETTING_TYPES:
+        scenarioDict[name] = getattr(settings, name)
+    if settings.pools:
+        scenarioDict['pools'] = settings.pools
+    scenarioDict['chatStates'] = [chatStateToDict(chatState) for chatState in settings.chatStates]
+    return scenarioDict
+
+######## Binary scenarios ########
+
+BINARY_SCENARIO_MAGIC = b"CHATSCN\0"
+BINARY_SCENARIO_EXTENSION = ".chatscn"
+
+# magic, version, settings size, state count, output count, messages size. Then, little-endian:
+#   settings        UTF-8 JSON of everything but the chat states' outputs and
+#                   durations, per state pools and rates go in "statePools"
+#                   and "stateRates" by state index
+#   durations       one double per state
+#   output counts   one uint32 per state
+#   probabilities   one double per output, all states one after another
+#   messages        UTF-8 text of every output, separated by NUL characters
+BINARY_HEADER_FORMAT = '<8sIIIIQ'
+BINARY_HEADER_SIZE = struct.calcsize(BINARY_HEADER_FORMAT)
+
+def readArray(typecode, data, position, count):
+    values = array(typecode)
+    values.frombytes(data[position:position + count*values.itemsize])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values, position + count*values.itemsize
+
+def scenarioFromBinary(data):
+    if len(data) < BINARY_HEADER_SIZE:
+        raise ScenarioError("Scenario is truncated or corrupt")
+    magic, version, settingsSize, stateCount, outputCount, messagesSize = struct.unpack_from(BINARY_HEADER_FORMAT, data, 0)
+    if version > SCENARIO_VERSION:
+        raise ScenarioError("Scenario version " + str(version) + " is newer than this simulator supports (" + str(SCENARIO_VERSION) + ")")
+    if len(data) != BINARY_HEADER_SIZE + settingsSize + stateCount*12 + outputCount*8 + messagesSize:
+        raise ScenarioError("Scenario is truncated or corrupt")
+
+    position = BINARY_HEADER_SIZE
+    try:
+        scenarioDict = json.loads(data[position:position + settingsSize].decode('utf-8'))
+        messages = data[len(data) - messagesSize:].decode('utf-8').split("\0") if outputCount > 0 else []
+    except ValueError as e:
+        raise ScenarioError("Scenario is corrupt: " + str(e))
+    position += settingsSize
+
+    durations, position = readArray('d', data, position, stateCount)
+    outputCounts, position = readArray('I', data, position, stateCount)
+    probabilities, position = readArray('d', data, position, outputCount)
+    if sum(outputCounts) != outputCount or len(messages) != outputCount:
+        raise ScenarioError("Scenario is corrupt: output counts don't match")
+
+    statePools = scenarioDict.get('statePools', {})
+    stateRates = scenarioDict.get('stateRates', {})
+    chatStates = []
+    start = 0
+    try:
+        for i in range(stateCount):
+            end = start + outputCounts[i]
+            outputs = list(map(ChatOutputValues, messages[start:end], probabilities[start:end]))
+            chatStates.append(ChatStateValues(outputs, durations[i], poolsFromDict(statePools.get(str(i))), rateProfileFromDict(stateRates.get(str(i)))))
+            start = end
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ScenarioError("Invalid scenario: " + str(e))
+    return settingsFromDict(scenarioDict, chatStates)
+
+def scenarioToBinary(settings):
+    scenarioDict = settingsToDict(settings)
+    chatStates = settings.chatStates
+    del scenarioDict['chatStates']
+    statePools = {str(i): chatStates[i].pools for i in range(len(chatStates)) if chatStates[i].pools}
+    if statePools:
+        scenarioDict['statePools'] = statePools
+    stateRates = {str(i): rateProfileToDict(chatStates[i].rate) for i in range(len(chatStates)) if chatStates[i].rate is not None}
+    if stateRates:
+        scenarioDict['stateRates'] = stateRates
+
+    messages = [str(output.message) for chatState in chatStates for output in chatState.outputs]
+    if any("\0" in message for message in messages):
+        raise ScenarioError("Messages containing NUL characters can only be saved as JSON")
+    durations = array('d', [chatState.duration for chatState in chatStates])
+    outputCounts = array('I', [len(chatState.outputs) for chatState in chatStates])
+    probabilities = array('d', [output.probability for chatState in chatStates for output in chatState.outputs])
+    if sys.byteorder != "little":
+        for values in (durations, outputCounts, probabilities):
+            values.byteswap()
+
+    settingsData = json.dumps(scenarioDict).encode('utf-8')
+    messagesData = "\0".join(messages).encode('utf-8')
+    header = struct.pack(BINARY_HEADER_FORMAT, BINARY_SCENARIO_MAGIC, SCENARIO_VERSION, len(settingsData),
+        len(chatStates), len(probabilities), len(messagesData))
+    return b''.join([header, settingsData, durations.tobytes(), outputCounts.tobytes(), probabilities.tobytes(), messagesData])
+
+######## Legacy settings ########
+
+# Older versions pickled [numberOfChatters, minTimeBetweenMessages,
+# maxTimeBetweenMessages, transitionDuration, outputType, tcpHost, tcpPort,
+# fileLocation, fileMaxSize, chatStates]. Only the chat state classes may be
+# unpickled, anything else in the file is refused.
+class LegacySettingsUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module in ("__main__", "ChatSimulator", "ChatEngine"):
+            if name == "ChatStateValues":
+                return ChatStateValues
+            if name == "ChatOutputValues":
+                return ChatOutputValues
+        raise pickle.UnpicklingError("Settings files can't contain " + module + "." + name)
+
+def settingsFromLegacyList(allSettings):
+    settings = ChatSettingsValues()
+    try:
+        settings.numberOfChatters = int(allSettings[0])
+        settings.minTimeBetweenMessages = float(allSettings[1])
+        settings.maxTimeBetweenMessages = float(allSettings[2])
+        settings.transitionDuration = float(allSettings[3])
+        settings.tcpHost = str(allSettings[5])
+        settings.tcpPort = int(allSettings[6])
+        outputTypesFromLegacy(settings, str(allSettings[4]), {})
+        settings.fileLocation = str(allSettings[7])
+        settings.fileMaxSize = int(allSettings[8])
+        # Rebuilt so they get any slots added since they were pickled
+        settings.chatStates = [ChatStateValues([ChatOutputValues(str(output.message), float(output.probability)) for output in chatState.outputs],
+            float(chatState.duration)) for chatState in allSettings[9]]
+    except (TypeError, ValueError, AttributeError, IndexError) as e:
+        raise ScenarioError("Invalid settings file: " + str(e))
+
+    if len(settings.chatStates) == 0:
+        raise ScenarioError("A scenario needs at least one chat state")
+    for i in range(len(settings.chatStates)):
+        validateChatState(settings.chatStates[i], i)
+    return settings
+
+######## Files ########
+
+def loadScenario(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError as e:
+        raise ScenarioError("Unable to read scenario " + str(path) + ": " + str(e))
+
+    try:
+        if data.startswith(BINARY_SCENARIO_MAGIC):
+            return scenarioFromBinary(data)
+        if data.startswith(b'\x80'):
+            try:
+                return settingsFromLegacyList(LegacySettingsUnpickler(io.BytesIO(data)).load())
+            except (pickle.UnpicklingError, EOFError) as e:
+                raise ScenarioError(str(e))
+
+        try:
+            scenarioDict = json.loads(data.decode('utf-8'))
+        except ValueError as e:
+            raise ScenarioError("not valid JSON: " + str(e))
+        if not isinstance(scenarioDict, dict):
+            raise ScenarioError("must be a JSON object")
+        return settingsFromDict(scenarioDict)
+    except ScenarioError as e:
+        raise ScenarioError("Scenario " + str(path) + ": " + str(e))
+
+# Saved in the binary form if path ends in .chatscn, as JSON otherwise
+def saveScenario(settings, path):
+    if path.lower().endswith(BINARY_SCENARIO_EXTENSION):
+        data = scenarioToBinary(settings)
+        with open(path, "wb") as f:
+            f.write(data)
+        return
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(settingsToDict(settings), f, indent=2)
@@ -0,0 +1,264 @@
+import bisect
+import math
+import random
+import time
+
+from array import array
+
+# Decides when each message goes out. Deadlines are absolute times on the
+# monotonic clock, so time spent sending or updating the UI is taken out of the
+# next wait instead of being added on top of it, and a late message is followed
+# by the next one straight away until the schedule is caught up.
+#   "Uniform" waits random.uniform(min, max) between messages like older versions
+#   "Fixed" sends exactly messagesPerSecond evenly spaced messages
+#   "Poisson" sends messagesPerSecond on average with exponential gaps
+#   "PerChatter" gives every chatter their own pace, see ChatPopulation.py
+RATE_MODES = ["Uniform", "Fixed", "Poisson", "PerChatter"]
+
+DEFAULT_RATE_MODE = "Uniform"
+DEFAULT_MESSAGES_PER_SECOND = 10.0
+
+# A chat state can set its own rate curve instead of using the global rate.
+# Rates are messages per second for the whole chat:
+#   "Constant"  rate for the whole state
+#   "Ramp"      from rate to endRate evenly over the state's duration
+#   "Burst"     jumps to peakRate and decays back towards rate, losing about
+#               two thirds of the difference every decay seconds
+#   "Step"      rate, then the rate of each [seconds into the state, rate]
+#               in steps from that time on
+# Fades between states blend the rate the same way as the messages.
+RATE_SHAPES = ["Constant", "Ramp", "Burst", "Step"]
+
+DEFAULT_BURST_DECAY = 5.0
+# A burst in the last state is followed for this many decays, then its rate is held
+BURST_SETTLE_DECAYS = 7.0
+
+# Where a curve changes it is sampled this often, with up to this many samples per state
+RATE_CURVE_STEP = 0.01
+RATE_CURVE_MAX_SAMPLES = 10000
+
+# If the generator falls further behind than this (e.g. the machine was
+# suspended) the schedule restarts from now instead of sending a huge burst
+MAX_SCHEDULE_LAG = 1.0
+
+class RateScheduler:
+    def __init__(self, mode, messagesPerSecond, minInterval, maxInterval, clock=time.monotonic):
+        if mode not in RATE_MODES:
+            raise ValueError("Unknown rate mode " + str(mode))
+        self.mode = mode
+        self.messagesPerSecond = messagesPerSecond
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.clock = clock
+
+        self.startTime = 0.0
+        self.deadline = 0.0
+        # Seconds of intervals drawn so far, see RateCurve
+        self.baseDeadline = 0.0
+        self.rateCurve = None
+        self.messageCount = 0
+        # Set by schedulers that decide who posts, None lets the generator pick
+        self.lastChatter = None
+
+    def targetRate(self):
+        if self.mode == "Uniform":
+            meanInterval = (self.minInterval + self.maxInterval) / 2.0
+            return 1.0 / meanInterval if meanInterval > 0 else float('inf')
+        return self.messagesPerSecond
+
+    # Anything slow to set up before the first message, so start() can be quick
+    def prepare(self):
+        pass
+
+    # Only schedulers that decide who posts use the ChatterPopulation
+    def setPopulation(self, population):
+        pass
+
+    # Follow rateCurve instead of the base rate, None goes back to the base rate
+    def setRateCurve(self, rateCurve):
+        self.rateCurve = rateCurve
+
+    # The base rate scaled by the rate curve at elapsed seconds into the run
+    def targetRateAt(self, elapsed):
+        if self.rateCurve is None:
+            return self.targetRate()
+        return self.targetRate() * self.rateCurve.scaleAt(elapsed)
+
+    def deadlineAt(self, baseTime):
+        if self.rateCurve is None:
+            return self.startTime + baseTime
+        return self.startTime + self.rateCurve.realTime(baseTime)
+
+    # startTime lets several schedulers share one start, it defaults to now.
+    # The first message is due offset seconds of intervals after it.
+    def start(self, startTime=None, offset=0.0):
+        self.startTime = self.clock() if startTime is None else startTime
+        self.baseDeadline = offset
+        self.deadline = self.deadlineAt(offset)
+        self.messageCount = 0
+
+    # Carries on from elapsed seconds into the run, e.g. after jumping to another
+    # chat state or changing the rate curve. The next message is due right away.
+    def resume(self, elapsed):
+        self.startTime = self.clock() - elapsed
+        self.baseDeadline = elapsed if self.rateCurve is None else self.rateCurve.baseTime(elapsed)
+        self.deadline = self.deadlineAt(self.baseDeadline)
+
+    def nextInterval(self):
+        if self.mode == "Fixed":
+            return 1.0 / self.messagesPerSecond
+        elif self.mode == "Poisson":
+            return random.expovariate(self.messagesPerSecond)
+        return random.uniform(self.minInterval, self.maxInterval)
+
+    # Seconds until the next message is due, 0 or less when it is due already
+    def timeUntilDeadline(self):
+        now = self.clock()
+        if now - self.deadline > MAX_SCHEDULE_LAG:
+            self.deadline = now
+            self.baseDeadline = now - self.startTime
+            if self.rateCurve is not None:
+                self.baseDeadline = self.rateCurve.baseTime(self.baseDeadline)
+        return self.deadline - now
+
+    # Call after each message; returns the deadline the message was due at
+    def advance(self):
+        sentDeadline = self.deadline
+        self.baseDeadline += self.nextInterval()
+        if self.rateCurve is None:
+            self.deadline = self.startTime + self.baseDeadline
+        else:
+            self.deadline = self.startTime + self.rateCurve.realTime(self.baseDeadline)
+        self.messageCount += 1
+        return sentDeadline
+
+    def elapsed(self):
+        return self.clock() - self.startTime
+
+    def achievedRate(self):
+        elapsed = self.elapsed()
+        return self.messageCount / elapsed if elapsed > 0 else 0.0
+
+######## Rate curves ########
+
+class RateProfile:
+    __slots__ = ['shape', 'rate', 'endRate', 'peakRate', 'decay', 'steps']
+    def __init__(self, shape, rate, endRate=0.0, peakRate=0.0, decay=DEFAULT_BURST_DECAY, steps=None):
+        self.shape = shape
+        self.rate = rate
+        self.endRate = endRate
+        self.peakRate = peakRate
+        self.decay = decay
+        # [(seconds into the state, rate)] sorted by time
+        self.steps = steps if steps is not None else []
+
+    # offset is seconds into a state lasting duration seconds
+    def rateAt(self, offset, duration):
+        if self.shape == "Ramp":
+            if offset >= duration:
+                return self.endRate
+            return self.rate + (self.endRate - self.rate) * offset / duration
+        elif self.shape == "Burst":
+            return self.rate + (self.peakRate - self.rate) * math.exp(-offset / self.decay)
+        elif self.shape == "Step":
+            rate = self.rate
+            for stepTime, stepRate in self.steps:
+                if offset < stepTime:
+                    break
+                rate = stepRate
+            return rate
+        return self.rate
+
+    # How long the curve keeps changing when the state never ends
+    def settleTime(self, duration):
+        if self.shape == "Burst":
+            return max(duration, self.decay * BURST_SETTLE_DECAYS)
+        elif self.shape == "Step" and self.steps:
+            return max(duration, self.steps[-1][0])
+        return duration
+
+# Maps real seconds since the start of a run to how far a scheduler drawing
+# intervals for its base rate has got, "base seconds". A scheduler adds up
+# intervals in base seconds and the curve stretches them where the rate is
+# lower and squeezes them where it is higher, so every rate mode follows the
+# curve without changing how it draws intervals.
+#
+# Stored as the times the rate changes, with the rate as a multiple of the
+# base rate from each time to the next, the last one holding forever. Runs
+# move forward, so lookups start from the previous one and are almost always
+# in the same or the next segment.
+class RateCurve:
+    __slots__ = ['times', 'baseTimes', 'scales', 'timeIndex', 'baseIndex']
+    def __init__(self, times, scales):
+        self.times = array('d', times)
+        self.scales = array('d', scales)
+        self.baseTimes = array('d', [0.0] * len(times))
+        for i in range(1, len(times)):
+            self.baseTimes[i] = self.baseTimes[i-1] + (times[i] - times[i-1]) * scales[i-1]
+        self.timeIndex = 0
+        self.baseIndex = 0
+
+    # Index of the last point at or before value, starting from the one at index
+    def findSegment(self, values, value, index):
+        count = len(values)
+        if index + 1 < count and values[index+1] <= value:
+            index += 1
+            if index + 1 < count and values[index+1] <= value:
+                index = bisect.bisect_right(values, value, index) - 1
+        elif values[index] > value and index > 0:
+            index = max(bisect.bisect_right(values, value, 0, index) - 1, 0)
+        return index
+
+    # Real seconds since the start at which the schedule reaches baseTime
+    def realTime(self, baseTime):
+        index = self.baseIndex = self.findSegment(self.baseTimes, baseTime, self.baseIndex)
+        scale = self.scales[index]
+        if scale <= 0:
+            return float('inf')
+        return self.times[index] + (baseTime - self.baseTimes[index]) / scale
+
+    def baseTime(self, realTime):
+        index = self.timeIndex = self.findSegment(self.times, realTime, self.timeIndex)
+        return self.baseTimes[index] + (realTime - self.times[index]) * self.scales[index]
+
+    # The rate at realTime as a multiple of the base rate
+    def scaleAt(self, realTime):
+        self.timeIndex = self.findSegment(self.times, realTime, self.timeIndex)
+        return self.scales[self.timeIndex]
+
+class RateCurveBuilder:
+    def __init__(self, baseRate):
+        self.baseRate = baseRate
+        self.times = []
+        self.scales = []
+
+    def add(self, time, rate):
+        scale = rate / self.baseRate
+        if self.scales and self.scales[-1] == scale:
+            return
+        if self.times and self.times[-1] >= time:
+            self.scales[-1] = scale
+            return
+        self.times.append(time)
+        self.scales.append(scale)
+
+    # rateAt(offset) is the state's own rate. The first fadeDuration seconds
+    # blend from fadeFromRate to it.
+    def addState(self, startTime, span, rateAt, isConstant, fadeDuration, fadeFromRate):
+        if isConstant and (fadeDuration <= 0 or fadeFromRate == rateAt(0.0)):
+            self.add(startTime, rateAt(0.0))
+            return
+
+        sampleCount = max(1, min(RATE_CURVE_MAX_SAMPLES, int(math.ceil(span / RATE_CURVE_STEP))))
+        step = span / sampleCount
+        for i in range(sampleCount):
+            # Each sample's rate is the one at its middle
+            offset = (i + 0.5) * step
+            rate = rateAt(offset)
+            if offset < fadeDuration:
+                rate = fadeFromRate + (rate - fadeFromRate) * offset / fadeDuration
+            self.add(startTime + i * step, rate)
+        self.add(startTime + span, rateAt(span))
+
+    def build(self):
+        return RateCurve(self.times, self.scales)
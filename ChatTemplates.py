@@ -0,0 +1,192 @@
+import itertools
+import random
+import re
+
+# Output messages can vary every time they are sent by using placeholders:
+#   {number}            a random number from 0 to 99
+#   {number:5-500}      a random number from 5 to 500
+#   {choice:a|b|c}      one of the options
+#   {pool:emotes}       one entry of the pool called emotes, from the chat
+#                       state's pools or else the scenario's
+#   {user}              a random chat user's name, e.g. for "@{user} hi", the
+#                       more a chatter talks the more they get mentioned
+#   {{ and }}           literal braces
+# Templates are compiled once when a run starts. A message without placeholders
+# stays a plain string. When a template has few enough combinations they are
+# all rendered up front and sending one is a random pick from a list, otherwise
+# it becomes a format string plus a function per placeholder and sending it is
+# one % operation.
+
+DEFAULT_NUMBER_RANGE = (0, 99)
+
+# Ranges and equally chatty chat user counts up to this size are converted to strings up front
+NUMBER_TABLE_SIZE = 10000
+USER_TABLE_SIZE = 100000
+# Templates with up to this many combinations are rendered up front
+PRERENDERED_SIZE = 4096
+
+class TemplateError(Exception):
+    pass
+
+class CompiledTemplate:
+    __slots__ = ['formatString', 'generators', 'render']
+    def __init__(self, formatString, generators, render):
+        self.formatString = formatString
+        self.generators = generators
+        self.render = render
+
+# Templates almost always have one to three placeholders, which get a render
+# function without a loop
+def createRenderFunction(formatString, generators):
+    if len(generators) == 1:
+        first = generators[0]
+        return lambda: formatString % first()
+    elif len(generators) == 2:
+        first, second = generators
+        return lambda: formatString % (first(), second())
+    elif len(generators) == 3:
+        first, second, third = generators
+        return lambda: formatString % (first(), second(), third())
+    return lambda: formatString % tuple([generator() for generator in generators])
+
+def createChoiceGenerator(options):
+    count = len(options)
+    if count == 1:
+        option = options[0]
+        return lambda: option
+    rand = random.random
+    return lambda: options[int(rand() * count)]
+
+def parseNumberRange(argument):
+    low, high = DEFAULT_NUMBER_RANGE
+    if argument:
+        try:
+            lowText, separator, highText = argument.partition("-")
+            low = int(lowText)
+            high = int(highText) if separator else low
+        except ValueError:
+            raise TemplateError("{number:" + argument + "} needs a range like {number:1-100}")
+        if high < low:
+            raise TemplateError("{number:" + argument + "} ends before it starts")
+    return low, high
+
+def createNumberGenerator(argument):
+    low, high = parseNumberRange(argument)
+    if high - low < NUMBER_TABLE_SIZE:
+        return [str(number) for number in range(low, high+1)]
+    randint = random.randint
+    return lambda: str(randint(low, high))
+
+# population is the run's ChatterPopulation
+def createUserGenerator(population):
+    if population.weights is None and len(population) <= USER_TABLE_SIZE:
+        return [population.nameAt(chatter) for chatter in range(len(population))]
+    nameAt = population.nameAt
+    return lambda: nameAt(population.pickChatter())
+
+# Raises TemplateError if the placeholder can't be filled in, returns its name and argument
+def checkPlaceholder(placeholder, pools):
+    name, separator, argument = placeholder.partition(":")
+    name = name.strip()
+
+    if name == "number":
+        parseNumberRange(argument.strip())
+    elif name == "choice":
+        if not separator:
+            raise TemplateError("{choice} needs options like {choice:a|b|c}")
+    elif name == "pool":
+        poolName = argument.strip()
+        pool = pools.get(poolName) if pools is not None else None
+        if not pool:
+            raise TemplateError("Unknown or empty pool " + poolName + " in {" + placeholder + "}")
+    elif name != "user":
+        raise TemplateError("Unknown placeholder {" + placeholder + "}")
+    return name, argument
+
+# Returns the list of values a placeholder picks from, or a function making one
+# when there are too many to list
+def createPlaceholderGenerator(placeholder, population, pools):
+    name, argument = checkPlaceholder(placeholder, pools)
+    if name == "number":
+        return createNumberGenerator(argument.strip())
+    elif name == "choice":
+        return argument.split("|")
+    elif name == "pool":
+        return [str(entry) for entry in pools[argument.strip()]]
+    return createUserGenerator(population)
+
+# Escaped braces, a placeholder, or a brace that is neither
+TEMPLATE_TOKEN = re.compile(r"\{\{|\}\}|\{([^}]*)\}|\{|\}")
+
+def raiseBraceError(brace, message):
+    if brace == "{":
+        raise TemplateError("Unclosed { in message " + message)
+    raise TemplateError("Unmatched } in message " + message + ". Use }} for a literal brace")
+
+# Returns message as a % format string and the text of each placeholder in it
+def parseTemplate(message):
+    formatParts = []
+    placeholders = []
+    position = 0
+    for match in TEMPLATE_TOKEN.finditer(message):
+        formatParts.append(message[position:match.start()].replace("%", "%%"))
+        token = match.group()
+        if token == "{{" or token == "}}":
+            formatParts.append(token[0])
+        elif match.group(1) is None:
+            raiseBraceError(token, message)
+        else:
+            placeholders.append(match.group(1))
+            formatParts.append("%s")
+        position = match.end()
+    formatParts.append(message[position:].replace("%", "%%"))
+
+    return "".join(formatParts), placeholders
+
+# Raises TemplateError where compileTemplate() would, without rendering anything.
+# Placeholders in checked are skipped and the ones checked are added to it.
+def checkTemplate(message, pools=None, checked=None):
+    if "{" not in message and "}" not in message:
+        return
+    for match in TEMPLATE_TOKEN.finditer(message):
+        placeholder = match.group(1)
+        if placeholder is None:
+            token = match.group()
+            if token == "{" or token == "}":
+                raiseBraceError(token, message)
+        elif checked is None:
+            checkPlaceholder(placeholder, pools)
+        elif placeholder not in checked:
+            checkPlaceholder(placeholder, pools)
+            checked.add(placeholder)
+
+# Returns message unchanged if it has nothing to fill in, a CompiledTemplate otherwise
+def compileTemplate(message, population, pools=None):
+    if "{" not in message and "}" not in message:
+        return message
+
+    formatString, placeholders = parseTemplate(message)
+    if not placeholders:
+        # Only escaped braces
+        return formatString % ()
+
+    generators = [createPlaceholderGenerator(placeholder, population, pools) for placeholder in placeholders]
+    combinations = 1
+    for generator in generators:
+        combinations *= len(generator) if isinstance(generator, list) else PRERENDERED_SIZE + 1
+    if combinations <= PRERENDERED_SIZE:
+        rendered = [formatString % values for values in itertools.product(*generators)]
+        return CompiledTemplate(formatString, [rendered], createChoiceGenerator(rendered))
+
+    generators = [createChoiceGenerator(generator) if isinstance(generator, list) else generator for generator in generators]
+    return CompiledTemplate(formatString, generators, createRenderFunction(formatString, generators))
+
+# A state's own pools with the scenario's filling in any it doesn't have
+def mergePools(scenarioPools, statePools):
+    if not statePools:
+        return scenarioPools
+    if not scenarioPools:
+        return statePools
+    pools = dict(scenarioPools)
+    pools.update(statePools)
+    return pools